@@ -0,0 +1,122 @@
+from array import array
+from collections import deque
+
+# Nucleotide alphabet handled by the automaton. Any other character (N, IUPAC codes, gaps)
+# cannot be part of a pattern and resets the automaton to its root state when scanned.
+ALPHABET = 'ACGT'
+RESET_CODE = len(ALPHABET)
+ALPHABET_SIZE = RESET_CODE + 1
+
+# Byte translation table mapping A/C/G/T (either case) to 0..3 and everything else to RESET_CODE
+CODE_TABLE = bytes(
+    ALPHABET.find(chr(b).upper()) if chr(b).upper() in ALPHABET else RESET_CODE
+    for b in range(256)
+)
+
+
+def encode_sequence(sequence):
+    """
+    Translates a DNA string into the automaton's byte code (0-3 for A/C/G/T, 4 otherwise).
+    """
+    return sequence.encode('ascii', 'replace').translate(CODE_TABLE)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a set of DNA patterns.
+
+    Patterns are added with an arbitrary value (several patterns may share a value and
+    the same pattern may be added with several values). Once build() has been called the
+    automaton reports every occurrence of every pattern, overlaps included, in a single
+    left-to-right pass over the scanned sequence.
+    """
+
+    def __init__(self):
+        # Trie under construction: one {code: child_state} dict per state
+        self._goto = [{}]
+        # Values attached to the patterns ending at each state, as (pattern_length, value)
+        self._outputs = [[]]
+        self._transitions = None
+        self.pattern_count = 0
+
+    def add(self, pattern, value):
+        """Adds a pattern (A/C/G/T only) to the trie, tagging its matches with value."""
+        if self._transitions is not None:
+            raise RuntimeError("Cannot add patterns after the automaton has been built.")
+
+        codes = encode_sequence(pattern)
+        if not codes or RESET_CODE in codes:
+            raise ValueError(f"Pattern '{pattern}' is empty or contains non-ACGT characters.")
+
+        state = 0
+        for code in codes:
+            next_state = self._goto[state].get(code)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][code] = next_state
+                self._goto.append({})
+                self._outputs.append([])
+            state = next_state
+
+        self._outputs[state].append((len(codes), value))
+        self.pattern_count += 1
+
+    def build(self):
+        """
+        Computes the failure links and flattens the trie into a complete transition table,
+        so scanning costs a single table lookup per base.
+        """
+        state_count = len(self._goto)
+        transitions = array('l', [0]) * (state_count * ALPHABET_SIZE)
+        fail = [0] * state_count
+
+        # Breadth-first traversal: a state's failure link is always resolved before its children
+        queue = deque()
+        for code in range(RESET_CODE):
+            child = self._goto[0].get(code)
+            if child is not None:
+                transitions[code] = child
+                queue.append(child)
+
+        while queue:
+            state = queue.popleft()
+            base = state * ALPHABET_SIZE
+            fail_base = fail[state] * ALPHABET_SIZE
+
+            # Inherit the matches of the longest proper suffix that is also a trie prefix
+            if self._outputs[fail[state]]:
+                self._outputs[state] = self._outputs[state] + self._outputs[fail[state]]
+
+            for code in range(RESET_CODE):
+                child = self._goto[state].get(code)
+                if child is not None:
+                    fail[child] = transitions[fail_base + code]
+                    transitions[base + code] = child
+                    queue.append(child)
+                else:
+                    transitions[base + code] = transitions[fail_base + code]
+            # transitions[base + RESET_CODE] stays 0: non-ACGT characters reset to the root
+
+        self._transitions = transitions
+        # Freeze outputs as tuples (None for states without matches) and release the trie
+        self._outputs = [tuple(output) if output else None for output in self._outputs]
+        self._goto = None
+        return self
+
+    def iter(self, sequence):
+        """
+        Yields (start_position, value) for every pattern occurrence in sequence,
+        ordered by end position. start_position is 0-based.
+        """
+        if self._transitions is None:
+            raise RuntimeError("The automaton must be built before scanning.")
+
+        transitions = self._transitions
+        outputs = self._outputs
+        state = 0
+        for index, code in enumerate(encode_sequence(sequence)):
+            state = transitions[state * ALPHABET_SIZE + code]
+            matched = outputs[state]
+            if matched is not None:
+                for length, value in matched:
+                    yield index - length + 1, value
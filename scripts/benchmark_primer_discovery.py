@@ -0,0 +1,392 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Directory holding the primer-discovery scripts (this file sits next to them)
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Synthetic data set sizes: genomes, contigs per genome, contig length (bp), fraction of every
+# contig covered by copies of a repeat element, number of k-mers sampled from the shared core region
+SCALES = {
+    'small': {'genomes': 4, 'contigs': 2, 'contig_length': 20000, 'repeat_fraction': 0.05, 'shared_kmers': 200},
+    'medium': {'genomes': 8, 'contigs': 4, 'contig_length': 100000, 'repeat_fraction': 0.05, 'shared_kmers': 1000},
+    'large': {'genomes': 16, 'contigs': 8, 'contig_length': 500000, 'repeat_fraction': 0.05, 'shared_kmers': 4000},
+}
+
+STAGES = ['kmer_positions', 'universal_primers', 'amplicons']
+
+KMER_LEN = 21
+PRIMER_LEN = 20
+# Length of the region shared by every genome (first contig), mutated at CORE_MUTATION_RATE per genome
+CORE_LENGTH = 6000
+CORE_MUTATION_RATE = 0.002
+REPEAT_LENGTH = 300
+# Fraction of the k-mers listed on one extra, random contig (hits outside the shared region)
+NOISE_KMER_FRACTION = 0.2
+MIN_PRODUCT_SIZE = 100
+MAX_PRODUCT_SIZE = 2000
+
+HISTORY_FIELDS = [
+    'timestamp', 'commit', 'dirty', 'host', 'python', 'scale', 'genomes', 'contigs', 'contig_length',
+    'repeat_fraction', 'shared_kmers', 'seed', 'stage', 'returncode', 'wall_s', 'peak_rss_mb',
+    'bp', 'hits', 'bp_per_s', 'hits_per_s'
+]
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+# IUPAC code covering a base and one other, used to make the benchmark primers degenerate
+DEGENERATE_CODES = {'A': 'R', 'G': 'R', 'C': 'Y', 'T': 'Y'}
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def random_sequence(rng, length):
+    return BASES[rng.integers(0, 4, length)].tobytes().decode('ascii')
+
+
+def mutate(rng, sequence, rate):
+    """Returns sequence with a fraction `rate` of its positions replaced by random bases."""
+    raw = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8).copy()
+    positions = np.flatnonzero(rng.random(len(raw)) < rate)
+    raw[positions] = BASES[rng.integers(0, 4, len(positions))]
+    return raw.tobytes().decode('ascii')
+
+
+def write_fasta(path, records, line_width=60):
+    with open(path, 'w') as f:
+        for name, sequence in records:
+            f.write(f">{name}\n")
+            for start in range(0, len(sequence), line_width):
+                f.write(sequence[start:start + line_width] + '\n')
+
+
+def generate_dataset(data_dir, genomes, contigs, contig_length, repeat_fraction, shared_kmers, seed):
+    """
+    Writes a reproducible synthetic assembly set to data_dir:
+    - fasta/<assembly>.<contig>.fasta per contig and fasta/<assembly>.fna per genome
+    - kmers.tsv (seq, contigs) listing k-mers of the shared core region, as find_kmer_positions.py expects
+    The first contig of every genome carries a mutated copy of a common core region (the source of
+    universal k-mers). Every contig gets copies of a repeat element covering repeat_fraction of it.
+    Returns a dict describing the data set (total bp, primers for the amplicon stage...).
+    """
+    rng = np.random.default_rng(seed)
+    fasta_dir = os.path.join(data_dir, 'fasta')
+    os.makedirs(fasta_dir, exist_ok=True)
+
+    core_length = min(CORE_LENGTH, contig_length // 2)
+    core = random_sequence(rng, core_length)
+    repeat = random_sequence(rng, REPEAT_LENGTH)
+    repeat_copies = int(contig_length * repeat_fraction) // REPEAT_LENGTH
+
+    contig_pairs = []
+    core_pairs = []
+    total_bp = 0
+    for genome in range(genomes):
+        assembly = f"GCF_{genome + 1:09d}.1_SYN{genome + 1}_genomic"
+        records = []
+        for contig in range(contigs):
+            contig_id = f"NZ_SYN{genome + 1:04d}{contig + 1:04d}.1"
+            sequence = list(random_sequence(rng, contig_length))
+
+            # Repeat element copies at random positions
+            for start in rng.integers(0, max(1, contig_length - REPEAT_LENGTH), repeat_copies):
+                sequence[start:start + REPEAT_LENGTH] = repeat
+
+            # Shared core region in the middle of the first contig
+            if contig == 0:
+                core_start = (contig_length - core_length) // 2
+                sequence[core_start:core_start + core_length] = mutate(rng, core, CORE_MUTATION_RATE)
+                core_pairs.append(f"{assembly}.{contig_id}")
+
+            sequence = ''.join(sequence[:contig_length])
+            write_fasta(os.path.join(fasta_dir, f"{assembly}.{contig_id}.fasta"), [(contig_id, sequence)])
+            records.append((contig_id, sequence))
+            contig_pairs.append(f"{assembly}.{contig_id}")
+            total_bp += len(sequence)
+        write_fasta(os.path.join(fasta_dir, f"{assembly}.fna"), records)
+
+    # 2. K-mers of the core region, half of them reverse complemented; some also listed on a random contig
+    starts = rng.choice(core_length - KMER_LEN, size=min(shared_kmers, core_length - KMER_LEN), replace=False)
+    kmers = set()
+    with open(os.path.join(data_dir, 'kmers.tsv'), 'w') as f:
+        f.write('seq\tcontigs\n')
+        for start in sorted(starts.tolist()):
+            kmer = core[start:start + KMER_LEN]
+            if rng.random() < 0.5:
+                kmer = reverse_complement(kmer)
+            if kmer in kmers:
+                continue
+            kmers.add(kmer)
+            pairs = list(core_pairs)
+            if rng.random() < NOISE_KMER_FRACTION:
+                pairs.append(contig_pairs[rng.integers(0, len(contig_pairs))])
+            f.write(f"{kmer}\t{','.join(pairs)}\n")
+
+    # 3. Degenerate primer pair framing a ~1 kb product inside the core region
+    product_size = min(1000, core_length - 2 * PRIMER_LEN)
+    primer_start = core[:PRIMER_LEN]
+    primer_end = core[product_size - PRIMER_LEN:product_size]
+    primer_start = DEGENERATE_CODES[primer_start[0]] + primer_start[1:]
+    primer_end = primer_end[:-1] + DEGENERATE_CODES[primer_end[-1]]
+
+    return {
+        'fasta_dir': fasta_dir,
+        'kmers_file': os.path.join(data_dir, 'kmers.tsv'),
+        'kmer_count': len(kmers),
+        'total_bp': total_bp,
+        'core_bp': core_length * genomes,
+        'primer_start': primer_start,
+        'primer_end': primer_end,
+    }
+
+
+def count_data_rows(path):
+    """Number of lines after the header of a TSV file (0 if it does not exist)."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+
+def run_stage(command, log_path):
+    """
+    Runs a stage as a child process, its output going to log_path.
+    Returns (returncode, wall_seconds, peak_rss_mb) with the peak RSS of the child from wait4.
+    """
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(log_path))
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    # Reaped by wait4: record the status so Popen does not wait for the child again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss_mb = usage.ru_maxrss / (1048576 if sys.platform == 'darwin' else 1024)
+    return process.returncode, wall, peak_rss_mb
+
+
+def stage_commands(stage, data_dir, dataset, threads):
+    """
+    Returns (command, output_file, bp, input_hits) of a stage. input_hits is None when the hits
+    are counted from the output file instead of the input.
+    """
+    python = sys.executable
+    positions_file = os.path.join(data_dir, 'kmers_positions.tsv')
+
+    if stage == 'kmer_positions':
+        command = [python, os.path.join(SCRIPTS_DIR, 'find_kmer_positions.py'), dataset['kmers_file'],
+                   dataset['fasta_dir'], '--threads', str(threads)]
+        return command, positions_file, dataset['total_bp'], None
+
+    if stage == 'universal_primers':
+        output_file = os.path.join(data_dir, 'universal_primer_pairs.tsv')
+        command = [python, os.path.join(SCRIPTS_DIR, 'find_universal_primers_from_kmers.py'),
+                   '--input_file', positions_file, '--output_file', output_file, '--fasta_dir', dataset['fasta_dir'],
+                   '--min_product_size', str(MIN_PRODUCT_SIZE), '--max_product_size', str(MAX_PRODUCT_SIZE)]
+        return command, output_file, dataset['core_bp'], count_data_rows(positions_file)
+
+    output_file = os.path.join(data_dir, 'amplicons.tsv')
+    # get_amplicons_from_primers.py appends to an existing output
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    command = [python, os.path.join(SCRIPTS_DIR, 'get_amplicons_from_primers.py'),
+               os.path.join(dataset['fasta_dir'], '*.fna'), output_file,
+               dataset['primer_start'], dataset['primer_end'], '--threads', str(threads)]
+    return command, output_file, dataset['total_bp'], None
+
+
+def git_commit():
+    """Returns (commit hash, dirty flag) of the repository holding the scripts, or ('unknown', False)."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SCRIPTS_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(status)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(history_file, tsv_file, records):
+    """Appends records to the JSON lines history and, if set, to the TSV history."""
+    with open(history_file, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    if tsv_file:
+        new_file = not os.path.exists(tsv_file) or os.path.getsize(tsv_file) == 0
+        with open(tsv_file, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=HISTORY_FIELDS, delimiter='\t', extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            writer.writerows(records)
+
+
+def print_comparison(records, history):
+    """Prints each result next to the latest earlier run of the same scale and stage from another commit."""
+    print(f"\n{'scale':<10}{'stage':<20}{'wall_s':>10}{'rss_mb':>10}{'bp/s':>14}{'hits/s':>12}  vs previous commit")
+    for record in records:
+        previous = None
+        for entry in reversed(history):
+            if (entry.get('scale') == record['scale'] and entry.get('stage') == record['stage']
+                    and entry.get('commit') != record['commit'] and entry.get('returncode') == 0):
+                previous = entry
+                break
+
+        comparison = ''
+        if record['returncode'] != 0:
+            comparison = f"FAILED (exit {record['returncode']})"
+        elif previous and previous['wall_s'] > 0:
+            speedup = previous['wall_s'] / record['wall_s'] if record['wall_s'] > 0 else float('inf')
+            comparison = (f"{speedup:.2f}x speed, RSS {record['peak_rss_mb'] - previous['peak_rss_mb']:+.1f} MB "
+                          f"({previous['commit'][:10]})")
+
+        print(f"{record['scale']:<10}{record['stage']:<20}{record['wall_s']:>10.2f}{record['peak_rss_mb']:>10.1f}"
+              f"{record['bp_per_s']:>14.0f}{record['hits_per_s']:>12.0f}  {comparison}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the primer-discovery chain (find_kmer_positions.py, "
+                    "find_universal_primers_from_kmers.py, get_amplicons_from_primers.py) on reproducible "
+                    "synthetic assemblies, recording wall time, peak RSS and throughput to a history file."
+    )
+    parser.add_argument(
+        '--scales',
+        type=str,
+        default='small',
+        help=f"Comma-separated data set sizes among {', '.join(SCALES)}, or 'custom' to use the options "
+             f"below. (default: small)"
+    )
+    parser.add_argument('--genomes', type=int, default=4, help='custom scale: number of genomes (default: 4)')
+    parser.add_argument('--contigs', type=int, default=2, help='custom scale: contigs per genome (default: 2)')
+    parser.add_argument('--contig_length', type=int, default=20000,
+                        help='custom scale: contig length in bp (default: 20000)')
+    parser.add_argument('--repeat_fraction', type=float, default=0.05,
+                        help='custom scale: fraction of each contig covered by a repeat element (default: 0.05)')
+    parser.add_argument('--shared_kmers', type=int, default=200,
+                        help='custom scale: number of k-mers sampled from the shared core region (default: 200)')
+    parser.add_argument(
+        '--stages',
+        type=str,
+        default=','.join(STAGES),
+        help=f"Comma-separated stages to run, in chain order (default: {','.join(STAGES)})"
+    )
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the synthetic data (default: 1)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='--threads passed to find_kmer_positions.py and get_amplicons_from_primers.py (default: 1)')
+    parser.add_argument(
+        '--history_file',
+        type=str,
+        default='benchmark_history.jsonl',
+        help='JSON lines history the results are appended to (default: benchmark_history.jsonl)'
+    )
+    parser.add_argument(
+        '--tsv_file',
+        type=str,
+        default=None,
+        help='Also append the results to this TSV history (default: none)'
+    )
+    parser.add_argument(
+        '--work_dir',
+        type=str,
+        default=None,
+        help='Keep the synthetic data and stage outputs in this directory (default: temporary, removed)'
+    )
+
+    args = parser.parse_args()
+
+    scale_names = [name.strip() for name in args.scales.split(',') if name.strip()]
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    for name in scale_names:
+        if name not in SCALES and name != 'custom':
+            print(f"Error: unknown scale '{name}'. Choose among {', '.join(SCALES)} or custom.")
+            sys.exit(1)
+    for stage in stages:
+        if stage not in STAGES:
+            print(f"Error: unknown stage '{stage}'. Choose among {', '.join(STAGES)}.")
+            sys.exit(1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='primer_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    commit, dirty = git_commit()
+    history = load_history(args.history_file)
+    records = []
+
+    try:
+        for name in scale_names:
+            if name == 'custom':
+                params = {'genomes': args.genomes, 'contigs': args.contigs, 'contig_length': args.contig_length,
+                          'repeat_fraction': args.repeat_fraction, 'shared_kmers': args.shared_kmers}
+            else:
+                params = SCALES[name]
+
+            # 1. Generate the synthetic data set
+            data_dir = os.path.join(work_dir, name)
+            if os.path.exists(data_dir):
+                shutil.rmtree(data_dir)
+            os.makedirs(data_dir)
+            print(f"Generating '{name}' data set: {params['genomes']} genomes x {params['contigs']} contigs x "
+                  f"{params['contig_length']} bp...")
+            dataset = generate_dataset(data_dir, seed=args.seed, **params)
+
+            # 2. Run every stage, each one reading the previous stage's output
+            for stage in stages:
+                command, output_file, bp, input_hits = stage_commands(stage, data_dir, dataset, args.threads)
+                print(f"  Running {stage}...")
+                returncode, wall, peak_rss_mb = run_stage(command, os.path.join(data_dir, f"{stage}.log"))
+                hits = input_hits if input_hits is not None else count_data_rows(output_file)
+
+                record = {
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'commit': commit,
+                    'dirty': dirty,
+                    'host': platform.node(),
+                    'python': platform.python_version(),
+                    'scale': name,
+                    'seed': args.seed,
+                    'stage': stage,
+                    'returncode': returncode,
+                    'wall_s': round(wall, 4),
+                    'peak_rss_mb': round(peak_rss_mb, 2),
+                    'bp': bp,
+                    'hits': hits,
+                    'bp_per_s': round(bp / wall, 1) if wall > 0 else 0.0,
+                    'hits_per_s': round(hits / wall, 1) if wall > 0 else 0.0,
+                }
+                record.update(params)
+                records.append(record)
+
+                if returncode != 0:
+                    print(f"  Warning: {stage} exited with code {returncode}, see {data_dir}/{stage}.log")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # 3. Record the results and compare them with the previous commit
+    append_history(args.history_file, args.tsv_file, records)
+    print_comparison(records, history)
+    print(f"\nResults appended to {args.history_file}" + (f" and {args.tsv_file}" if args.tsv_file else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+
+# One .fai record (samtools faidx layout): sequence length, byte offset of the first base
+# (uncompressed offset for bgzip files), bases per line and bytes per line (newline included)
+FaiEntry = namedtuple('FaiEntry', ['length', 'offset', 'line_bases', 'line_width'])
+
+# Magic bytes of a BGZF block: gzip member with FEXTRA set and a 'BC' extra subfield
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_HEADER_SIZE = 18
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Size of the chunks read while scanning a plain FASTA file to build its index
+SCAN_CHUNK_SIZE = 1 << 22
+
+# Number of IndexedFasta handles kept open by open_indexed_fasta (least recently used are closed)
+MAX_OPEN_FASTAS = 64
+
+
+def is_bgzip(fasta_path):
+    """
+    Returns True if the file starts with a BGZF block header.
+    Raises ValueError for a plain gzip file, which cannot be indexed.
+    """
+    with open(fasta_path, 'rb') as f:
+        header = f.read(BGZF_HEADER_SIZE)
+    if header[:4] == BGZF_MAGIC and header[12:14] == b'BC':
+        return True
+    if header[:2] == GZIP_MAGIC:
+        raise ValueError(f"{fasta_path} is gzip-compressed but not BGZF. Recompress it with bgzip.")
+    return False
+
+
+def iter_bgzf_blocks(handle):
+    """
+    Yields (compressed_offset, uncompressed_data) for every BGZF block of an open binary file.
+    """
+    compressed_offset = 0
+    while True:
+        header = handle.read(BGZF_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) < BGZF_HEADER_SIZE or header[:4] != BGZF_MAGIC or header[12:14] != b'BC':
+            raise ValueError(f"Invalid BGZF block at offset {compressed_offset}. Compress the FASTA with bgzip.")
+
+        # BSIZE (total block size - 1) is stored in the 'BC' subfield
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        payload = handle.read(block_size - BGZF_HEADER_SIZE)
+        # The last 8 bytes are the CRC32 and the uncompressed size
+        yield compressed_offset, zlib.decompress(payload[:-8], -15)
+        compressed_offset += block_size
+
+
+def _scan_fai_entries(chunks):
+    """
+    Builds the .fai entries from an iterable of raw (uncompressed) byte chunks.
+    Returns {name: FaiEntry} in file order.
+    """
+    entries = {}
+    name = None
+    length = offset = line_bases = line_width = 0
+    # Set once a sequence line shorter than line_bases has been seen (only the last may be)
+    short_line_seen = False
+    file_offset = 0
+    pending = b''
+
+    def close_record():
+        if name is not None:
+            if name in entries:
+                raise ValueError(f"Duplicate sequence name '{name}' in FASTA.")
+            entries[name] = FaiEntry(length, offset, line_bases, line_width)
+
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            width = len(line) + 1
+            if line.startswith(b'>'):
+                close_record()
+                fields = line[1:].split()
+                name = fields[0].decode() if fields else ''
+                length = line_bases = line_width = 0
+                short_line_seen = False
+                offset = file_offset + width
+            elif name is not None:
+                bases = len(line.rstrip(b'\r'))
+                if bases:
+                    if short_line_seen:
+                        raise ValueError(f"Sequence '{name}' has lines of different lengths; cannot index it.")
+                    if line_bases == 0:
+                        line_bases, line_width = bases, width
+                    elif bases != line_bases or width != line_width:
+                        if bases > line_bases or (bases == line_bases and width != line_width):
+                            raise ValueError(f"Sequence '{name}' has lines of different lengths; cannot index it.")
+                        short_line_seen = True
+                    length += bases
+                elif line_bases:
+                    short_line_seen = True
+            file_offset += width
+
+    # Last line without a trailing newline
+    if pending:
+        if pending.startswith(b'>'):
+            close_record()
+            name = pending[1:].split()[0].decode()
+            length = line_bases = line_width = 0
+            offset = file_offset + len(pending)
+        elif name is not None:
+            bases = len(pending.rstrip(b'\r'))
+            if short_line_seen or (line_bases and bases > line_bases):
+                raise ValueError(f"Sequence '{name}' has lines of different lengths; cannot index it.")
+            if line_bases == 0:
+                line_bases, line_width = bases, bases + 1
+            length += bases
+    close_record()
+
+    return entries
+
+
+def write_fai(fai_path, entries):
+    with open(fai_path, 'w') as f:
+        for name, entry in entries.items():
+            f.write(f"{name}\t{entry.length}\t{entry.offset}\t{entry.line_bases}\t{entry.line_width}\n")
+
+
+def read_fai(fai_path):
+    entries = {}
+    with open(fai_path, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 5:
+                entries[fields[0]] = FaiEntry(*(int(value) for value in fields[1:5]))
+    return entries
+
+
+def write_gzi(gzi_path, blocks):
+    """Writes a bgzip .gzi index: block count, then (compressed, uncompressed) offset pairs."""
+    # The first block (0, 0) is implicit in the samtools format
+    blocks = [block for block in blocks if block != (0, 0)]
+    with open(gzi_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(blocks)))
+        for compressed_offset, uncompressed_offset in blocks:
+            f.write(struct.pack('<QQ', compressed_offset, uncompressed_offset))
+
+
+def read_gzi(gzi_path):
+    with open(gzi_path, 'rb') as f:
+        count = struct.unpack('<Q', f.read(8))[0]
+        blocks = [struct.unpack('<QQ', f.read(16)) for _ in range(count)]
+    return [(0, 0)] + blocks
+
+
+def _index_is_fresh(index_path, fasta_path):
+    return os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(fasta_path)
+
+
+def _save_index(writer, index_path, data):
+    """Saves an index next to the FASTA (atomically), warning instead of failing on read-only storage."""
+    tmp_path = f"{index_path}.tmp.{os.getpid()}"
+    try:
+        writer(tmp_path, data)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print(f"Warning: could not save index {index_path} ({e}). It will be rebuilt next time.", file=sys.stderr)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def build_index(fasta_path):
+    """
+    Builds (or loads, if up to date) the .fai index of a FASTA file, plus the .gzi block index
+    for bgzip files. Indexes are saved next to the FASTA file.
+    Returns (entries, blocks), blocks being None for plain files.
+    """
+    fai_path = f"{fasta_path}.fai"
+    gzi_path = f"{fasta_path}.gzi"
+    bgzip = is_bgzip(fasta_path)
+
+    if _index_is_fresh(fai_path, fasta_path) and (not bgzip or _index_is_fresh(gzi_path, fasta_path)):
+        return read_fai(fai_path), read_gzi(gzi_path) if bgzip else None
+
+    print(f"Indexing {fasta_path}...", file=sys.stderr)
+    with open(fasta_path, 'rb') as f:
+        if bgzip:
+            blocks = []
+            uncompressed_offset = [0]
+
+            def block_chunks():
+                for compressed_offset, data in iter_bgzf_blocks(f):
+                    blocks.append((compressed_offset, uncompressed_offset[0]))
+                    uncompressed_offset[0] += len(data)
+                    yield data
+
+            entries = _scan_fai_entries(block_chunks())
+        else:
+            blocks = None
+            entries = _scan_fai_entries(iter(lambda: f.read(SCAN_CHUNK_SIZE), b''))
+
+    _save_index(write_fai, fai_path, entries)
+    if bgzip:
+        _save_index(write_gzi, gzi_path, blocks)
+
+    return entries, blocks
+
+
+class IndexedFasta:
+    """
+    Random access to the sequences of a (multi-)FASTA file, plain or bgzip-compressed,
+    through a faidx-style index built once and saved next to the file.
+    Plain files are memory-mapped; bgzip files are read block by block, so fetching a
+    subsequence never loads more than the blocks that cover it. fetch() is thread-safe.
+    """
+
+    def __init__(self, fasta_path):
+        self.fasta_path = fasta_path
+        self.entries, self._blocks = build_index(fasta_path)
+        self._handle = None
+        self._mmap = None
+        if self._blocks is not None:
+            self._block_starts = [uncompressed for _, uncompressed in self._blocks]
+        # Serializes opening, closing and reading the shared file handle / mapping
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        """Opens the file (and maps it, for plain files) if it is not open."""
+        if self._handle is None:
+            self._handle = open(self.fasta_path, 'rb')
+            if self._blocks is None and os.path.getsize(self.fasta_path) > 0:
+                self._mmap = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def length(self, name):
+        """Returns the length of a sequence, or None if it is not in the file."""
+        entry = self.entries.get(name)
+        return entry.length if entry else None
+
+    def _read_bgzf(self, start, size):
+        """Reads size uncompressed bytes starting at an uncompressed offset."""
+        block_index = bisect.bisect_right(self._block_starts, start) - 1
+        compressed_offset, block_start = self._blocks[block_index]
+        self._handle.seek(compressed_offset)
+
+        parts = []
+        collected = 0
+        skip = start - block_start
+        for _, data in iter_bgzf_blocks(self._handle):
+            if skip:
+                data = data[skip:]
+                skip = 0
+            parts.append(data)
+            collected += len(data)
+            if collected >= size:
+                break
+        return b''.join(parts)[:size]
+
+    def fetch(self, name, start=0, end=None):
+        """
+        Returns the uppercase subsequence [start, end) (0-based, end exclusive) of a sequence,
+        clipped to its length. Raises KeyError if the sequence is not in the file.
+        """
+        entry = self.entries[name]
+        end = entry.length if end is None else min(end, entry.length)
+        start = max(0, start)
+        if start >= end:
+            return ''
+
+        # Byte range covering the requested bases, newlines included
+        first_byte = entry.offset + (start // entry.line_bases) * entry.line_width + start % entry.line_bases
+        last_base = end - 1
+        last_byte = entry.offset + (last_base // entry.line_bases) * entry.line_width + last_base % entry.line_bases
+
+        with self._lock:
+            # A handle closed by close() (e.g. evicted from open_indexed_fasta) is reopened
+            self._open()
+            if self._mmap is not None:
+                raw = self._mmap[first_byte:last_byte + 1]
+            else:
+                raw = self._read_bgzf(first_byte, last_byte + 1 - first_byte)
+
+        return raw.replace(b'\n', b'').replace(b'\r', b'').decode('ascii').upper()
+
+    def close(self):
+        """Releases the file handle and mapping. A later fetch() reopens the file."""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+# Open IndexedFasta handles, keyed by path, least recently used first
+_OPEN_FASTAS = OrderedDict()
+_OPEN_FASTAS_LOCK = threading.Lock()
+
+
+def open_indexed_fasta(fasta_path, max_open=MAX_OPEN_FASTAS):
+    """
+    Returns a shared IndexedFasta handle for fasta_path, opening (and indexing) it on first use.
+    At most max_open handles are kept: the least recently used one is closed when a new file is
+    opened, so runs over thousands of assemblies stay under the file-descriptor limit.
+    """
+    with _OPEN_FASTAS_LOCK:
+        handle = _OPEN_FASTAS.get(fasta_path)
+        if handle is not None:
+            _OPEN_FASTAS.move_to_end(fasta_path)
+            return handle
+
+        handle = IndexedFasta(fasta_path)
+        _OPEN_FASTAS[fasta_path] = handle
+        while len(_OPEN_FASTAS) > max(1, max_open):
+            _, evicted = _OPEN_FASTAS.popitem(last=False)
+            evicted.close()
+        return handle
+
+
+def close_indexed_fastas():
+    """Closes every handle opened by open_indexed_fasta."""
+    with _OPEN_FASTAS_LOCK:
+        while _OPEN_FASTAS:
+            _, handle = _OPEN_FASTAS.popitem(last=False)
+            handle.close()
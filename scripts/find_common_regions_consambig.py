@@ -1,8 +1,11 @@
+import argparse
+import glob
+import math
+import multiprocessing
+import os
 import sys
-from collections import Counter
-import statistics
-from Bio.SeqUtils import MeltingTemp as mt
-from Bio.Seq import Seq
+import numpy as np
+from nn_tm import NN_SCALE, NN_TABLE, concentration_term, nn_parameters, salt_correction, thermo_to_tm, tm_nn_batch
 
 # --- Configuration Parameters ---
 WINDOW_SIZE = 20
@@ -16,7 +19,10 @@ RYSWKM_BASES = {'R', 'Y', 'S', 'W', 'K', 'M'}
 # Set of all valid IUPAC codes
 VALID_IUPAC_CODES = CANONICAL_BASES.union(NBDHV_BASES, RYSWKM_BASES)
 
-# IUPAC Map for manual sequence expansion (used by the new function)
+# Safety bound on the Viterbi passes of the exact Min_Tm/Max_Tm search (a few are enough)
+MAX_DINKELBACH_PASSES = 50
+
+# IUPAC Map of the bases each code expands to
 IUPAC_MAP = {
     'A': ['A'], 'T': ['T'], 'C': ['C'], 'G': ['G'],
     'R': ['A', 'G'], 'Y': ['C', 'T'], 'S': ['G', 'C'], 'W': ['A', 'T'],
@@ -27,165 +33,614 @@ IUPAC_MAP = {
 }
 
 
-def generate_all_sequences(ambiguous_seq):
-    """Recursively generates all unambiguous sequences from an ambiguous sequence."""
-    if not ambiguous_seq:
-        yield ""
-        return
+def _first_base_terms(parameters, base):
+    """(dH, dS) of the first base of an expansion: general initiation, terminal base pair, 5' T penalty."""
+    terminal_t_h, terminal_t_s = parameters.terminal_t if base == 'T' else (0, 0)
+    return (parameters.init[0] + parameters.terminal[base][0] + terminal_t_h,
+            parameters.init[1] + parameters.terminal[base][1] + terminal_t_s)
 
-    first_base = ambiguous_seq[0]
-    remaining_seq = ambiguous_seq[1:]
 
-    # We already checked for validity, so this should not fail, but handled defensively.
-    possible_bases = IUPAC_MAP.get(first_base, [first_base])
+def _last_base_terms(parameters, last_base, has_gc):
+    """(dH, dS) of the last base of an expansion: terminal base pair, 3' A penalty, G/C content."""
+    terminal_t_h, terminal_t_s = parameters.terminal_t if last_base == 'A' else (0, 0)
+    return (parameters.terminal[last_base][0] + terminal_t_h + parameters.gc_content[has_gc][0],
+            parameters.terminal[last_base][1] + terminal_t_s + parameters.gc_content[has_gc][1])
 
-    for base in possible_bases:
-        for sub_sequence in generate_all_sequences(remaining_seq):
-            yield base + sub_sequence
 
+def _best_expansion_sums(ambiguous_seq, parameters, weight):
+    """
+    Viterbi pass over the (last base, contains G/C) states: returns the (dH, dS) totals of the
+    expansion maximizing the sum of weight(dH, dS) over its nearest-neighbor terms.
+    """
+    states = {}
+    for base in IUPAC_MAP[ambiguous_seq[0]]:
+        delta_h, delta_s = _first_base_terms(parameters, base)
+        score = weight(delta_h, delta_s)
+        key = (base, base in 'GC')
+        if key not in states or score > states[key][0]:
+            states[key] = (score, delta_h, delta_s)
+
+    step_weights = {pair: weight(*terms) for pair, terms in parameters.steps.items()}
+    for code in ambiguous_seq[1:]:
+        next_states = {}
+        for (last_base, has_gc), (score, delta_h, delta_s) in states.items():
+            for base in IUPAC_MAP[code]:
+                step_h, step_s = parameters.steps[(last_base, base)]
+                candidate = score + step_weights[(last_base, base)]
+                key = (base, has_gc or base in 'GC')
+                if key not in next_states or candidate > next_states[key][0]:
+                    next_states[key] = (candidate, delta_h + step_h, delta_s + step_s)
+        states = next_states
+
+    best = None
+    for (last_base, has_gc), (score, delta_h, delta_s) in states.items():
+        end_h, end_s = _last_base_terms(parameters, last_base, has_gc)
+        candidate = score + weight(end_h, end_s)
+        if best is None or candidate > best[0]:
+            best = (candidate, delta_h + end_h, delta_s + end_s)
+    return best[1], best[2]
+
+
+def _extreme_tm(ambiguous_seq, parameters, salt_corr, highest):
+    """
+    Highest (or lowest) Tm over all expansions of an IUPAC sequence, by Dinkelbach's method.
 
-def analyze_consensus(file_path, enrichment_threshold):
+    Tm grows with r = H / (S + c), a ratio of two path sums (c being the salt and strand
+    concentration entropy terms, the denominator always negative). For a given r, the expansion
+    maximizing r * S - H (lowest: H - r * S) is found by one Viterbi pass; its own ratio is at
+    least as extreme as r, with equality only at the optimum, so a few passes reach it.
     """
-    Main analysis function using Tm_NN for stability and manual iteration for min/avg/max Tm.
+    sign = 1 if highest else -1
+    tm = thermo_to_tm(*_best_expansion_sums(ambiguous_seq, parameters, lambda delta_h, delta_s: 0), salt_corr)
+    for _ in range(MAX_DINKELBACH_PASSES):
+        ratio = (tm + 273.15) / 1000
+        next_tm = thermo_to_tm(*_best_expansion_sums(
+            ambiguous_seq, parameters, lambda delta_h, delta_s: sign * (ratio * delta_s - delta_h)
+        ), salt_corr)
+        if sign * (next_tm - tm) <= 0:
+            break
+        tm = next_tm
+    return float(tm)
+
+
+def _mean_tm(ambiguous_seq, parameters, salt_corr):
     """
-    header = ''
-    sequence = ''
+    Exact mean Tm over all expansions of an IUPAC sequence, by a dynamic program over
+    (last base, contains G/C) states holding, for each total dS, the number of expansions and
+    their total dH.
+
+    For a fixed total dS, Tm = 1000 dH / D - 273.15 (D = dS + salt_corr + concentration term) is
+    linear in dH, so the Tm of all expansions sharing a total dS sums to 1000 (their total dH) / D.
+    Sums are integers in tenths, so counts and totals stay exact.
+    """
+    steps = parameters.steps
+    states = {}
+    for base in IUPAC_MAP[ambiguous_seq[0]]:
+        delta_h, delta_s = _first_base_terms(parameters, base)
+        sums = states.setdefault((base, base in 'GC'), {})
+        count, total_h = sums.get(delta_s, (0, 0))
+        sums[delta_s] = (count + 1, total_h + delta_h)
+
+    for code in ambiguous_seq[1:]:
+        next_states = {}
+        for (last_base, has_gc), sums in states.items():
+            for base in IUPAC_MAP[code]:
+                step_h, step_s = steps[(last_base, base)]
+                next_sums = next_states.setdefault((base, has_gc or base in 'GC'), {})
+                for delta_s, (count, total_h) in sums.items():
+                    key = delta_s + step_s
+                    moved_h = total_h + count * step_h
+                    if key in next_sums:
+                        next_count, next_total_h = next_sums[key]
+                        next_sums[key] = (next_count + count, next_total_h + moved_h)
+                    else:
+                        next_sums[key] = (count, moved_h)
+        states = next_states
+
+    log_term = concentration_term()
+    expansions = 0
+    tm_terms = []
+    for (last_base, has_gc), sums in states.items():
+        end_h, end_s = _last_base_terms(parameters, last_base, has_gc)
+        for delta_s, (count, total_h) in sums.items():
+            denominator = (delta_s + end_s) / NN_SCALE + salt_corr + log_term
+            tm_terms.append(1000 * ((total_h + count * end_h) / NN_SCALE) / denominator)
+            expansions += count
+    return math.fsum(tm_terms) / expansions - 273.15
+
+
+def tm_stats_over_expansions(ambiguous_seq, nn_table=NN_TABLE):
+    """
+    Returns (min_tm, mean_tm, max_tm) of the nearest-neighbor Tm (Bio.SeqUtils.MeltingTemp.Tm_NN with
+    its default conditions) over all unambiguous expansions of an IUPAC sequence, without enumerating them.
+
+    Tm only depends on the total enthalpy and entropy of the duplex; table values have one decimal,
+    so the sums are kept exactly as integers in tenths. Min and max are exact: each is found by a
+    few Viterbi passes over the (last base, contains G/C) states (see _extreme_tm), so their cost is
+    linear in the sequence length. The mean is exact too: a dynamic program grouping expansions by total dS
+    sums the dH of the expansions sharing it (see _mean_tm), so its cost grows with the number of
+    distinct dS sums (polynomially with the count of ambiguous bases), never with the number of
+    expansions.
+    The nearest-neighbor parameters and the Tm formula are shared with nn_tm.
+    """
+    parameters = nn_parameters(nn_table)
+    salt_corr = salt_correction(len(ambiguous_seq))
+
+    min_tm = _extreme_tm(ambiguous_seq, parameters, salt_corr, highest=False)
+    max_tm = _extreme_tm(ambiguous_seq, parameters, salt_corr, highest=True)
+
+    mean_tm = _mean_tm(ambiguous_seq, parameters, salt_corr)
+    return min_tm, mean_tm, max_tm
+
+
+def byte_class_table(characters):
+    """Returns a 256-entry uint8 lookup table set to 1 for the bytes of the given characters."""
+    table = np.zeros(256, dtype=np.uint8)
+    table[list(''.join(characters).encode('ascii'))] = 1
+    return table
+
+
+# Byte -> 0/1 lookup tables for the per-window counts (canonical/ambiguity classes ignore case)
+UPPERCASE_TABLE = byte_class_table([chr(code) for code in range(ord('A'), ord('Z') + 1)])
+BASE_TABLES = {base: byte_class_table([base, base.lower()]) for base in ('A', 'T', 'C', 'G')}
+NBDHV_TABLE = byte_class_table(NBDHV_BASES | {base.lower() for base in NBDHV_BASES})
+RYSWKM_TABLE = byte_class_table(RYSWKM_BASES | {base.lower() for base in RYSWKM_BASES})
+INVALID_TABLE = 1 - byte_class_table(VALID_IUPAC_CODES | {base.lower() for base in VALID_IUPAC_CODES})
+GAP_TABLE = byte_class_table(['-'])
+
+
+def window_counts(raw, table, window_size):
+    """Number of bytes of each window of raw flagged by a lookup table, from a prefix-sum array."""
+    prefix = np.zeros(len(raw) + 1, dtype=np.int64)
+    np.cumsum(table[raw], out=prefix[1:])
+    return prefix[window_size:] - prefix[:-window_size]
+
+
+def read_consensus_records(file_path):
+    """
+    Yields (record, sequence) for every record of a consensus FASTA file, record being the header
+    line without '>' (empty for sequence lines before any header).
+    """
+    header = None
+    sequence_lines = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if header is not None or sequence_lines:
+                    yield header or '', ''.join(sequence_lines)
+                header = line[1:].strip()
+                sequence_lines = []
+            else:
+                sequence_lines.append(line)
+    if header is not None or sequence_lines:
+        yield header or '', ''.join(sequence_lines)
+
+
+# Tm column labels of windows without a numeric Tm, by status code (0 = numeric Tm); Tm error
+# types are appended as further status codes
+STATUS_LABELS = ['', 'INVALID_CHAR', 'CONTAINS_GAP', 'TM_NOT_STORED']
+STATUS_INVALID_CHAR = 1
+STATUS_CONTAINS_GAP = 2
+# Window table rows below the table's Tm floor (counts only)
+STATUS_TM_NOT_STORED = 3
+
+# Per-window count columns, in output order (TSV header name, stats/table column name)
+COUNT_COLUMNS = [
+    ('A_Count', 'a_count'), ('T_Count', 't_count'), ('C_Count', 'c_count'), ('G_Count', 'g_count'),
+    ('Upper_Count', 'upper_count'), ('NBDHV_Count', 'nbdhv_count'), ('RYSWKM_Count', 'ryswkm_count'),
+]
+TM_COLUMNS = ['min_tm', 'avg_tm', 'max_tm']
+OUTPUT_HEADER = "\t".join(['Filename', 'Record', 'Position'] + [name for name, _ in COUNT_COLUMNS]
+                          + ['Window_Sequence', 'Min_Tm', 'Avg_Tm', 'Max_Tm'])
+
+WINDOW_TABLE_FORMAT_VERSION = 2
+
+
+def window_statistics(record, sequence, window_size, enrichment_threshold, upper_threshold, tm_floor=None):
+    """
+    Per-window statistics of one consensus record, as columns over the windows passing
+    upper_threshold and the enrichment threshold: 'start' (0-based), the COUNT_COLUMNS counts,
+    'status' (index in the returned labels, 0 for a numeric Tm) and the min/avg/max nearest-neighbor
+    Tm over all expansions of the window, computed by tm_stats_over_expansions (exact min/max; the
+    mean is approximated for windows too degenerate to track exactly).
+    Per-window base counts come from prefix sums over the sequence bytes; Tm is only computed
+    for the passing windows. With tm_floor=(min_enrichment, min_upper), passing windows with fewer
+    canonical or upper-case characters keep their counts but get the TM_NOT_STORED status and no Tm.
+    Returns (stats, labels, messages, errors_logged), messages being meant for standard error.
+    """
+    labels = list(STATUS_LABELS)
+    messages = []
+    errors_logged = 0
+
+    if len(sequence) < window_size:
+        messages.append(f"Error: Sequence '{record}' is shorter than the window size ({window_size}).")
+        counts = {column: np.zeros(0, dtype=np.int64) for _, column in COUNT_COLUMNS}
+        passing_windows = np.zeros(0, dtype=np.int64)
+        invalid_counts = gap_counts = canonical_counts = np.zeros(0, dtype=np.int64)
+    else:
+        # 2. Count every character class over all windows at once (non-ASCII characters become '?',
+        # which is neither uppercase nor a valid IUPAC code, so positions are unchanged)
+        raw = np.frombuffer(sequence.encode('ascii', errors='replace'), dtype=np.uint8)
+        counts = {f"{base.lower()}_count": window_counts(raw, table, window_size) for base, table in BASE_TABLES.items()}
+        counts['upper_count'] = window_counts(raw, UPPERCASE_TABLE, window_size)
+        counts['nbdhv_count'] = window_counts(raw, NBDHV_TABLE, window_size)
+        counts['ryswkm_count'] = window_counts(raw, RYSWKM_TABLE, window_size)
+        canonical_counts = counts['a_count'] + counts['t_count'] + counts['c_count'] + counts['g_count']
+
+        # 3-4. Check thresholds: only the passing windows are kept
+        passing_windows = np.flatnonzero((counts['upper_count'] >= upper_threshold)
+                                         & (canonical_counts >= enrichment_threshold))
+        invalid_counts = window_counts(raw, INVALID_TABLE, window_size)[passing_windows]
+        gap_counts = window_counts(raw, GAP_TABLE, window_size)[passing_windows]
+        canonical_counts = canonical_counts[passing_windows]
+
+    stats = {'start': passing_windows}
+    for _, column in COUNT_COLUMNS:
+        stats[column] = counts[column][passing_windows]
+    status = np.zeros(len(passing_windows), dtype=np.int64)
+    status[invalid_counts > 0] = STATUS_INVALID_CHAR
+    status[(invalid_counts == 0) & (gap_counts > 0)] = STATUS_CONTAINS_GAP
+    if tm_floor is not None:
+        min_enrichment, min_upper = tm_floor
+        status[(canonical_counts < min_enrichment) | (stats['upper_count'] < min_upper)] = STATUS_TM_NOT_STORED
+    tms = {column: np.full(len(passing_windows), np.nan) for column in TM_COLUMNS}
+
+    # 5a. Windows of canonical bases only have a single expansion: their Tm is computed in one batch
+    unambiguous = np.flatnonzero((status == 0) & (canonical_counts == window_size))
+    unambiguous_tms = tm_nn_batch([sequence[i: i + window_size] for i in passing_windows[unambiguous].tolist()])
+    for column in TM_COLUMNS:
+        tms[column][unambiguous] = unambiguous_tms
+
+    # 5b. Tm Calculation over the expansions of ambiguous windows
+    ambiguous = np.flatnonzero((status == 0) & (canonical_counts < window_size))
+    for index, i in zip(ambiguous.tolist(), passing_windows[ambiguous].tolist()):
+        window = sequence[i: i + window_size]
+        try:
+            # Min/avg/max Tm over all expansions, without enumerating them
+            tms['min_tm'][index], tms['avg_tm'][index], tms['max_tm'][index] = \
+                tm_stats_over_expansions(window.upper())
+        except Exception as e:
+            errors_logged += 1
+            error_type = type(e).__name__
+            messages.append(f"Tm ERROR @ {record} Position {i + 1} ({window}): [{error_type}] {e}")
+            if error_type not in labels:
+                labels.append(error_type)
+            status[index] = labels.index(error_type)
+
+    stats['status'] = status
+    stats.update(tms)
+    return stats, labels, messages, errors_logged
+
+
+def format_window_rows(file_path, record, sequence, stats, labels, window_size):
+    """Returns the output TSV lines of the windows of window_statistics() columns."""
+    rows = []
+    counts = [stats[column].tolist() for _, column in COUNT_COLUMNS]
+    tms = [stats[column].tolist() for column in TM_COLUMNS]
+    for index, (i, status) in enumerate(zip(stats['start'].tolist(), stats['status'].tolist())):
+        if status:
+            tm_values = [labels[status]] * 3
+        else:
+            tm_values = [f"{values[index]:.2f}" for values in tms]
+        rows.append("\t".join([file_path, record, str(i + 1)] + [str(values[index]) for values in counts]
+                              + [sequence[i: i + window_size]] + tm_values))
+    return rows
+
+
+def analyze_record(file_path, record, sequence, enrichment_threshold, window_size=WINDOW_SIZE,
+                   upper_threshold=UPPER_THRESHOLD):
+    """
+    Analysis of one consensus record (window_statistics) formatted as output TSV lines.
+    Returns (rows, messages, errors_logged).
+    """
+    stats, labels, messages, errors_logged = window_statistics(record, sequence, window_size, enrichment_threshold,
+                                                               upper_threshold)
+    messages = [f"{file_path}: {message}" for message in messages]
+    return format_window_rows(file_path, record, sequence, stats, labels, window_size), messages, errors_logged
+
+
+def _analyze_record_task(task):
+    """Pool task: analyze_record() of one (file_path, record, sequence, enrichment_threshold, ...) task."""
+    return analyze_record(*task)
 
-    # File reading and setup
-    try:
-        with open(file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('>'):
-                    if not header:
-                        header = line[1:].strip()
-                else:
-                    sequence += line
-    except FileNotFoundError:
-        print(f"Error: File not found at {file_path}", file=sys.stderr)
-        return
-    except ImportError:
-        print("Error: Biopython is required. Please install it (e.g., pip install biopython).", file=sys.stderr)
-        return
 
-    sequence_length = len(sequence)
-    if sequence_length < WINDOW_SIZE:
-        print("Error: Sequence is shorter than the window size.", file=sys.stderr)
+def _record_statistics_task(task):
+    """
+    Pool task of the table build: window_statistics() of every window of one record for every window
+    size, with Tm only above the (min_enrichment, min_upper) floor. Returns (file_path, record,
+    sequence, {window_size: (stats, labels)}, messages, errors_logged).
+    """
+    file_path, record, sequence, tm_floor, window_sizes = task
+    statistics = {}
+    messages = []
+    errors_logged = 0
+    for window_size in window_sizes:
+        stats, labels, window_messages, window_errors = window_statistics(record, sequence, window_size, 0, 0,
+                                                                          tm_floor)
+        statistics[window_size] = (stats, labels)
+        messages.extend(f"{file_path}: {message}" for message in window_messages)
+        errors_logged += window_errors
+    return file_path, record, sequence, statistics, messages, errors_logged
+
+
+def expand_consensus_files(patterns):
+    """Expands glob patterns (kept in argument order, matches sorted); plain paths are kept as is."""
+    file_paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                print(f"Warning: No files found matching the pattern '{pattern}'.", file=sys.stderr)
+            file_paths.extend(matches)
+        else:
+            file_paths.append(pattern)
+    return file_paths
+
+
+def iter_record_tasks(file_paths, *task_arguments):
+    """Yields one (file_path, record, sequence, *task_arguments) task per record of every file, in order."""
+    for file_path in file_paths:
+        try:
+            for record, sequence in read_consensus_records(file_path):
+                yield (file_path, record, sequence) + task_arguments
+        except OSError as e:
+            print(f"Error: Cannot read {file_path}: {e}", file=sys.stderr)
+
+
+def map_records(task_function, tasks, threads):
+    """
+    Yields task_function(task) for every task, in task order. With threads > 1 tasks are
+    spread over a process pool of that size.
+    """
+    if threads <= 1:
+        yield from map(task_function, tasks)
         return
 
+    with multiprocessing.Pool(threads) as pool:
+        yield from pool.imap(task_function, tasks)
+
+
+def analyze_consensus(file_paths, enrichment_threshold, threads=1, output_file=None, window_size=WINDOW_SIZE,
+                      upper_threshold=UPPER_THRESHOLD):
+    """
+    Main analysis function: every record of every consensus FASTA file is analyzed separately
+    (analyze_record) and written to one TSV (standard output by default), in file then record order.
+    With threads > 1 records are spread over a process pool of that size; the output order is kept.
+    """
+    tasks = iter_record_tasks(file_paths, enrichment_threshold, window_size, upper_threshold)
+    records = 0
     matching_windows = 0
     errors_logged = 0
 
-    # --- Print Header Information (Modified to include Filename) ---
-    print(
-        "Filename\tPosition\tA_Count\tT_Count\tC_Count\tG_Count\tUpper_Count\tNBDHV_Count\tRYSWKM_Count\tWindow_Sequence\tMin_Tm\tAvg_Tm\tMax_Tm")
-
-    # 2. Slide the window across the sequence
-    max_i = sequence_length - WINDOW_SIZE + 1
-    for i in range(max_i):
-        position = i + 1
-        window = sequence[i: i + WINDOW_SIZE]
-
-        upper_count = 0
-        canonical_bases = []
-        nbdhv_count = 0
-        ryswkm_count = 0
-        has_gap = False
-
-        upper_window = window.upper()
-
-        # 3. Analyze the window character by character
-        for char in window:
-            if char == '-':
-                has_gap = True
-
-            if 'A' <= char <= 'Z':
-                upper_count += 1
-
-            base = char.upper()
-
-            if base in NBDHV_BASES:
-                nbdhv_count += 1
-            elif base in RYSWKM_BASES:
-                ryswkm_count += 1
-
-            if base in CANONICAL_BASES:
-                canonical_bases.append(base)
-
-        counts = Counter(canonical_bases)
-        total_canonical_count = len(canonical_bases)
-
-        # 4. Check thresholds
-        if upper_count >= UPPER_THRESHOLD:
-            if total_canonical_count >= enrichment_threshold:
-
-                # --- 5. Tm Calculation using Tm_NN ---
-                min_tm, avg_tm, max_tm = "N/A", "N/A", "N/A"
-
-                has_invalid_char = any(base not in VALID_IUPAC_CODES for base in upper_window)
-
-                if has_invalid_char:
-                    min_tm, avg_tm, max_tm = "INVALID_CHAR", "INVALID_CHAR", "INVALID_CHAR"
-                elif has_gap:
-                    min_tm, avg_tm, max_tm = "CONTAINS_GAP", "CONTAINS_GAP", "CONTAINS_GAP"
-                else:
-                    try:
-                        # Manually generate all sequences and calculate Tm for each
-                        all_sequences = list(generate_all_sequences(upper_window))
-                        tm_values = []
-
-                        for seq in all_sequences:
-                            # Use the robust, foundational Tm_NN function
-                            # Biopython's Tm_NN is the stable method for NN calculation
-                            tm_values.append(mt.Tm_NN(Seq(seq), nn_table="DNA_NN4"))
-
-                        if tm_values:
-                            min_tm = min(tm_values)
-                            max_tm = max(tm_values)
-                            avg_tm = statistics.mean(tm_values)
-
-                            min_tm = f"{min_tm:.2f}"
-                            max_tm = f"{max_tm:.2f}"
-                            avg_tm = f"{avg_tm:.2f}"
-
-                    except Exception as e:
-                        errors_logged += 1
-                        error_type = type(e).__name__
-                        print(f"Tm ERROR @ Position {position} ({window}): [{error_type}] {e}", file=sys.stderr)
-                        min_tm, avg_tm, max_tm = error_type, error_type, error_type
-
-                # 6. Print the results for the current window (Modified to include Filename)
-                print(f"{file_path}\t"
-                      f"{position}\t"
-                      f"{counts.get('A', 0)}\t"
-                      f"{counts.get('T', 0)}\t"
-                      f"{counts.get('C', 0)}\t"
-                      f"{counts.get('G', 0)}\t"
-                      f"{upper_count}\t"
-                      f"{nbdhv_count}\t"
-                      f"{ryswkm_count}\t"
-                      f"{window}\t"
-                      f"{min_tm}\t"
-                      f"{avg_tm}\t"
-                      f"{max_tm}"
-                      )
-                matching_windows += 1
+    out = open(output_file, 'w') if output_file else sys.stdout
+    try:
+        # --- Header Information ---
+        out.write(OUTPUT_HEADER + "\n")
+
+        for rows, messages, record_errors in map_records(_analyze_record_task, tasks, threads):
+            for message in messages:
+                print(message, file=sys.stderr)
+            if rows:
+                out.write('\n'.join(rows) + '\n')
+            records += 1
+            matching_windows += len(rows)
+            errors_logged += record_errors
+    finally:
+        if output_file:
+            out.close()
+
+    if output_file:
+        print(f"Analyzed {records} records from {len(file_paths)} files: {matching_windows} windows written to "
+              f"{output_file}", file=sys.stderr)
+    if errors_logged > 0:
+        print(f"## WARNING: {errors_logged} Tm errors were logged to standard error (above).", file=sys.stderr)
+
+
+def build_window_table(file_paths, table_file, window_sizes, min_enrichment=0, min_upper=0, threads=1):
+    """
+    Computes the statistics of every window for each window size once, and stores them in a
+    compressed columnar .npz table. Tm is only computed for the windows with at least min_enrichment
+    canonical bases and min_upper upper-case characters (the Tm floor, stored in the table as
+    min_enrichment / min_upper); the other windows only keep their counts (TM_NOT_STORED status).
+    Table layout:
+    - record arrays: file_values / record_file (file of each record), record_values (record names),
+      sequence_bytes + record_offsets (the concatenated record sequences, to rebuild window sequences)
+    - per window size w, columns w<w>_record, w<w>_start, the count columns, w<w>_status and the
+      Tm columns; status codes index status_values
+    Integer columns use the smallest dtype holding their values. Threshold sweeps are then answered
+    by filter_window_table without rescanning or recomputing any Tm.
+    """
+    tasks = iter_record_tasks(file_paths, (min_enrichment, min_upper), tuple(window_sizes))
+    file_values = []
+    record_file = []
+    record_values = []
+    sequences = []
+    labels = list(STATUS_LABELS)
+    columns = {window_size: {} for window_size in window_sizes}
+    errors_logged = 0
 
+    for file_path, record, sequence, statistics, messages, record_errors in map_records(_record_statistics_task,
+                                                                                        tasks, threads):
+        for message in messages:
+            print(message, file=sys.stderr)
+        errors_logged += record_errors
+        if file_path not in file_values:
+            file_values.append(file_path)
+        record_code = len(record_values)
+        record_file.append(file_values.index(file_path))
+        record_values.append(record)
+        sequences.append(sequence.encode('ascii', errors='replace'))
+
+        for window_size, (stats, record_labels) in statistics.items():
+            # Status codes are made global across records
+            for label in record_labels:
+                if label not in labels:
+                    labels.append(label)
+            status_codes = np.array([labels.index(label) for label in record_labels], dtype=np.int64)
+            window_columns = columns[window_size]
+            window_columns.setdefault('record', []).append(np.full(len(stats['start']), record_code, dtype=np.int64))
+            window_columns.setdefault('status', []).append(status_codes[stats['status']])
+            for column, values in stats.items():
+                if column != 'status':
+                    window_columns.setdefault(column, []).append(values)
+
+    arrays = {
+        'format_version': np.array(WINDOW_TABLE_FORMAT_VERSION),
+        'window_sizes': np.array(window_sizes, dtype=np.int64),
+        'min_enrichment': np.array(min_enrichment),
+        'min_upper': np.array(min_upper),
+        'status_values': np.array(labels),
+        'file_values': np.array(file_values, dtype=str),
+        'record_file': compact_integers(np.array(record_file, dtype=np.int64)),
+        'record_values': np.array(record_values, dtype=str),
+        'sequence_bytes': np.frombuffer(b''.join(sequences), dtype=np.uint8),
+        'record_offsets': np.cumsum([0] + [len(sequence) for sequence in sequences]).astype(np.int64),
+    }
+    window_count = 0
+    for window_size, window_columns in columns.items():
+        for column in ['record', 'start'] + [column for _, column in COUNT_COLUMNS] + ['status'] + TM_COLUMNS:
+            values = np.concatenate(window_columns[column]) if column in window_columns else np.zeros(0)
+            arrays[f"w{window_size}_{column}"] = values if column in TM_COLUMNS else compact_integers(values)
+        window_count += len(arrays[f"w{window_size}_start"])
+
+    np.savez_compressed(table_file, **arrays)
+    # np.savez appends .npz when missing; keep the requested name
+    if not table_file.endswith('.npz'):
+        os.replace(f"{table_file}.npz", table_file)
+
+    print(f"Stored {window_count} windows of {len(record_values)} records (window sizes "
+          f"{', '.join(str(window_size) for window_size in window_sizes)}) in {table_file}", file=sys.stderr)
     if errors_logged > 0:
         print(f"## WARNING: {errors_logged} Tm errors were logged to standard error (above).", file=sys.stderr)
 
 
-if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: python script_name.py <consensus_fasta_file> <ENRICHMENT_THRESHOLD>", file=sys.stderr)
-        sys.exit(1)
+def compact_integers(values):
+    """Returns an integer array in the smallest dtype holding all of its values."""
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return values.astype(np.uint8)
+    return values.astype(np.promote_types(np.min_scalar_type(values.min()), np.min_scalar_type(values.max())))
+
 
-    file_path = sys.argv[1]
+def filter_window_table(table_file, enrichment_threshold, output_file=None, window_size=WINDOW_SIZE,
+                        upper_threshold=UPPER_THRESHOLD):
+    """
+    Writes the same TSV as analyze_consensus for one window size and set of thresholds, filtered
+    from a table written by build_window_table instead of rescanning the consensus files.
+    Thresholds below the table's Tm floor are refused, since those windows have no stored Tm.
+    """
+    with np.load(table_file, allow_pickle=False) as archive:
+        window_sizes = archive['window_sizes'].tolist()
+        if window_size not in window_sizes:
+            print(f"Error: Window size {window_size} is not in {table_file} (window sizes: "
+                  f"{', '.join(str(size) for size in window_sizes)}).", file=sys.stderr)
+            sys.exit(1)
+        min_enrichment = int(archive['min_enrichment'])
+        # Version 1 tables computed Tm regardless of the upper-case count
+        min_upper = int(archive['min_upper']) if 'min_upper' in archive.files else 0
+        if enrichment_threshold < min_enrichment:
+            print(f"Error: {table_file} only holds the Tm of windows with at least {min_enrichment} canonical "
+                  f"bases; cannot filter with ENRICHMENT_THRESHOLD {enrichment_threshold}.", file=sys.stderr)
+            sys.exit(1)
+        if upper_threshold < min_upper:
+            print(f"Error: {table_file} only holds the Tm of windows with at least {min_upper} upper-case "
+                  f"characters; cannot filter with --upper_threshold {upper_threshold}.", file=sys.stderr)
+            sys.exit(1)
+
+        labels = archive['status_values'].tolist()
+        file_values = archive['file_values'].tolist()
+        record_file = archive['record_file'].tolist()
+        record_values = archive['record_values'].tolist()
+        sequence_bytes = archive['sequence_bytes']
+        record_offsets = archive['record_offsets'].tolist()
+        table = {
+            column: archive[f"w{window_size}_{column}"]
+            for column in ['record', 'start'] + [column for _, column in COUNT_COLUMNS] + ['status'] + TM_COLUMNS
+        }
+
+    # Same thresholds as window_statistics, applied to the stored columns
+    canonical_counts = (table['a_count'].astype(np.int64) + table['t_count'] + table['c_count']
+                        + table['g_count'])
+    selected = np.flatnonzero((table['upper_count'] >= upper_threshold) & (canonical_counts >= enrichment_threshold))
+    records = table['record'][selected]
+    # Rows are stored in record order: split the selection into one block per record
+    boundaries = np.flatnonzero(np.diff(records)) + 1
+    block_starts = [0] + boundaries.tolist()
+    block_stops = boundaries.tolist() + [len(selected)]
 
+    matching_windows = 0
+    out = open(output_file, 'w') if output_file else sys.stdout
     try:
-        enrichment_threshold = int(sys.argv[2])
-    except ValueError:
-        print("Error: ENRICHMENT_THRESHOLD must be an integer.", file=sys.stderr)
-        sys.exit(1)
+        out.write(OUTPUT_HEADER + "\n")
+        for block_start, block_stop in zip(block_starts, block_stops):
+            if block_start == block_stop:
+                continue
+            rows_index = selected[block_start:block_stop]
+            record_code = int(records[block_start])
+            sequence = sequence_bytes[record_offsets[record_code]:record_offsets[record_code + 1]].tobytes().decode(
+                'ascii')
+            stats = {column: values[rows_index] for column, values in table.items()}
+            rows = format_window_rows(file_values[record_file[record_code]], record_values[record_code], sequence,
+                                      stats, labels, window_size)
+            out.write('\n'.join(rows) + '\n')
+            matching_windows += len(rows)
+    finally:
+        if output_file:
+            out.close()
+
+    if output_file:
+        print(f"{matching_windows} windows written to {output_file}", file=sys.stderr)
+
 
-    analyze_consensus(file_path, enrichment_threshold)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Reports the windows of consensus FASTA records enriched in canonical bases, with the "
+                    "min/avg/max nearest-neighbor Tm over all expansions of their IUPAC codes."
+    )
+    parser.add_argument('consensus_files', nargs='*',
+                        help="Consensus FASTA files or glob patterns (e.g. 'core_genes/*.fasta'); "
+                             "every record is analyzed separately. Not used with --from_table.")
+    parser.add_argument('enrichment_threshold', type=int,
+                        help="Minimum number of canonical bases (A/T/C/G) in a window. With --build_table, "
+                             "the Tm floor of the table: Tm is only stored for windows reaching it (and "
+                             "--upper_threshold), and --from_table refuses lower thresholds.")
+    parser.add_argument('--window_size', type=int, default=WINDOW_SIZE,
+                        help=f"Window size (default: {WINDOW_SIZE}).")
+    parser.add_argument('--upper_threshold', type=int, default=UPPER_THRESHOLD,
+                        help=f"Minimum number of upper-case characters in a window (default: {UPPER_THRESHOLD}).")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Number of worker processes the records are spread over (default: 1).")
+    parser.add_argument('--output', default=None,
+                        help="Output TSV file (default: standard output).")
+    parser.add_argument('--build_table', default=None, metavar='TABLE_NPZ',
+                        help="Instead of the TSV, compute the statistics of every window once for each of "
+                             "--window_sizes and store them in this columnar .npz table, with the Tm of the windows "
+                             "reaching ENRICHMENT_THRESHOLD and --upper_threshold.")
+    parser.add_argument('--window_sizes', default=None,
+                        help="Comma-separated window sizes stored by --build_table (default: --window_size).")
+    parser.add_argument('--from_table', default=None, metavar='TABLE_NPZ',
+                        help="Write the TSV for --window_size, --upper_threshold and ENRICHMENT_THRESHOLD by "
+                             "filtering a table written by --build_table, without rescanning.")
+    args = parser.parse_args()
+
+    if args.from_table:
+        filter_window_table(args.from_table, args.enrichment_threshold, args.output, args.window_size,
+                            args.upper_threshold)
+        sys.exit(0)
+
+    if not args.consensus_files:
+        parser.error("at least one consensus file is required (unless --from_table is used)")
+    file_paths = expand_consensus_files(args.consensus_files)
+
+    if args.build_table:
+        try:
+            window_sizes = [int(size) for size in args.window_sizes.split(',')] if args.window_sizes \
+                else [args.window_size]
+        except ValueError:
+            parser.error("--window_sizes must be a comma-separated list of integers")
+        build_window_table(file_paths, args.build_table, window_sizes, args.enrichment_threshold,
+                           args.upper_threshold, args.threads)
+    else:
+        analyze_consensus(file_paths, args.enrichment_threshold, args.threads, args.output, args.window_size,
+                          args.upper_threshold)
@@ -3,24 +3,32 @@ from Bio import SeqIO
 from Bio.Seq import Seq
 import os
 import argparse
+import multiprocessing
 import sys
 
-# Cache for sequences to avoid re-reading files
-SEQUENCE_CACHE = {}
+from aho_corasick import ALPHABET, AhoCorasick
+from fasta_index import build_index, close_indexed_fastas, open_indexed_fasta
+from positions_io import (DEFAULT_CHUNK_SIZE, POSITION_COLUMNS, POSITION_FORMATS, open_positions_writer,
+                          positions_output_file)
 
 
-def load_fasta_sequence(fasta_base_dir, pair_clean):
+def load_fasta_sequence(fasta_base_dir, pair_clean, assembly_ext=None):
     """
-    Loads the sequence for a given contig from its FASTA file, using a global cache.
-    """
-    cache_key = f"{pair_clean}"
-    if cache_key in SEQUENCE_CACHE:
-        return SEQUENCE_CACHE[cache_key]
+    Loads the sequence for a given contig from its FASTA file.
+    Every contig is scanned once for all of its k-mers, so sequences are not cached.
 
-    # Construct the full file path
-    # Assuming file structure: fasta_base_dir/ASSEMBLY_NAME/CONTIG_NAME.fasta
-    fasta_filename = f"{pair_clean}.fasta"
-    fasta_path = os.path.join(fasta_base_dir, fasta_filename)
+    By default each contig has its own file, fasta_base_dir/<pair_clean>.fasta. When assembly_ext
+    is given, the contig is instead read from the whole-assembly FASTA
+    fasta_base_dir/<assembly><assembly_ext> (plain or bgzip) through its faidx-style index.
+    """
+    if assembly_ext:
+        _, assembly_name, contig_id = parse_contig_pair(pair_clean)
+        fasta_path = os.path.join(fasta_base_dir, f"{assembly_name}{assembly_ext}")
+    else:
+        # Construct the full file path
+        # Assuming file structure: fasta_base_dir/ASSEMBLY_NAME/CONTIG_NAME.fasta
+        fasta_filename = f"{pair_clean}.fasta"
+        fasta_path = os.path.join(fasta_base_dir, fasta_filename)
 
     if not os.path.exists(fasta_path):
         # Fallback in case the .fasta extension is missing in the file system
@@ -28,31 +36,149 @@ def load_fasta_sequence(fasta_base_dir, pair_clean):
         return None
 
     try:
-        # Read the sequence record
-        record = SeqIO.read(fasta_path, "fasta")
-        sequence = str(record.seq).upper()
+        if assembly_ext:
+            indexed_fasta = open_indexed_fasta(fasta_path)
+            if contig_id not in indexed_fasta:
+                print(f"Warning: contig {contig_id} not found in {fasta_path}. Skipping.")
+                return None
+            sequence = indexed_fasta.fetch(contig_id)
+        else:
+            # Read the sequence record
+            record = SeqIO.read(fasta_path, "fasta")
+            sequence = str(record.seq).upper()
 
-        # Store in cache
-        SEQUENCE_CACHE[cache_key] = sequence
         return sequence
     except Exception as e:
         print(f"Error reading {fasta_path}: {e}. Skipping.")
         return None
 
 
-def find_kmer_positions(tsv_file, fasta_base_dir):
+def parse_contig_pair(pair):
     """
-    Reads the TSV, finds k-mer positions, and writes the output in a row-per-match format.
+    Splits an 'assembly.contig_id' pair into (pair_clean, assembly_name, contig_id).
+    Raises ValueError when the pair cannot be split reliably.
     """
+    # The user's data indicates the format is 'assembly.contig_id',
+    # where the assembly name ends in '_genomic' and the separator is the dot immediately following it.
+    pair_clean = pair.strip()
 
-    # Define the output file based on the input TSV name
-    output_file = tsv_file.replace('.tsv', '_positions.tsv')
-    if tsv_file == output_file:
-        output_file = "kmer_positions_results.tsv"
+    # Use a known marker to reliably split the assembly from the contig ID
+    sep_marker = '_genomic.'
+    marker_index = pair_clean.find(sep_marker)
+
+    if marker_index == -1:
+        # If the standard pattern is not found, we cannot reliably split it.
+        # This handles cases where the original SQL failed to concatenate with ':'
+        raise ValueError("Cannot reliably split pair into assembly and contig using '_genomic.' as marker.")
+
+    # Assembly Name is everything up to the character before the separator dot
+    assembly_name = pair_clean[:marker_index + len('_genomic')].strip()
+    # Contig ID is everything after the separator dot (this is the desired 'contig' ID)
+    contig_id = pair_clean[marker_index + len(sep_marker):].strip()
+
+    return pair_clean, assembly_name, contig_id
+
+
+def is_acgt_kmer(kmer_seq):
+    """True if kmer_seq is a non-empty A/C/G/T sequence, i.e. searchable by the automaton."""
+    return bool(kmer_seq) and all(base in ALPHABET for base in kmer_seq)
+
+
+def build_kmer_automaton(kmer_entries):
+    """
+    Builds a single Aho-Corasick automaton holding every k-mer (strand '+') and its
+    reverse complement (strand '-'). Matches are tagged with (kmer_index, strand).
+    kmer_entries items start with (kmer_seq, rev_comp_seq, ...).
+    A palindromic k-mer is only reported on strand '-', as the original per-k-mer search did.
+    K-mers that are empty or contain non-ACGT characters are left out: they get no hits.
+    """
+    automaton = AhoCorasick()
+    for kmer_index, entry in enumerate(kmer_entries):
+        if not is_acgt_kmer(entry[0]):
+            continue
+        if entry[0] != entry[1]:
+            automaton.add(entry[0], (kmer_index, '+'))
+        automaton.add(entry[1], (kmer_index, '-'))
+    return automaton.build()
+
+
+def scan_contig(automaton, sequence, kmer_indices):
+    """
+    Scans a contig once and returns the hits of the k-mers assigned to it as a list of
+    (position, kmer_index, strand), in scan order. Positions are 0-based.
+    """
+    return [
+        (position, kmer_index, strand)
+        for position, (kmer_index, strand) in automaton.iter(sequence)
+        if kmer_index in kmer_indices
+    ]
 
-    print(f"Reading input k-mer file: {tsv_file}")
-    print(f"Using FASTA base directory: {fasta_base_dir}")
 
+def group_contig_hits(hits):
+    """Groups scan_contig() hits into {(kmer_index, strand): [ascending positions]}."""
+    grouped = {}
+    for position, kmer_index, strand in hits:
+        grouped.setdefault((kmer_index, strand), []).append(position)
+    return grouped
+
+
+# Per-process state of the pool workers, set once by _init_scan_worker
+_WORKER_STATE = {}
+
+
+def _init_scan_worker(kmer_patterns, fasta_base_dir, assembly_ext):
+    """
+    Pool initializer: each worker builds its own automaton from the (kmer, rev_comp) list,
+    which is sent once per worker instead of once per task.
+    """
+    _WORKER_STATE['automaton'] = build_kmer_automaton(kmer_patterns)
+    _WORKER_STATE['fasta_base_dir'] = fasta_base_dir
+    _WORKER_STATE['assembly_ext'] = assembly_ext
+
+
+def _scan_contig_task(task):
+    """
+    Pool task: loads one contig inside the worker (sequences never transit through the parent)
+    and returns (pair_clean, hits), hits being None when the sequence could not be loaded.
+    """
+    pair_clean, kmer_indices = task
+    sequence = load_fasta_sequence(_WORKER_STATE['fasta_base_dir'], pair_clean,
+                                   assembly_ext=_WORKER_STATE['assembly_ext'])
+    if not sequence:
+        return pair_clean, None
+    return pair_clean, scan_contig(_WORKER_STATE['automaton'], sequence, kmer_indices)
+
+
+def iter_scanned_contigs(automaton, kmer_entries, contig_kmers, fasta_base_dir, threads=1, assembly_ext=None):
+    """
+    Yields (pair_clean, hits) for every contig of contig_kmers, in contig_kmers order,
+    hits being the scan_contig() list or None if the sequence could not be loaded.
+    With threads > 1 contigs are scanned by a process pool; results are still yielded
+    in contig_kmers order so the output is deterministic.
+    """
+    if threads <= 1:
+        for pair_clean, (_, _, kmer_indices) in contig_kmers.items():
+            sequence = load_fasta_sequence(fasta_base_dir, pair_clean, assembly_ext=assembly_ext)
+            yield pair_clean, scan_contig(automaton, sequence, kmer_indices) if sequence else None
+        return
+
+    kmer_patterns = [(kmer_seq, rev_comp_seq) for kmer_seq, rev_comp_seq, _ in kmer_entries]
+    tasks = ((pair_clean, kmer_indices) for pair_clean, (_, _, kmer_indices) in contig_kmers.items())
+    # Batch small contigs together to limit inter-process overhead while keeping the pool busy
+    chunksize = max(1, min(64, len(contig_kmers) // (threads * 8)))
+
+    with multiprocessing.Pool(threads, initializer=_init_scan_worker,
+                              initargs=(kmer_patterns, fasta_base_dir, assembly_ext)) as pool:
+        yield from pool.imap(_scan_contig_task, tasks, chunksize=chunksize)
+
+
+def read_kmer_entries(tsv_file):
+    """
+    Reads the k-mer TSV and returns (kmer_entries, contig_kmers):
+    - kmer_entries: list of (kmer_seq, rev_comp_seq, [(pair_clean, assembly, contig), ...])
+    - contig_kmers: {pair_clean: (assembly, contig, {kmer_index: listing_count})} in first-seen order,
+      listing_count being how many times the k-mer lists the contig (its hits are written that many times)
+    """
     # Read the TSV file (assuming tab separation)
     try:
         df = pd.read_csv(tsv_file, sep='\t', engine='python')
@@ -67,13 +193,13 @@ def find_kmer_positions(tsv_file, fasta_base_dir):
         print("Error: Input file must contain 'seq' and 'contigs' columns.")
         sys.exit(1)
 
-    # List to store the final, flattened results (one dictionary per k-mer match)
-    results = []
-
     print(f"Processing {len(df)} k-mer entries...")
-    for index, row in df.iterrows():
-        kmer_seq = row['seq'].strip().upper()
-        contigs_list_str = row['contigs']
+
+    kmer_entries = []
+    contig_kmers = {}
+
+    for kmer_seq, contigs_list_str in zip(df['seq'], df['contigs']):
+        kmer_seq = kmer_seq.strip().upper()
 
         # Calculate the reverse complement sequence
         try:
@@ -82,75 +208,113 @@ def find_kmer_positions(tsv_file, fasta_base_dir):
             print(f"Error calculating reverse complement for {kmer_seq}: {e}. Skipping k-mer.")
             continue
 
-        # Split the comma-separated list of assembly:contig_id pairs
-        contig_pairs = contigs_list_str.split(',')
+        if not is_acgt_kmer(kmer_seq):
+            print(f"Warning: k-mer '{kmer_seq}' is empty or contains non-ACGT characters; it will have no hits.")
 
-        for pair in contig_pairs:
+        # Split the comma-separated list of assembly:contig_id pairs
+        contig_pairs = []
+        for pair in contigs_list_str.split(','):
             try:
-                # The user's data indicates the format is 'assembly.contig_id',
-                # where the assembly name ends in '_genomic' and the separator is the dot immediately following it.
-                pair_clean = pair.strip()
-
-                # Use a known marker to reliably split the assembly from the contig ID
-                sep_marker = '_genomic.'
-                marker_index = pair_clean.find(sep_marker)
-
-                if marker_index != -1:
-                    # Assembly Name is everything up to the character before the separator dot
-                    assembly_name = pair_clean[:marker_index + len('_genomic')]
-                    # Contig ID is everything after the separator dot
-                    contig_id = pair_clean[marker_index + len(sep_marker):]
-                else:
-                    # If the standard pattern is not found, we cannot reliably split it.
-                    # This handles cases where the original SQL failed to concatenate with ':'
-                    raise ValueError("Cannot reliably split pair into assembly and contig using '_genomic.' as marker.")
-
-                # Clean and strip any whitespace
-                assembly_name = assembly_name.strip()
-                file_base_name = contig_id.strip()  # This is the desired 'contig' ID
-
-                sequence = load_fasta_sequence(fasta_base_dir, pair_clean)
-
-                if sequence:
-                    # Search for both forward and reverse complement sequences
-                    search_patterns = {
-                        kmer_seq: '+',  # Search 1: Forward Strand
-                        rev_comp_seq: '-'  # Search 2: Reverse Complement Strand
-                    }
-
-                    for pattern, strand in search_patterns.items():
-                        position = 0
-                        while True:
-                            # Find the pattern starting search from the last found position + 1
-                            position = sequence.find(pattern, position)
-
-                            if position != -1:
-                                # Append a new record for this specific match
-                                # Note: 'seq' is always the original input kmer, not the matched pattern
-                                results.append({
-                                    'seq': kmer_seq,
-                                    'assembly': assembly_name,
-                                    'contig': file_base_name,
-                                    'position': position,
-                                    'strand': strand  # ADDED: The strand that matched the pattern
-                                })
-                                position += 1  # Advance search by one base
-                            else:
-                                break  # No more occurrences found
-
+                contig_pairs.append(parse_contig_pair(pair))
             except ValueError as ve:
                 print(f"Error: Could not parse pair '{pair}'. Reason: {ve}. Skipping.")
-                continue
-            except Exception as e:
-                print(f"Error processing k-mer {kmer_seq}, pair {pair}: {e}. Skipping pair.")
-                continue
 
-    # Write the final results
-    results_df = pd.DataFrame(results)
+        kmer_index = len(kmer_entries)
+        kmer_entries.append((kmer_seq, rev_comp_seq, contig_pairs))
+        for pair_clean, assembly_name, contig_id in contig_pairs:
+            listing_counts = contig_kmers.setdefault(pair_clean, (assembly_name, contig_id, {}))[2]
+            listing_counts[kmer_index] = listing_counts.get(kmer_index, 0) + 1
+
+    return kmer_entries, contig_kmers
+
+
+def find_kmer_positions(tsv_file, fasta_base_dir, contig_major=False, chunk_size=DEFAULT_CHUNK_SIZE, threads=1,
+                        assembly_ext=None, output_format='tsv'):
+    """
+    Reads the TSV, finds k-mer positions, and writes the output in a row-per-match format.
+    All k-mers are searched together: each contig is scanned once by an Aho-Corasick automaton
+    built from every k-mer and its reverse complement.
+
+    By default rows are written in input k-mer order, which requires holding every hit in memory.
+    With contig_major=True each contig is loaded once, scanned for all of its
+    k-mers, and its hits are streamed to the output in chunks of chunk_size rows, so memory no
+    longer grows with the number of hits. Rows are then ordered by contig, then by position.
+    Both orders write the same rows: a contig listed several times for a k-mer gets its hits once
+    per listing.
+
+    With threads > 1 contigs are spread over a process pool of that size; either output order
+    is preserved.
+
+    With assembly_ext set, contigs are read from whole-assembly FASTA files
+    (<assembly><assembly_ext>) through a .fai index instead of one file per contig.
 
-    # Write only the desired columns in the specified order, including 'strand'
-    final_columns = ['seq', 'assembly', 'contig', 'position', 'strand']
-    results_df.to_csv(output_file, sep='\t', index=False, columns=final_columns)
+    output_format 'npz' or 'parquet' writes a columnar, dictionary-encoded table (see positions_io.py)
+    instead of the TSV; the primer stage reads any of the three.
+    """
+    # Define the output file based on the input TSV name
+    output_file = positions_output_file(tsv_file, output_format)
+
+    print(f"Reading input k-mer file: {tsv_file}")
+    print(f"Using FASTA base directory: {fasta_base_dir}")
+
+    # 1. Parse every k-mer with its reverse complement and the contigs it is assigned to
+    kmer_entries, contig_kmers = read_kmer_entries(tsv_file)
+
+    # 2. Build one automaton for all k-mers and scan each contig once
+    try:
+        automaton = build_kmer_automaton(kmer_entries)
+    except ValueError as e:
+        print(f"Error building k-mer automaton: {e}")
+        sys.exit(1)
+
+    print(f"Scanning {len(contig_kmers)} contigs for {automaton.pattern_count} patterns...")
+
+    if assembly_ext:
+        # Build missing indexes once, up front, so pool workers only ever read them
+        assembly_names = dict.fromkeys(assembly_name for assembly_name, _, _ in contig_kmers.values())
+        for assembly_name in assembly_names:
+            fasta_path = os.path.join(fasta_base_dir, f"{assembly_name}{assembly_ext}")
+            if os.path.exists(fasta_path):
+                try:
+                    build_index(fasta_path)
+                except ValueError as e:
+                    print(f"Error indexing {fasta_path}: {e}")
+
+    contigs = iter_scanned_contigs(automaton, kmer_entries, contig_kmers, fasta_base_dir,
+                                   threads=threads, assembly_ext=assembly_ext)
+
+    if contig_major:
+        with open_positions_writer(output_file, POSITION_COLUMNS, chunk_size) as writer:
+            for pair_clean, hits in contigs:
+                if not hits:
+                    continue
+
+                assembly_name, contig_id, listing_counts = contig_kmers[pair_clean]
+                for position, kmer_index, strand in hits:
+                    # A contig listed several times for a k-mer repeats its rows, as in k-mer order
+                    for _ in range(listing_counts[kmer_index]):
+                        writer.write((kmer_entries[kmer_index][0], assembly_name, contig_id, position, strand))
+
+        close_indexed_fastas()
+        print(f"\nProcessing complete. {writer.rows_written} hits saved to {output_file}")
+        return
+
+    contig_hits = {pair_clean: group_contig_hits(hits) for pair_clean, hits in contigs if hits}
+    close_indexed_fastas()
+
+    # 3. Write the hits in k-mer order (one row per k-mer match)
+    with open_positions_writer(output_file, POSITION_COLUMNS, chunk_size) as writer:
+        for kmer_index, (kmer_seq, _, contig_pairs) in enumerate(kmer_entries):
+            for pair_clean, assembly_name, contig_id in contig_pairs:
+                hits = contig_hits.get(pair_clean)
+                if not hits:
+                    continue
+
+                # Forward strand matches first, then reverse complement matches
+                for strand in ('+', '-'):
+                    for position in hits.get((kmer_index, strand), ()):
+                        # Note: 'seq' is always the original input kmer, not the matched pattern
+                        writer.write((kmer_seq, assembly_name, contig_id, position, strand))
 
     print(f"\nProcessing complete. Results saved to {output_file}")
 
@@ -167,7 +331,47 @@ if __name__ == "__main__":
         help="Base directory containing the FASTA files (e.g., assembly_kmers21/assembly)."
     )
 
+    parser.add_argument(
+        '--contig_major',
+        action='store_true',
+        help="Scan contig by contig and stream hits to the output in chunks (bounded memory). "
+             "Rows are ordered by contig and position instead of by input k-mer; the rows themselves are the "
+             "same (a contig listed twice for a k-mer gets its hits twice in both modes)."
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of hit rows buffered before each write (default: {DEFAULT_CHUNK_SIZE})."
+    )
+
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=1,
+        help="Number of worker processes scanning contigs in parallel (default: 1)."
+    )
+
+    parser.add_argument(
+        '--assembly_ext',
+        default=None,
+        help="Read contigs from whole-assembly FASTA files named <assembly><ext> in fasta_base_dir "
+             "(plain or bgzip, e.g. '.fna' or '.fna.gz') through a .fai index saved next to each file, "
+             "instead of one <assembly>.<contig>.fasta file per contig."
+    )
+
+    parser.add_argument(
+        '--output_format',
+        choices=sorted(POSITION_FORMATS),
+        default='tsv',
+        help="Output format: 'tsv', or a columnar dictionary-encoded 'npz' (numpy) or 'parquet' (pyarrow) "
+             "table, much smaller and faster to load in find_universal_primers_from_kmers.py. Both are written "
+             "chunk by chunk; .npz is compressed, so readers load its columns whole, while .parquet is read "
+             "one row group at a time (default: tsv)."
+    )
+
     args = parser.parse_args()
 
     # Run the main function with the command-line arguments
-    find_kmer_positions(args.tsv_file, args.fasta_base_dir)
+    find_kmer_positions(args.tsv_file, args.fasta_base_dir, args.contig_major, args.chunk_size, args.threads,
+                        args.assembly_ext, args.output_format)
@@ -3,23 +3,51 @@ import sys
 import numpy as np
 import argparse
 import os
+import shutil
+import tempfile
+import heapq
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from fasta_index import close_indexed_fastas, open_indexed_fasta
+from positions_io import (
+    CATEGORICAL_COLUMNS, DEFAULT_CHUNK_SIZE, POSITION_COLUMNS, count_positions, iter_positions, read_positions
+)
 
 # NOTE: TARGET_ASSEMBLIES is now dynamically determined from the input file
-# Global cache for FASTA sequences: {assembly.contig_key: sequence_string}
-FASTA_CACHE = {}
+
+# Number of contigs loaded ahead on a thread pool while amplicons are extracted
+DEFAULT_PREFETCH = 4
+
+# Weights of the --top_n pair score (lower score is better):
+# 1 point per 10% of product size spread across assemblies, per degree C of Tm difference,
+# per 10 points of GC % difference and per 100% of distance to the target product size
+SPREAD_WEIGHT = 10.0
+TM_WEIGHT = 1.0
+GC_WEIGHT = 0.1
+LENGTH_WEIGHT = 1.0
+
+# --top_n pairs scored per batch (one batched Tm computation each), and the float slack allowed
+# when comparing a pair's Tm-free lower bound with the worst kept score
+RANK_BATCH_SIZE = 1024
+RANK_BOUND_TOLERANCE = 1e-9
+
+# Approximate memory per k-mer hit in partitioned mode (DataFrame row plus pairing working space),
+# used to size partitions from --memory_budget_mb
+PARTITION_ROW_BYTES = 512
 
 
 # --- Helper Functions for Sequence Loading ---
 
 def load_fasta_sequence(assembly, contig, fasta_dir):
     """
-    Loads a sequence from a FASTA file into the global cache.
-    Handles wrapped (multi-line) FASTA format by concatenating all lines after the header.
+    Loads a sequence from a FASTA file and returns it as an uppercase string, or None if it cannot
+    be loaded. Handles wrapped (multi-line) FASTA format by concatenating all lines after the header.
     File name convention: <assembly>.<contig>.fasta
+    Safe to call from several threads (no shared state).
     """
     key = f"{assembly}.{contig}"
-    if key in FASTA_CACHE:
-        return FASTA_CACHE[key]
 
     # Construct the file path using the assembly and contig names
     file_path = os.path.join(fasta_dir, f"{assembly}.{contig}.fasta")
@@ -30,7 +58,6 @@ def load_fasta_sequence(assembly, contig, fasta_dir):
 
             if not lines:
                 print(f"Warning: FASTA file is empty: {file_path}")
-                FASTA_CACHE[key] = None
                 return None
 
             # Skip the header line (index 0) and read all subsequent lines
@@ -41,91 +68,753 @@ def load_fasta_sequence(assembly, contig, fasta_dir):
 
             if not sequence:
                 print(f"Warning: FASTA file sequence is empty after parsing: {file_path}")
-                FASTA_CACHE[key] = None
                 return None
 
-            FASTA_CACHE[key] = sequence
             return sequence
 
     except FileNotFoundError:
         print(f"Error: FASTA file not found for {key} at {file_path}. Cannot extract sequence.")
-        FASTA_CACHE[key] = None
         return None
     except Exception as e:
         print(f"Error reading FASTA file {file_path}: {e}")
-        FASTA_CACHE[key] = None
         return None
 
 
-def get_all_assemblies_from_file(input_file):
+def load_fasta_slice(assembly, contig, start_idx, end_idx, fasta_dir, assembly_ext):
     """
-    Reads the input TSV file and returns a set of all unique assembly IDs
-    found in the 'assembly' column.
+    Fetches sequence[start_idx:end_idx] of a contig straight from its whole-assembly FASTA
+    file <assembly><assembly_ext> (plain or bgzip) through a faidx-style index, without loading
+    the whole contig. Returns (subsequence, contig_length), or (None, None) on failure.
     """
-    print(f"Reading {input_file} to dynamically determine target assemblies...")
+    file_path = os.path.join(fasta_dir, f"{assembly}{assembly_ext}")
+
     try:
-        # Load only the 'assembly' column
-        df = pd.read_csv(input_file, sep='\t', usecols=['assembly'])
-        unique_assemblies = set(df['assembly'].unique())
-        print(f"Dynamically identified {len(unique_assemblies)} unique assemblies to target.")
-        return unique_assemblies
+        indexed_fasta = open_indexed_fasta(file_path)
+    except FileNotFoundError:
+        print(f"Error: FASTA file not found for {assembly} at {file_path}. Cannot extract sequence.")
+        return None, None
     except Exception as e:
-        print(f"Error reading file to determine target assemblies: {e}")
-        return set()
+        print(f"Error reading FASTA file {file_path}: {e}")
+        return None, None
+
+    contig_length = indexed_fasta.length(contig)
+    if not contig_length:
+        print(f"Error: contig {contig} not found in {file_path}. Cannot extract sequence.")
+        return None, None
+
+    return indexed_fasta.fetch(contig, start_idx, end_idx), contig_length
 
 
-def generate_homology_map_from_file(input_file, target_assemblies):
+def load_contig_span(assembly, contig, start_idx, end_idx, fasta_dir, assembly_ext=None):
     """
-    Computes a dictionary mapping assembly IDs to a list of all unique contig IDs
-    present in that assembly within the input file, restricted to the target_assemblies.
-    This dynamically creates the TARGET_HOMOLOGY_MAP.
+    Loads the part of a contig covering [start_idx, end_idx) in one read: the whole per-contig
+    file, or just that span of the indexed whole-assembly FASTA when assembly_ext is set.
+    Returns (sequence, offset, contig_length), offset being the contig position of sequence[0],
+    or (None, 0, None) on failure.
     """
-    print(f"Generating homology map from {input_file}...")
+    if assembly_ext:
+        sequence, contig_length = load_fasta_slice(assembly, contig, start_idx, end_idx, fasta_dir, assembly_ext)
+        return sequence, max(0, start_idx), contig_length
+
+    sequence = load_fasta_sequence(assembly, contig, fasta_dir)
+    return sequence, 0, len(sequence) if sequence else None
+
+
+def extract_amplicons(results_df, kmer_len, fasta_dir, assembly_ext=None, prefetch=DEFAULT_PREFETCH):
+    """
+    Returns the amplicon sequence of every row of results_df (same order), as an object array.
+
+    Rows are grouped by (assembly, contig): each contig is read once and all of its amplicons are
+    sliced in a single pass, so no sequence cache is kept. While one contig is being sliced, the next `prefetch` contigs are
+    loaded on a thread pool, so file opens (slow on network storage) overlap with the slicing.
+    """
+    # Fwd_pos is 1-based start. Python slice start is Fwd_Start_Pos - 1.
+    # Amplicon ends at Rev_Start_Pos + kmer_len - 1. Python slice end is exclusive.
+    # A hit at position 0 gives start -1, which (as a Python slice start) counts from the contig end
+    start_idx = results_df['Fwd_Start_Pos'].to_numpy(np.int64) - 1
+    end_idx = results_df['Rev_Start_Pos'].to_numpy(np.int64) + kmer_len - 1
+    amplicons = np.empty(len(results_df), dtype=object)
+
+    groups = list(results_df.groupby(['assembly', 'contig'], observed=True, sort=False).indices.items())
+
+    def load_group(group):
+        (assembly, contig), rows = group
+        return load_contig_span(
+            assembly, contig, max(0, int(start_idx[rows].min())), int(end_idx[rows].max()), fasta_dir, assembly_ext
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, prefetch)) as executor:
+        pending = deque()
+        next_group = 0
+        while next_group < len(groups) or pending:
+            # Keep the current contig plus `prefetch` more in flight
+            while next_group < len(groups) and len(pending) <= prefetch:
+                pending.append((groups[next_group][1], executor.submit(load_group, groups[next_group])))
+                next_group += 1
+
+            rows, future = pending.popleft()
+            sequence, offset, contig_length = future.result()
+
+            if contig_length is None:
+                amplicons[rows] = "FASTA_LOAD_FAILED"
+                continue
+
+            row_starts = start_idx[rows]
+            row_starts = (np.where(row_starts < 0, row_starts + contig_length, row_starts) - offset).tolist()
+            row_ends = (end_idx[rows] - offset).tolist()
+            amplicons[rows] = [sequence[start:end] for start, end in zip(row_starts, row_ends)]
+
+            for row in rows[end_idx[rows] > contig_length]:
+                amplicons[row] = (f"ERROR_INDEX_OUT_OF_BOUNDS (Contig Len: {contig_length}, "
+                                  f"End Index: {end_idx[row]})")
+
+    if assembly_ext:
+        close_indexed_fastas()
+    return amplicons
+
+
+def load_positions_table(input_file):
+    """
+    Loads the k-mer positions table (TSV, .npz or .parquet) once, with categorical
+    seq/assembly/contig/strand columns and integer positions. The target assemblies, the
+    homology map and the pairing input are all derived from this single load.
+    Returns None if the file cannot be read.
+    """
+    print(f"Loading data from {input_file}...")
     try:
-        # Load only necessary columns for map generation
-        df = pd.read_csv(input_file, sep='\t', usecols=['assembly', 'contig'])
+        df = read_positions(input_file)
     except Exception as e:
-        print(f"Error loading file for map generation: {e}")
-        return {}
+        print(f"Error loading file: {e}")
+        return None
+    print(f"Loaded {len(df)} k-mer hits.")
+    return df
 
+
+def get_all_assemblies(positions_df):
+    """
+    Returns a set of all unique assembly IDs found in the 'assembly' column.
+    """
+    unique_assemblies = set(positions_df['assembly'].unique())
+    print(f"Dynamically identified {len(unique_assemblies)} unique assemblies to target.")
+    return unique_assemblies
+
+
+def generate_homology_map(positions_df, target_assemblies):
+    """
+    Computes a dictionary mapping assembly IDs to a list of all unique contig IDs
+    present in that assembly within the positions table, restricted to the target_assemblies.
+    This dynamically creates the TARGET_HOMOLOGY_MAP.
+    """
     # Filter to only include the assemblies we care about (which is all of them now)
-    df_filtered = df[df['assembly'].isin(target_assemblies)].copy()
+    assembly_contigs = positions_df[['assembly', 'contig']].drop_duplicates()
+    assembly_contigs = assembly_contigs[assembly_contigs['assembly'].isin(target_assemblies)]
 
     # Group by assembly and collect all unique contigs into a list
-    contig_map = df_filtered.groupby('assembly')['contig'].unique().apply(list).to_dict()
+    contig_map = assembly_contigs.groupby('assembly', observed=True)['contig'].unique().apply(list).to_dict()
 
     print(f"Map generated for {len(contig_map)} assemblies.")
     return contig_map
 
 
-# --- Main Analysis Function ---
+# --- Pairing ---
 
-def find_universal_primers(input_file, output_file, min_product_size, max_product_size, fasta_dir, target_homology_map):
+def join_fwd_rev_hits(fwd_kmers_df, rev_kmers_df, kmer_len, min_product_size, max_product_size):
     """
-    Analyzes the k-mer position data to find universal primer pairs and extracts the amplicon sequence.
-    Refactored to use DataFrame merges for efficiency, following the logic:
-    1. Find all valid amplicons (Fwd(+) < Rev(-) on same contig, within size constraints)
-    2. Filter these amplicons to find pairs that are universal across ALL assemblies.
+    Sorted sweep (range) join of forward and reverse k-mer hits.
+
+    Reverse hits are sorted by (contig, position); for each forward hit at position F, a pair of
+    binary searches selects the reverse hits R of the same contig with F < R and
+    min_product_size <= R - F + kmer_len <= max_product_size. Memory therefore scales with the
+    number of valid amplicons rather than with the Fwd x Rev product of each contig.
+
+    Self pairs (Fwd_Kmer == Rev_Kmer) are dropped. Rows come out in the order an inner merge on
+    (assembly, contig) followed by filtering would produce them, with the columns
+    Fwd_Kmer, assembly, contig, Fwd_Start_Pos, Rev_Kmer, Rev_Start_Pos, Calculated_Size,
+    indexed by the index label of their forward hit.
+    """
+    columns = ['Fwd_Kmer', 'assembly', 'contig', 'Fwd_Start_Pos', 'Rev_Kmer', 'Rev_Start_Pos', 'Calculated_Size']
+    if fwd_kmers_df.empty or rev_kmers_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    fwd_count = len(fwd_kmers_df)
+
+    # Shared integer id per (assembly, contig) and per k-mer sequence for both sides
+    contig_keys = pd.concat(
+        [fwd_kmers_df[['assembly', 'contig']], rev_kmers_df[['assembly', 'contig']]], ignore_index=True
+    )
+    group_ids = contig_keys.groupby(['assembly', 'contig'], observed=True, sort=False).ngroup().to_numpy(np.int64)
+    fwd_group, rev_group = group_ids[:fwd_count], group_ids[fwd_count:]
+
+    kmer_ids, _ = pd.factorize(pd.concat([fwd_kmers_df['Fwd_Kmer'], rev_kmers_df['Rev_Kmer']], ignore_index=True)
+                               .astype(object))
+    fwd_kmer_ids, rev_kmer_ids = kmer_ids[:fwd_count], kmer_ids[fwd_count:]
+
+    fwd_pos = fwd_kmers_df['Fwd_Start_Pos'].to_numpy(np.int64)
+    rev_pos = rev_kmers_df['Rev_Start_Pos'].to_numpy(np.int64)
+
+    # Reverse hits sorted on a single (contig, position) key
+    stride = int(max(fwd_pos.max(), rev_pos.max())) + 1
+    rev_order = np.lexsort((rev_pos, rev_group))
+    rev_keys = rev_group[rev_order] * stride + rev_pos[rev_order]
+
+    # Allowed Rev_Start_Pos window of every forward hit, clipped to its own contig
+    window_low = np.minimum(np.maximum(fwd_pos + 1, fwd_pos + min_product_size - kmer_len), stride)
+    window_high = np.minimum(fwd_pos + max_product_size - kmer_len, stride - 1)
+    first = np.searchsorted(rev_keys, fwd_group * stride + window_low, side='left')
+    last = np.searchsorted(rev_keys, fwd_group * stride + window_high, side='right')
+    counts = np.maximum(last - first, 0)
+
+    # Expand the [first, last) ranges into (forward row, reverse row) pairs
+    total = int(counts.sum())
+    fwd_rows = np.repeat(np.arange(fwd_count), counts)
+    range_starts = np.repeat(first - (np.cumsum(counts) - counts), counts)
+    rev_rows = rev_order[range_starts + np.arange(total)]
+
+    # Filter out cases where the kmer is paired with itself
+    keep = fwd_kmer_ids[fwd_rows] != rev_kmer_ids[rev_rows]
+    fwd_rows, rev_rows = fwd_rows[keep], rev_rows[keep]
+
+    # Same row order as an inner merge: forward rows in input order, then reverse rows in input order
+    order = np.lexsort((rev_rows, fwd_rows))
+    fwd_rows, rev_rows = fwd_rows[order], rev_rows[order]
+
+    fwd_part = fwd_kmers_df.iloc[fwd_rows]
+    rev_part = rev_kmers_df.iloc[rev_rows]
+    valid_amplicons_df = pd.DataFrame({
+        'Fwd_Kmer': fwd_part['Fwd_Kmer'].array,
+        'assembly': fwd_part['assembly'].array,
+        'contig': fwd_part['contig'].array,
+        'Fwd_Start_Pos': fwd_part['Fwd_Start_Pos'].array,
+        'Rev_Kmer': rev_part['Rev_Kmer'].array,
+        'Rev_Start_Pos': rev_part['Rev_Start_Pos'].array,
+    }, index=fwd_part.index)
+    valid_amplicons_df['Calculated_Size'] = (
+        valid_amplicons_df['Rev_Start_Pos'] - valid_amplicons_df['Fwd_Start_Pos'] + kmer_len
+    )
+    return valid_amplicons_df
+
+
+# --- Universality Bitsets ---
+
+def assembly_bitsets(group_ids, assembly_ids, group_count, assembly_count):
+    """
+    Builds one assembly-membership bitset per group: row g has bit a set when some row with
+    group_ids == g has assembly_ids == a. Bitsets are stored as (group_count, words) uint64 arrays.
+    """
+    word_count = max(1, (assembly_count + 63) // 64)
+    bitsets = np.zeros((group_count, word_count), dtype=np.uint64)
+
+    # Deduplicate (group, assembly) first so the unbuffered bitwise_or.at only sees distinct pairs
+    memberships = np.unique(np.asarray(group_ids, dtype=np.int64) * assembly_count + np.asarray(assembly_ids))
+    groups, assemblies = np.divmod(memberships, assembly_count)
+    np.bitwise_or.at(
+        bitsets,
+        (groups, assemblies // 64),
+        np.left_shift(np.uint64(1), (assemblies % 64).astype(np.uint64))
+    )
+    return bitsets
+
+
+def bitset_popcount(bitsets):
+    """Returns the number of set bits of each bitset row."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bitsets).sum(axis=1, dtype=np.int64)
+    return np.unpackbits(bitsets.view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+
+
+def drop_non_universal_kmers(kmers_df, kmer_column, target_assemblies):
+    """
+    Universality pre-filter: keeps only the hits of k-mers that are present (on this strand)
+    in every target assembly, since any other k-mer can never be part of a universal pair.
+    """
+    if kmers_df.empty:
+        return kmers_df
+
+    kmer_ids, kmer_values = pd.factorize(kmers_df[kmer_column])
+    assembly_ids = pd.Categorical(kmers_df['assembly'], categories=sorted(target_assemblies)).codes
+    bitsets = assembly_bitsets(kmer_ids, assembly_ids, len(kmer_values), len(target_assemblies))
+    universal_kmers = bitset_popcount(bitsets) == len(target_assemblies)
+    return kmers_df[universal_kmers[kmer_ids]]
+
+
+def universal_pair_mask(amplicons_df, target_assemblies):
+    """
+    Returns (row_mask, universal_pair_count): row_mask flags the amplicons whose (Fwd_Kmer, Rev_Kmer)
+    pair yields a valid product in every target assembly, tested as a popcount of per-pair bitsets.
+    """
+    fwd_ids, fwd_values = pd.factorize(amplicons_df['Fwd_Kmer'])
+    rev_ids, _ = pd.factorize(amplicons_df['Rev_Kmer'])
+    pair_ids, pair_values = pd.factorize(fwd_ids.astype(np.int64) * (rev_ids.max() + 1) + rev_ids)
+
+    assembly_ids = pd.Categorical(amplicons_df['assembly'], categories=sorted(target_assemblies)).codes
+    bitsets = assembly_bitsets(pair_ids, assembly_ids, len(pair_values), len(target_assemblies))
+    universal_pairs = bitset_popcount(bitsets) == len(target_assemblies)
+    return universal_pairs[pair_ids], int(universal_pairs.sum())
+
+
+# --- Top-N Ranking ---
+
+def primer_gc_percent(kmer):
+    """GC % of a primer k-mer, rounded to 2 decimals."""
+    return round(100.0 * (kmer.count('G') + kmer.count('C')) / len(kmer), 2)
+
+
+def primer_melting_temperatures(kmers):
+    """
+    Returns the Tm of primer k-mers (rounded to 2 decimals), using the batched nearest neighbor
+    engine of nn_tm.py with the DNA_NN4 table, as in get_amplicons_from_primers.py (requires Biopython).
     """
-    print(f"Loading data from {input_file}...")
     try:
-        df = pd.read_csv(input_file, sep='\t')
+        from nn_tm import melting_temperatures
+    except ImportError as e:
+        print(f"Error: --top_n ranking requires Biopython to compute primer Tm ({e}).")
+        sys.exit(1)
+    return [round(tm, 2) for tm in melting_temperatures(kmers)]
+
+
+def score_primer_pair(size_avg, size_min, size_max, target_product_size, fwd_tm, rev_tm, fwd_gc, rev_gc):
+    """
+    Scores a universal primer pair (lower is better) as a weighted sum of:
+    the relative product size spread across assemblies, the Tm and GC % differences between
+    the two primers, and the relative distance of the average product size to the target size.
+    """
+    score = (
+        SPREAD_WEIGHT * (size_max - size_min) / size_avg
+        + TM_WEIGHT * abs(fwd_tm - rev_tm)
+        + GC_WEIGHT * abs(fwd_gc - rev_gc)
+        + LENGTH_WEIGHT * abs(size_avg - target_product_size) / target_product_size
+    )
+    return round(score, 4)
+
+
+def rank_primer_pairs(metrics, top_n, target_product_size):
+    """
+    Keeps the top_n best scoring pairs of a metrics DataFrame (Fwd_Kmer, Rev_Kmer, Product_Size_Avg,
+    Product_Size_Min, Product_Size_Max) in a bounded heap. Ties keep the earliest pair.
+
+    The score without its Tm term is a lower bound of the full score, and is cheap to compute for
+    every pair at once. Pairs are visited by increasing lower bound, RANK_BATCH_SIZE at a time, and
+    the primer Tm (the costly part) is only computed for the batches that can still enter the heap.
+    Returns (ranking, scored_count): a DataFrame of the kept pairs, best first, with Rank, Score,
+    Tm and GC % columns, and the number of pairs whose full score was computed.
+    """
+    fwd_kmers = metrics['Fwd_Kmer'].astype(str).tolist()
+    rev_kmers = metrics['Rev_Kmer'].astype(str).tolist()
+    size_avg = metrics['Product_Size_Avg'].tolist()
+    size_min = metrics['Product_Size_Min'].tolist()
+    size_max = metrics['Product_Size_Max'].tolist()
+
+    gc_cache = {kmer: primer_gc_percent(kmer) for kmer in set(fwd_kmers) | set(rev_kmers)}
+    fwd_gc = [gc_cache[kmer] for kmer in fwd_kmers]
+    rev_gc = [gc_cache[kmer] for kmer in rev_kmers]
+
+    avg = np.array(size_avg, dtype=np.float64)
+    lower_bounds = (
+        SPREAD_WEIGHT * (np.array(size_max, dtype=np.float64) - np.array(size_min, dtype=np.float64)) / avg
+        + GC_WEIGHT * np.abs(np.array(fwd_gc) - np.array(rev_gc))
+        + LENGTH_WEIGHT * np.abs(avg - target_product_size) / target_product_size
+    )
+    visit_order = np.argsort(lower_bounds, kind='stable')
+
+    heap = []
+    tm_cache = {}
+    scored_count = 0
+    for batch_start in range(0, len(visit_order), RANK_BATCH_SIZE):
+        batch = visit_order[batch_start:batch_start + RANK_BATCH_SIZE]
+        # Pairs are visited by increasing lower bound: once it exceeds the worst kept score, stop
+        if len(heap) == top_n:
+            batch = batch[lower_bounds[batch] <= -heap[0][0] + RANK_BOUND_TOLERANCE]
+            if not len(batch):
+                break
+
+        missing = list(dict.fromkeys(
+            kmer for row in batch.tolist() for kmer in (fwd_kmers[row], rev_kmers[row]) if kmer not in tm_cache
+        ))
+        tm_cache.update(zip(missing, primer_melting_temperatures(missing)))
+
+        for row in batch.tolist():
+            if len(heap) == top_n and lower_bounds[row] > -heap[0][0] + RANK_BOUND_TOLERANCE:
+                break
+            fwd_kmer, rev_kmer = fwd_kmers[row], rev_kmers[row]
+            fwd_tm, rev_tm = tm_cache[fwd_kmer], tm_cache[rev_kmer]
+            score = score_primer_pair(size_avg[row], size_min[row], size_max[row], target_product_size,
+                                      fwd_tm, rev_tm, fwd_gc[row], rev_gc[row])
+            scored_count += 1
+            # Min-heap whose root is the worst kept pair (highest score, latest seen)
+            entry = (-score, -row, fwd_kmer, rev_kmer, fwd_tm, rev_tm, fwd_gc[row], rev_gc[row])
+            if len(heap) < top_n:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    ranked = sorted(heap, reverse=True)
+    ranking = pd.DataFrame({
+        'Fwd_Kmer': [entry[2] for entry in ranked],
+        'Rev_Kmer': [entry[3] for entry in ranked],
+        'Rank': np.arange(1, len(ranked) + 1),
+        'Score': [-entry[0] for entry in ranked],
+        'Fwd_Tm': [entry[4] for entry in ranked],
+        'Rev_Tm': [entry[5] for entry in ranked],
+        'Fwd_GC': [entry[6] for entry in ranked],
+        'Rev_GC': [entry[7] for entry in ranked],
+    })
+    return ranking, scored_count
+
+
+def select_top_pairs(metrics, top_n, target_product_size):
+    """
+    Ranks the universal pairs of a metrics DataFrame and returns (top_metrics, ranking),
+    both restricted to the top_n pairs.
+    """
+    print(f"Ranking {len(metrics)} universal primer pairs, keeping the top {top_n}...")
+    ranking, scored_count = rank_primer_pairs(metrics, top_n, target_product_size)
+    print(f"Scored {scored_count} of {len(metrics)} pairs in full; the others could not reach the top {top_n}.")
+    top_pairs = pd.MultiIndex.from_frame(ranking[['Fwd_Kmer', 'Rev_Kmer']])
+    is_top = pd.MultiIndex.from_frame(metrics[['Fwd_Kmer', 'Rev_Kmer']].astype(str)).isin(top_pairs)
+    return metrics[is_top], ranking
+
+
+# --- Partitioned (Out-of-Core) Mode ---
+
+def partition_positions(input_file, work_dir, partition_count, chunk_rows):
+    """
+    Streams the positions table once and splits it on disk into partition_count TSV files by a
+    hash of (assembly, contig), so every contig lands whole in a single partition. Each row keeps
+    its row number in the input ('row' column) so the final output order can be restored.
+
+    While streaming, the assemblies hit by every k-mer are accumulated per strand as integer
+    bitsets for the universality pre-filter.
+    Returns (partition_files, assembly_names, strand_kmer_bits, kmer_len, row_count).
+    """
+    partition_files = [os.path.join(work_dir, f"partition_{index:04d}.tsv") for index in range(partition_count)]
+    handles = [open(path, 'w', newline='') for path in partition_files]
+    for handle in handles:
+        handle.write('\t'.join(['row'] + POSITION_COLUMNS) + '\n')
+
+    assembly_index = {}
+    strand_kmer_bits = {'+': {}, '-': {}}
+    contig_partitions = {}
+    kmer_len = 0
+    row_count = 0
+
+    try:
+        for chunk in iter_positions(input_file, chunk_rows):
+            row_count += len(chunk)
+            chunk = chunk.astype({column: str for column in CATEGORICAL_COLUMNS})
+
+            # Assemblies get their bit in order of first appearance
+            for assembly in chunk['assembly'].unique():
+                assembly_index.setdefault(assembly, len(assembly_index))
+
+            if not kmer_len:
+                fwd_seqs = chunk.loc[chunk['strand'] == '+', 'seq']
+                kmer_len = len(fwd_seqs.iloc[0]) if not fwd_seqs.empty else 0
+
+            # Assembly bitset of every k-mer, per strand
+            for seq, strand, assembly in chunk[['seq', 'strand', 'assembly']].drop_duplicates().itertuples(index=False):
+                kmer_bits = strand_kmer_bits.get(strand)
+                if kmer_bits is not None:
+                    kmer_bits[seq] = kmer_bits.get(seq, 0) | (1 << assembly_index[assembly])
+
+            # Route every row to the partition of its contig
+            contig_ids, contig_keys = pd.factorize(chunk['assembly'] + '\t' + chunk['contig'])
+            key_partitions = np.array([
+                contig_partitions.setdefault(key, zlib.crc32(key.encode()) % partition_count) for key in contig_keys
+            ], dtype=np.int64)
+            row_partitions = key_partitions[contig_ids]
+            for index in np.unique(row_partitions):
+                chunk[row_partitions == index].to_csv(
+                    handles[index], sep='\t', header=False, index=True, lineterminator='\n'
+                )
+    finally:
+        for handle in handles:
+            handle.close()
+
+    assembly_names = sorted(assembly_index, key=assembly_index.get)
+    return partition_files, assembly_names, strand_kmer_bits, kmer_len, row_count
+
+
+def read_partition(partition_file):
+    """Loads one partition written by partition_positions, indexed by input row number."""
+    dtypes = {column: 'category' for column in CATEGORICAL_COLUMNS}
+    dtypes['position'] = 'int64'
+    return pd.read_csv(partition_file, sep='\t', index_col='row', dtype=dtypes)
+
+
+def pair_partition_hits(partition_file, universal_fwd_kmers, universal_rev_kmers, kmer_len,
+                        min_product_size, max_product_size):
+    """
+    Pairs the hits of one partition (pre-filtered to universal k-mers) with join_fwd_rev_hits.
+    Returns (valid_amplicons_df, fwd_hit_count, rev_hit_count); amplicons are indexed by the
+    input row number of their forward hit.
+    """
+    df = read_partition(partition_file)
+
+    fwd_kmers_df = df[df['strand'] == '+'].rename(
+        columns={'seq': 'Fwd_Kmer', 'position': 'Fwd_Start_Pos'}
+    ).drop(columns=['strand'])
+    rev_kmers_df = df[df['strand'] == '-'].rename(
+        columns={'seq': 'Rev_Kmer', 'position': 'Rev_Start_Pos'}
+    ).drop(columns=['strand'])
+    del df
+
+    fwd_kmers_df = fwd_kmers_df[fwd_kmers_df['Fwd_Kmer'].isin(universal_fwd_kmers)]
+    rev_kmers_df = rev_kmers_df[rev_kmers_df['Rev_Kmer'].isin(universal_rev_kmers)]
+
+    valid_amplicons_df = join_fwd_rev_hits(fwd_kmers_df, rev_kmers_df, kmer_len, min_product_size, max_product_size)
+    return valid_amplicons_df, len(fwd_kmers_df), len(rev_kmers_df)
+
+
+def pair_summary_rows(amplicons_df, assembly_names):
+    """
+    Summarizes the amplicons of one partition per primer pair. Returns a list of
+    (Fwd_Kmer, Rev_Kmer, assembly_bits, min_size, max_size, size_sum, amplicon_count) tuples,
+    assembly_bits being an integer bitset over assembly_names.
+    """
+    pair_ids, pair_values = pd.factorize(
+        pd.MultiIndex.from_arrays([amplicons_df['Fwd_Kmer'].astype(str), amplicons_df['Rev_Kmer'].astype(str)])
+    )
+    assembly_ids = pd.Categorical(amplicons_df['assembly'].astype(str), categories=assembly_names).codes
+    bitsets = assembly_bitsets(pair_ids, assembly_ids, len(pair_values), len(assembly_names))
+
+    sizes = amplicons_df['Calculated_Size'].to_numpy(np.int64)
+    size_stats = pd.Series(sizes).groupby(pair_ids).agg(['min', 'max', 'sum', 'count'])
+
+    return [
+        (fwd_kmer, rev_kmer, int.from_bytes(words.tobytes(), 'little'),
+         int(size_min), int(size_max), int(size_sum), int(size_count))
+        for (fwd_kmer, rev_kmer), words, size_min, size_max, size_sum, size_count in zip(
+            pair_values, bitsets, size_stats['min'], size_stats['max'], size_stats['sum'], size_stats['count'])
+    ]
+
+
+def spill_pair_summaries(handles, summary_rows):
+    """
+    Appends pair summary rows to handles[crc32(pair) % len(handles)] (bitset in hex), so all the
+    partial summaries of a pair land in the same spill file and can be reduced one file at a time.
+    """
+    for fwd_kmer, rev_kmer, bits, size_min, size_max, size_sum, size_count in summary_rows:
+        key = f"{fwd_kmer}\t{rev_kmer}"
+        handles[zlib.crc32(key.encode()) % len(handles)].write(
+            f"{key}\t{bits:x}\t{size_min}\t{size_max}\t{size_sum}\t{size_count}\n"
+        )
+
+
+def read_pair_summaries(spill_file):
+    """Yields the pair summary rows written by spill_pair_summaries."""
+    with open(spill_file, 'r') as f:
+        for line in f:
+            fwd_kmer, rev_kmer, bits, size_min, size_max, size_sum, size_count = line.rstrip('\n').split('\t')
+            yield (fwd_kmer, rev_kmer, int(bits, 16),
+                   int(size_min), int(size_max), int(size_sum), int(size_count))
+
+
+def merge_pair_summaries(pair_summaries, summary_rows):
+    """
+    Folds pair summary rows into pair_summaries:
+    {(Fwd_Kmer, Rev_Kmer): [assembly_bits, min_size, max_size, size_sum, amplicon_count]}.
+    """
+    for fwd_kmer, rev_kmer, bits, size_min, size_max, size_sum, size_count in summary_rows:
+        summary = pair_summaries.get((fwd_kmer, rev_kmer))
+        if summary is None:
+            pair_summaries[(fwd_kmer, rev_kmer)] = [bits, size_min, size_max, size_sum, size_count]
+        else:
+            summary[0] |= bits
+            summary[1] = min(summary[1], size_min)
+            summary[2] = max(summary[2], size_max)
+            summary[3] += size_sum
+            summary[4] += size_count
+
+
+def find_universal_primers_partitioned(input_file, output_file, min_product_size, max_product_size, fasta_dir,
+                                       memory_budget_mb=None, partition_count=None, work_dir=None,
+                                       assembly_ext=None, prefetch=DEFAULT_PREFETCH, top_n=None,
+                                       target_product_size=None):
+    """
+    Out-of-core version of find_universal_primers for positions tables that do not fit in memory.
+    The table is split on disk by contig and processed one partition at a time; only a compact
+    summary per primer pair (assembly bitset, min/max/sum of product sizes, amplicon count) is
+    carried between partitions, spilled to disk by pair hash and reduced one spill file at a time,
+    so only the universal pairs' summaries are held in memory. A second pass over the partitions collects
+    the amplicons of the universal pairs. The output is identical to find_universal_primers.
+
+    The partition count and the streaming chunk size are derived from memory_budget_mb unless
+    partition_count is given. The budget only covers the partition rows: the per-strand assembly
+    bitset of every k-mer (universality pre-filter) is kept in memory while splitting, and grows with
+    the number of distinct k-mers. Partition and spill files are written to a temporary directory inside work_dir
+    (default: the output directory) and removed at the end. With top_n, pairs are ranked from their
+    summaries and the second pass only collects the amplicons of the top_n pairs.
+    """
+    try:
+        row_count = count_positions(input_file)
     except Exception as e:
         print(f"Error loading file: {e}")
-        return
+        return None
+
+    if memory_budget_mb:
+        budget_bytes = memory_budget_mb * 1024 * 1024
+        chunk_rows = max(1000, int(budget_bytes / (4 * PARTITION_ROW_BYTES)))
+        if not partition_count:
+            partition_count = int(np.ceil(row_count * PARTITION_ROW_BYTES / budget_bytes))
+    else:
+        chunk_rows = DEFAULT_CHUNK_SIZE
+    partition_count = max(1, partition_count or 1)
+
+    work_dir = work_dir or os.path.dirname(os.path.abspath(output_file))
+    partition_dir = tempfile.mkdtemp(prefix='universal_primers_partitions_', dir=work_dir)
+
+    try:
+        # 1. Split the positions table on disk by contig, collecting k-mer assembly bitsets on the way
+        print(f"Splitting about {row_count} k-mer hits from {input_file} into {partition_count} partitions "
+              f"in {partition_dir}...")
+        try:
+            partition_files, assembly_names, strand_kmer_bits, kmer_len, row_count = partition_positions(
+                input_file, partition_dir, partition_count, chunk_rows
+            )
+        except Exception as e:
+            print(f"Error loading file: {e}")
+            return None
+
+        if kmer_len == 0:
+            print("Error: No forward k-mers found or k-mer length is zero. Exiting analysis.")
+            return None
+
+        print(f"Dynamically identified {len(assembly_names)} unique assemblies to target.")
+        print(f"k-mer length determined to be {kmer_len}.")
+
+        # 2. Universality pre-filter: only k-mers present on their strand in all assemblies can pair
+        all_assemblies = (1 << len(assembly_names)) - 1
+        universal_fwd_kmers = [kmer for kmer, bits in strand_kmer_bits['+'].items() if bits == all_assemblies]
+        universal_rev_kmers = [kmer for kmer, bits in strand_kmer_bits['-'].items() if bits == all_assemblies]
+        del strand_kmer_bits
+
+        # 3. Pair every partition; the per-pair summaries are spilled to disk by pair hash
+        print("Finding all valid Fwd(+) < Rev(-) pairings on the same contig, one partition at a time...")
+        spill_files = [os.path.join(partition_dir, f"pairs_{index:04d}.tsv") for index in range(partition_count)]
+        spill_handles = [open(path, 'w') for path in spill_files]
+        amplicon_count = fwd_hit_count = rev_hit_count = 0
+        try:
+            for partition_file in partition_files:
+                valid_amplicons_df, fwd_hits, rev_hits = pair_partition_hits(
+                    partition_file, universal_fwd_kmers, universal_rev_kmers, kmer_len,
+                    min_product_size, max_product_size
+                )
+                fwd_hit_count += fwd_hits
+                rev_hit_count += rev_hits
+                if not valid_amplicons_df.empty:
+                    amplicon_count += len(valid_amplicons_df)
+                    spill_pair_summaries(spill_handles, pair_summary_rows(valid_amplicons_df, assembly_names))
+        finally:
+            for handle in spill_handles:
+                handle.close()
+
+        print(f"Universality pre-filter kept {fwd_hit_count} Fwd(+) hits and {rev_hit_count} Rev(-) hits "
+              f"out of {row_count}.")
+
+        if amplicon_count == 0:
+            print("\n--- Analysis Complete ---")
+            print(
+                f"No valid k-mer pairings found meeting the size and order criteria ({min_product_size}-{max_product_size} bp).")
+            return None
+
+        # 4. Reduce the summaries one spill file at a time, keeping the pairs whose bitset covers every assembly
+        universal_summaries = {}
+        pair_count = 0
+        for spill_file in spill_files:
+            pair_summaries = {}
+            merge_pair_summaries(pair_summaries, read_pair_summaries(spill_file))
+            pair_count += len(pair_summaries)
+            universal_summaries.update(
+                (pair, summary) for pair, summary in pair_summaries.items() if summary[0] == all_assemblies
+            )
+            del pair_summaries
+        # Same pair order as the in-memory path (sorted by Fwd_Kmer, then Rev_Kmer)
+        universal_summaries = dict(sorted(universal_summaries.items()))
+
+        print(f"Found {amplicon_count} potential valid amplicons across all assemblies "
+              f"({pair_count} distinct pairs).")
+
+        if not universal_summaries:
+            print("\n--- Analysis Complete ---")
+            print(
+                f"No universal primer pairs found that consistently maintain the Fwd(+) < Rev(-) position AND yield a product size between {min_product_size} and {max_product_size} bp in all {len(assembly_names)} target strains.")
+            return None
+
+        universal_pairs = pd.MultiIndex.from_tuples(list(universal_summaries), names=['Fwd_Kmer', 'Rev_Kmer'])
+        summaries = np.array([summary[1:] for summary in universal_summaries.values()], dtype=np.int64)
+        metrics = pd.DataFrame({
+            'Fwd_Kmer': universal_pairs.get_level_values('Fwd_Kmer'),
+            'Rev_Kmer': universal_pairs.get_level_values('Rev_Kmer'),
+            'Product_Size_Avg': summaries[:, 2] // summaries[:, 3],
+            'Product_Size_Min': summaries[:, 0],
+            'Product_Size_Max': summaries[:, 1],
+        })
+
+        ranking = None
+        if top_n:
+            metrics, ranking = select_top_pairs(
+                metrics, top_n, target_product_size or (min_product_size + max_product_size) // 2
+            )
+            universal_pairs = pd.MultiIndex.from_frame(ranking[['Fwd_Kmer', 'Rev_Kmer']])
+
+        # 5. Second pass: collect the amplicons of the universal pairs
+        universal_parts = []
+        for partition_file in partition_files:
+            valid_amplicons_df, _, _ = pair_partition_hits(
+                partition_file, universal_fwd_kmers, universal_rev_kmers, kmer_len,
+                min_product_size, max_product_size
+            )
+            if valid_amplicons_df.empty:
+                continue
+            valid_amplicons_df = valid_amplicons_df.astype(
+                {'Fwd_Kmer': str, 'assembly': str, 'contig': str, 'Rev_Kmer': str}
+            )
+            is_universal = pd.MultiIndex.from_arrays(
+                [valid_amplicons_df['Fwd_Kmer'], valid_amplicons_df['Rev_Kmer']]
+            ).isin(universal_pairs)
+            universal_parts.append(valid_amplicons_df[is_universal])
+    finally:
+        shutil.rmtree(partition_dir, ignore_errors=True)
+
+    # Same row order as the in-memory path: by pair and assembly, then by input row of the Fwd hit
+    universal_results_df = pd.concat(universal_parts).rename_axis('Fwd_Row').sort_values(
+        by=['Fwd_Kmer', 'Rev_Kmer', 'assembly', 'Fwd_Row'], kind='stable'
+    ).reset_index(drop=True)
+
+    return write_universal_results(universal_results_df, metrics, len(universal_summaries), kmer_len, output_file,
+                                   min_product_size, max_product_size, fasta_dir, assembly_ext, prefetch, ranking)
 
+
+# --- Main Analysis Function ---
+
+def find_universal_primers(positions_df, output_file, min_product_size, max_product_size, fasta_dir,
+                           target_homology_map, assembly_ext=None, prefetch=DEFAULT_PREFETCH, top_n=None,
+                           target_product_size=None):
+    """
+    Analyzes the k-mer position data (as loaded by load_positions_table) to find universal primer
+    pairs and extracts the amplicon sequence.
+    Amplicons are read from per-contig files <assembly>.<contig>.fasta, or, when assembly_ext is set,
+    sliced directly out of the indexed whole-assembly FASTA <assembly><assembly_ext>.
+    Follows the logic:
+    1. Find all valid amplicons (Fwd(+) < Rev(-) on same contig, within size constraints)
+    2. Filter these amplicons to find pairs that are universal across ALL assemblies.
+    With top_n, only the top_n best scoring universal pairs are extracted and written, best first
+    (see score_primer_pair; target_product_size defaults to the middle of the size range).
+    """
     # 1. Filter data to only include the target assemblies/contigs for efficiency
     target_assemblies = set(target_homology_map.keys())
-    df_filtered = df[df['assembly'].isin(target_assemblies)].copy()
+    df_filtered = positions_df
+    if not target_assemblies.issuperset(positions_df['assembly'].unique()):
+        df_filtered = positions_df[positions_df['assembly'].isin(target_assemblies)]
 
-    # 2. Separate Fwd (+) and Rev (-) k-mers
+    # 2. Separate Fwd (+) and Rev (-) k-mers (the row selections are new frames, no extra copy needed)
     fwd_kmers_df = df_filtered[df_filtered['strand'] == '+'].rename(
         columns={'seq': 'Fwd_Kmer', 'position': 'Fwd_Start_Pos'}
-    ).drop(columns=['strand']).copy()
+    ).drop(columns=['strand'])
 
     rev_kmers_df = df_filtered[df_filtered['strand'] == '-'].rename(
         columns={'seq': 'Rev_Kmer', 'position': 'Rev_Start_Pos'}
-    ).drop(columns=['strand']).copy()
+    ).drop(columns=['strand'])
 
     # Determine k-mer length (assume all kmers are the same length, use the first one)
     kmer_len = len(fwd_kmers_df['Fwd_Kmer'].iloc[0]) if not fwd_kmers_df.empty else 0
@@ -134,33 +823,20 @@ def find_universal_primers(input_file, output_file, min_product_size, max_produc
         return None
 
     print(f"k-mer length determined to be {kmer_len}.")
-    print("Finding all valid Fwd(+) < Rev(-) pairings on the same contig...")
 
-    # 3. Merge Fwd and Rev dataframes on (assembly, contig) to find all possible pairs on the same segment.
-    # This efficiently creates the list of k-mer pairs on different strands on the same contig (User Step 1).
-    all_pairs_df = pd.merge(
-        fwd_kmers_df,
-        rev_kmers_df,
-        on=['assembly', 'contig'],
-        how='inner'
-    )
-
-    # Filter out cases where the kmer is paired with itself
-    all_pairs_df = all_pairs_df[all_pairs_df['Fwd_Kmer'] != all_pairs_df['Rev_Kmer']]
+    # Prune k-mers that are not present on the right strand in all target assemblies before pairing
+    fwd_hit_count, rev_hit_count = len(fwd_kmers_df), len(rev_kmers_df)
+    fwd_kmers_df = drop_non_universal_kmers(fwd_kmers_df, 'Fwd_Kmer', target_assemblies)
+    rev_kmers_df = drop_non_universal_kmers(rev_kmers_df, 'Rev_Kmer', target_assemblies)
+    print(f"Universality pre-filter kept {len(fwd_kmers_df)}/{fwd_hit_count} Fwd(+) hits "
+          f"and {len(rev_kmers_df)}/{rev_hit_count} Rev(-) hits.")
 
-    # 4. Apply PCR conditions (Order and Size)
-
-    # Condition A: Correct Order (Fwd start must be before Rev start on the forward strand)
-    valid_order_df = all_pairs_df[all_pairs_df['Fwd_Start_Pos'] < all_pairs_df['Rev_Start_Pos']].copy()
-
-    # Calculate product size
-    valid_order_df['Calculated_Size'] = valid_order_df['Rev_Start_Pos'] - valid_order_df['Fwd_Start_Pos'] + kmer_len
+    print("Finding all valid Fwd(+) < Rev(-) pairings on the same contig...")
 
-    # Condition B: Filter by MINIMUM and MAXIMUM length
-    valid_amplicons_df = valid_order_df[
-        (valid_order_df['Calculated_Size'] >= min_product_size) &
-        (valid_order_df['Calculated_Size'] <= max_product_size)
-        ].reset_index(drop=True)
+    # 3-4. Pair every Fwd(+) hit with the Rev(-) hits of the same contig that lie downstream of it
+    # and inside the product size window (User Step 1). A sorted range join only materializes valid
+    # amplicons instead of the full Fwd x Rev product of each contig.
+    valid_amplicons_df = join_fwd_rev_hits(fwd_kmers_df, rev_kmers_df, kmer_len, min_product_size, max_product_size)
 
     if valid_amplicons_df.empty:
         print("\n--- Analysis Complete ---")
@@ -172,72 +848,78 @@ def find_universal_primers(input_file, output_file, min_product_size, max_produc
 
     # 5. Check Universality: Filter for pairs that are present in ALL target assemblies (User Step 2).
 
-    # Group by the primer pair and count how many unique assemblies they hit
-    pair_assembly_counts = valid_amplicons_df.groupby(['Fwd_Kmer', 'Rev_Kmer'])['assembly'].nunique().reset_index(
-        name='Assembly_Count')
+    # Track the assemblies hit by each primer pair as a bitset; a pair is universal when its
+    # popcount equals the number of target assemblies
+    universal_rows, universal_pair_count = universal_pair_mask(valid_amplicons_df, target_assemblies)
 
-    # Identify the universal pairs (count must equal the total number of target assemblies)
-    universal_pair_sequences = pair_assembly_counts[pair_assembly_counts['Assembly_Count'] == len(target_assemblies)]
-
-    if universal_pair_sequences.empty:
+    if universal_pair_count == 0:
         print("\n--- Analysis Complete ---")
         print(
             f"No universal primer pairs found that consistently maintain the Fwd(+) < Rev(-) position AND yield a product size between {min_product_size} and {max_product_size} bp in all {len(target_homology_map)} target strains.")
         return None
 
-    # Merge the universal pairs list back into the full list of valid amplicons to get the final results
-    universal_results_df = pd.merge(
-        valid_amplicons_df,
-        universal_pair_sequences[['Fwd_Kmer', 'Rev_Kmer']],
-        on=['Fwd_Kmer', 'Rev_Kmer'],
-        how='inner'
-    ).sort_values(by=['Fwd_Kmer', 'Rev_Kmer', 'assembly']).reset_index(drop=True)
-
-    # 6. Calculate consistency metrics
-    metrics = universal_results_df.groupby(['Fwd_Kmer', 'Rev_Kmer'])['Calculated_Size'].agg(
-        Product_Size_Avg=lambda x: int(x.mean()),
-        Product_Size_Min=lambda x: int(x.min()),
-        Product_Size_Max=lambda x: int(x.max())
-    ).reset_index()
-
+    universal_amplicons_df = valid_amplicons_df[universal_rows]
+
+    # 6. Calculate consistency metrics (built-in aggregations; the average is truncated to an integer)
+    metrics = universal_amplicons_df.groupby(['Fwd_Kmer', 'Rev_Kmer'], observed=True)['Calculated_Size'].agg(
+        Product_Size_Avg='mean',
+        Product_Size_Min='min',
+        Product_Size_Max='max'
+    ).astype(np.int64).reset_index()
+
+    # Ranking mode: only the amplicons of the top_n best scoring pairs go further
+    ranking = None
+    if top_n:
+        metrics, ranking = select_top_pairs(
+            metrics, top_n, target_product_size or (min_product_size + max_product_size) // 2
+        )
+        top_pairs = pd.MultiIndex.from_frame(ranking[['Fwd_Kmer', 'Rev_Kmer']])
+        universal_amplicons_df = universal_amplicons_df[
+            pd.MultiIndex.from_frame(universal_amplicons_df[['Fwd_Kmer', 'Rev_Kmer']].astype(str)).isin(top_pairs)
+        ]
+
+    # Keep the amplicons of the universal pairs to get the final results
+    universal_results_df = universal_amplicons_df.sort_values(
+        by=['Fwd_Kmer', 'Rev_Kmer', 'assembly']
+    ).reset_index(drop=True)
+
+    return write_universal_results(universal_results_df, metrics, universal_pair_count, kmer_len, output_file,
+                                   min_product_size, max_product_size, fasta_dir, assembly_ext, prefetch, ranking)
+
+
+def write_universal_results(universal_results_df, metrics, universal_pair_count, kmer_len, output_file,
+                            min_product_size, max_product_size, fasta_dir, assembly_ext=None,
+                            prefetch=DEFAULT_PREFETCH, ranking=None):
+    """
+    Merges the per-pair metrics into the sorted universal amplicons, extracts the amplicon
+    sequences, saves the results and prints the summary table. When a ranking (from
+    rank_primer_pairs) is given, pairs are written best first with their rank, score, Tm and GC %.
+    """
     # Merge the metrics into the results DataFrame
     universal_results_df = universal_results_df.merge(metrics, on=['Fwd_Kmer', 'Rev_Kmer'])
-
-    print(f"Found {len(universal_pair_sequences)} universal primer pairs.")
+    ranking_columns = []
+    if ranking is not None:
+        ranking_columns = [column for column in ranking.columns if column not in ('Fwd_Kmer', 'Rev_Kmer')]
+        universal_results_df = universal_results_df.astype({'Fwd_Kmer': str, 'Rev_Kmer': str}).merge(
+            ranking, on=['Fwd_Kmer', 'Rev_Kmer']
+        ).sort_values(by='Rank', kind='stable').reset_index(drop=True)
+
+    print(f"Found {universal_pair_count} universal primer pairs.")
     print("Extracting amplicon sequences for universal pairs...")
 
-    # 7. Extract Amplicon Sequence (Apply this function row-wise)
-    def extract_amplicon(row, fasta_dir):
-        """Helper function to load sequence and extract amplicon."""
-        sequence = load_fasta_sequence(row['assembly'], row['contig'], fasta_dir)
-
-        amplicon_sequence = ""
-        if sequence:
-            # Fwd_pos is 1-based start. Python slice start is Fwd_Start_Pos - 1.
-            # Amplicon ends at Rev_Start_Pos + kmer_len - 1. Python slice end is exclusive.
-            start_idx = row['Fwd_Start_Pos'] - 1
-            end_idx = row['Rev_Start_Pos'] + kmer_len - 1
-
-            if end_idx <= len(sequence):
-                amplicon_sequence = sequence[start_idx:end_idx]
-            else:
-                amplicon_sequence = f"ERROR_INDEX_OUT_OF_BOUNDS (Contig Len: {len(sequence)}, End Index: {end_idx})"
-        else:
-            amplicon_sequence = "FASTA_LOAD_FAILED"
-
-        return amplicon_sequence
-
-    # Apply the extraction function
+    # 7. Extract Amplicon Sequence, one read per contig with the next contigs prefetched
     # NOTE: The original map filtering on homologous contigs is implicitly handled here because the
     # initial dataframe df_filtered contains only k-mer hits (assembly, contig) that were present
     # in the input file, which is used to generate the TARGET_HOMOLOGY_MAP.
-    universal_results_df['Amplicon_Sequence'] = universal_results_df.apply(
-        extract_amplicon, axis=1, fasta_dir=fasta_dir
+    universal_results_df['Amplicon_Sequence'] = extract_amplicons(
+        universal_results_df, kmer_len, fasta_dir, assembly_ext, prefetch
     )
 
     # 8. Final Output
+    universal_results_df = universal_results_df.rename(columns={'assembly': 'Assembly', 'contig': 'Contig'})
     final_columns = [
         'Fwd_Kmer', 'Rev_Kmer', 'Product_Size_Avg', 'Product_Size_Min', 'Product_Size_Max',
+    ] + ranking_columns + [
         'Amplicon_Sequence',
         'Assembly', 'Contig', 'Fwd_Start_Pos', 'Rev_Start_Pos', 'Calculated_Size'
     ]
@@ -253,7 +935,7 @@ def find_universal_primers(input_file, output_file, min_product_size, max_produc
     # Print a summary table to the console
     summary_df = universal_results_df[
         ['Fwd_Kmer', 'Rev_Kmer', 'Product_Size_Avg', 'Product_Size_Min',
-         'Product_Size_Max']].drop_duplicates().reset_index(drop=True)
+         'Product_Size_Max'] + ranking_columns].drop_duplicates().reset_index(drop=True)
     print(
         f"\nSummary of Universal Primer Pairs (All products between {min_product_size} and {max_product_size} bp):")
 
@@ -277,7 +959,8 @@ def main():
         '--input_file',
         type=str,
         default='multiassembly_kmers_positions.tsv',
-        help='Input TSV file containing k-mer positions (default: multiassembly_kmers_positions.tsv)'
+        help='Input file containing k-mer positions: TSV, or the columnar .npz/.parquet output of '
+             'find_kmer_positions.py --output_format (default: multiassembly_kmers_positions.tsv)'
     )
     parser.add_argument(
         '--output_file',
@@ -303,6 +986,61 @@ def main():
         default='./assembly/',
         help='Directory containing the FASTA files named <assembly>.<contig>.fasta. (default: ./assembly/)'
     )
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        default=DEFAULT_PREFETCH,
+        help=f'Number of contigs loaded ahead on a thread pool during amplicon extraction (default: {DEFAULT_PREFETCH})'
+    )
+    parser.add_argument(
+        '--assembly_ext',
+        type=str,
+        default=None,
+        help="Read amplicons from whole-assembly FASTA files named <assembly><ext> in --fasta_dir "
+             "(plain or bgzip, e.g. '.fna' or '.fna.gz') through a .fai index saved next to each file, "
+             "instead of per-contig files. (default: per-contig files)"
+    )
+    parser.add_argument(
+        '--memory_budget_mb',
+        type=float,
+        default=None,
+        help='Run out-of-core: split the input on disk by contig into partitions sized to fit this memory '
+             'budget (in MB) and process them one at a time. The budget applies to the partition rows only; '
+             'the assembly bitset of every distinct k-mer and the summaries of the universal pairs are still '
+             'kept in memory. (default: load the whole input in memory)'
+    )
+    parser.add_argument(
+        '--partitions',
+        type=int,
+        default=None,
+        help='Run out-of-core with this many on-disk partitions (overrides the count derived from '
+             '--memory_budget_mb).'
+    )
+    parser.add_argument(
+        '--work_dir',
+        type=str,
+        default=None,
+        help='Directory for the temporary partition files of the out-of-core mode (default: output directory)'
+    )
+    parser.add_argument(
+        '--top_n',
+        type=int,
+        default=None,
+        help='Ranking mode: score the universal pairs (product size spread, primer Tm and GC %% difference, '
+             'distance to --target_product_size) and only extract and write the N best ones, best first. '
+             '(default: write all universal pairs)'
+    )
+    parser.add_argument(
+        '--target_product_size',
+        type=int,
+        default=None,
+        help='Preferred product size used by --top_n scoring (default: middle of the min/max product size range)'
+    )
+    parser.add_argument(
+        '--print_homology_map',
+        action='store_true',
+        help='Print the contigs of every assembly found in the input file (debugging).'
+    )
 
     # Parse arguments
     args = parser.parse_args()
@@ -312,23 +1050,45 @@ def main():
         print(f"Error: Input file '{args.input_file}' not found. Please ensure it is uploaded.")
         sys.exit(1)
 
+    # Out-of-core mode: the input is only ever streamed, never loaded whole
+    if args.memory_budget_mb or args.partitions:
+        find_universal_primers_partitioned(
+            args.input_file,
+            args.output_file,
+            args.min_product_size,
+            args.max_product_size,
+            args.fasta_dir,
+            args.memory_budget_mb,
+            args.partitions,
+            args.work_dir,
+            args.assembly_ext,
+            args.prefetch,
+            args.top_n,
+            args.target_product_size
+        )
+        return
+
+    # Load the positions table once; everything below is derived from it
+    positions_df = load_positions_table(args.input_file)
+    if positions_df is None:
+        sys.exit(1)
+
     # 1. Dynamically get all target assemblies from the input file
-    TARGET_ASSEMBLIES = get_all_assemblies_from_file(args.input_file)
+    TARGET_ASSEMBLIES = get_all_assemblies(positions_df)
 
     if not TARGET_ASSEMBLIES:
         print("Error: Could not determine target assemblies from input file. Exiting.")
         sys.exit(1)
 
     # 2. Dynamically generate TARGET_HOMOLOGY_MAP based on the newly defined TARGET_ASSEMBLIES
-    TARGET_HOMOLOGY_MAP = generate_homology_map_from_file(args.input_file, TARGET_ASSEMBLIES)
+    TARGET_HOMOLOGY_MAP = generate_homology_map(positions_df, TARGET_ASSEMBLIES)
 
-    # --- START: Added printing for debugging ---
-    print("\n--- TARGET_HOMOLOGY_MAP Content (Assembly ID -> Contigs) ---")
-    # Loop through the dictionary to print each item clearly
-    for assembly, contigs in TARGET_HOMOLOGY_MAP.items():
-        print(f"  {assembly}: {', '.join(contigs)}")
-    print("----------------------------------------------------------\n")
-    # --- END: Added printing for debugging ---
+    if args.print_homology_map:
+        print("\n--- TARGET_HOMOLOGY_MAP Content (Assembly ID -> Contigs) ---")
+        # Loop through the dictionary to print each item clearly
+        for assembly, contigs in TARGET_HOMOLOGY_MAP.items():
+            print(f"  {assembly}: {', '.join(contigs)}")
+        print("----------------------------------------------------------\n")
 
     # Check if the generated map is usable
     if not TARGET_HOMOLOGY_MAP:
@@ -337,12 +1097,16 @@ def main():
 
     # Run the main analysis function
     find_universal_primers(
-        args.input_file,
+        positions_df,
         args.output_file,
         args.min_product_size,
         args.max_product_size,
         args.fasta_dir,  # Pass the FASTA directory
-        TARGET_HOMOLOGY_MAP
+        TARGET_HOMOLOGY_MAP,
+        args.assembly_ext,
+        args.prefetch,
+        args.top_n,
+        args.target_product_size
     )
 
 
@@ -2,9 +2,19 @@ import re
 import os
 import argparse
 from glob import glob
+import sys
 import csv
+import gzip
+import multiprocessing
+import time
+from collections import deque
+from functools import lru_cache
+from itertools import product
+import numpy as np
 from Bio.Seq import Seq
 from Bio.SeqUtils import MeltingTemp as mt
+from aho_corasick import AhoCorasick
+from nn_tm import melting_temperatures
 
 # Define the IUPAC degeneracy mapping for use in regex
 IUPAC_MAPPING = {
@@ -28,6 +38,26 @@ COMPLEMENT_MAPPING = {
     'N': 'N',  # Handle 'N' if present in the sequence
 }
 
+# Primer panels: length of the exact seeds indexed for each primer, and maximum number of
+# expansions of a degenerate seed (highly degenerate primers get shorter seeds)
+SEED_LENGTH = 12
+MAX_SEED_EXPANSIONS = 256
+
+# FASTA sequence lines: bytes removed (anything but A/C/G/T in either case) and uppercase translation
+NON_ACGT_BYTES = bytes(code for code in range(256) if chr(code) not in 'ACGTacgt')
+UPPERCASE_BYTES = bytes.maketrans(b'acgt', b'ACGT')
+
+# Parallel runs: records are sent to the workers in tasks of about TASK_BASES bases (a task never
+# spans two files), with at most TASKS_PER_WORKER tasks per worker in flight to bound memory
+TASK_BASES = 1000000
+TASKS_PER_WORKER = 4
+
+# One bit per base for mismatch-tolerant matching: a sequence base matches an IUPAC code
+# when their bit masks intersect (any other character matches nothing)
+BASE_BITS = np.zeros(256, dtype=np.uint8)
+for _bit, _base in enumerate('ACGT'):
+    BASE_BITS[ord(_base)] = BASE_BITS[ord(_base.lower())] = 1 << _bit
+
 
 def iupac_to_regex(degenerate_seq):
     """Converts a degenerate IUPAC DNA sequence into a standard regex pattern."""
@@ -38,45 +68,78 @@ def iupac_to_regex(degenerate_seq):
     return regex_pattern
 
 
+# Complement of every IUPAC code, for reverse-complementing degenerate primers
+IUPAC_COMPLEMENT_MAPPING = {
+    'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C',
+    'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W', 'K': 'M', 'M': 'K',
+    'B': 'V', 'V': 'B', 'D': 'H', 'H': 'D', 'N': 'N',
+}
+
+COMPLEMENT_TABLE = str.maketrans(COMPLEMENT_MAPPING)
+IUPAC_COMPLEMENT_TABLE = str.maketrans(IUPAC_COMPLEMENT_MAPPING)
+
+
 def reverse_complement(seq):
     """Calculates the reverse complement of a DNA sequence."""
-    seq = seq.upper()
-    complement_list = [COMPLEMENT_MAPPING.get(base, base) for base in seq]
-    # Reverse the complemented list and join
-    return "".join(complement_list[::-1])
+    return seq.upper().translate(COMPLEMENT_TABLE)[::-1]
 
 
-def read_fasta_sequences(filepath):
+def reverse_complement_degenerate(degenerate_seq):
+    """Calculates the reverse complement of a degenerate IUPAC DNA sequence."""
+    return degenerate_seq.upper().translate(IUPAC_COMPLEMENT_TABLE)[::-1]
+
+
+def open_fasta(filepath):
+    """Opens a FASTA file in binary mode, decompressing it when its name ends in .gz."""
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rb')
+    return open(filepath, 'rb')
+
+
+def iter_fasta_records(filepath):
     """
-    Reads a FASTA file and returns a dictionary of {header: sequence}.
-    It assumes the user's specific single-line FASTA format is being used.
+    Streams the records of a FASTA file (gzip-compressed when ending in .gz) as (header, sequence),
+    one record in memory at a time. The header is the first word of the header line, as is typical
+    for contig IDs; sequence lines are uppercased and stripped of non-ACGT characters with a single
+    bytes.translate per line.
     """
-    sequences = {}
     current_header = None
     current_sequence = []
+    has_sequence_lines = False
+
+    with open_fasta(filepath) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith(b'>'):
+                if current_header and has_sequence_lines:
+                    yield current_header, b"".join(current_sequence).decode('ascii')
+
+                words = line[1:].split()
+                current_header = words[0].decode('utf-8', errors='replace') if words else None
+                current_sequence = []
+                has_sequence_lines = False
+            else:
+                # Append sequence lines, removing non-ACGT characters
+                current_sequence.append(line.translate(UPPERCASE_BYTES, NON_ACGT_BYTES))
+                has_sequence_lines = True
+
+        # Yield the last sequence
+        if current_header and has_sequence_lines:
+            yield current_header, b"".join(current_sequence).decode('ascii')
+
+
+def read_fasta_sequences(filepath):
+    """
+    Reads a FASTA file and returns a dictionary of {header: sequence} (see iter_fasta_records).
+    """
+    sequences = {}
 
     try:
-        with open(filepath, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-
-                if line.startswith('>'):
-                    if current_header and current_sequence:
-                        sequences[current_header] = "".join(current_sequence)
-
-                    # Store the new header, removing the '>'
-                    # Use only the first part as header ID, as is typical for contig IDs
-                    current_header = line[1:].split()[0]
-                    current_sequence = []
-                else:
-                    # Append sequence lines, removing non-ACGT characters
-                    current_sequence.append(re.sub(r'[^ACGTacgt]', '', line.upper()))
-
-            # Yield the last sequence
-            if current_header and current_sequence:
-                sequences[current_header] = "".join(current_sequence)
+        for header, sequence in iter_fasta_records(filepath):
+            sequences[header] = sequence
     except FileNotFoundError:
         print(f"Error: File not found at {filepath}")
     except Exception as e:
@@ -85,116 +148,272 @@ def read_fasta_sequences(filepath):
     return sequences
 
 
-def find_all_matches_single_strand(sequence, regex_start, regex_end):
+@lru_cache(maxsize=None)
+def motif_pattern(regex):
     """
-    Finds ALL non-overlapping occurrences of the start motif followed by the
-    end motif on a single sequence string.
+    Compiles a motif regex once into a zero-width lookahead pattern, so that a single finditer pass
+    reports every (overlapping) hit of the motif with its span in group 1.
+    """
+    return re.compile(f"(?=({regex}))")
 
-    Returns a list of dictionaries containing match details.
+
+def motif_hits(sequence, regex):
+    """Returns the (start_0, end_0_exclusive) span of every occurrence of a motif, in one pass."""
+    return [match.span(1) for match in motif_pattern(regex).finditer(sequence)]
+
+
+def pair_motif_hits(upstream_hits, downstream_hits, min_len=None, max_len=None):
     """
-    matches = []
+    Pairs upstream and downstream motif hits ((start_0, end_0_exclusive) spans sorted by start)
+    into non-overlapping amplicons with a two-pointer sweep: each upstream hit at or after the end
+    of the previous amplicon is paired with the first downstream hit beginning after it.
+
+    With min_len/max_len the amplicon (upstream start to downstream end) must be that long: the
+    downstream hit is the first one beginning after the upstream match and ending at least min_len
+    bases after its start, and the upstream hit is left unpaired when that hit ends more than
+    max_len bases after its start. The sweep stops as soon as no downstream hit is left, so the
+    cost stays linear in the number of hits whatever the contig length.
+
+    Returns a list of (start_0, upstream_end_0, downstream_start_0, end_0_exclusive).
+    """
+    pairs = []
+    downstream_index = 0
     current_search_start = 0
-    seq_len = len(sequence)
 
-    while current_search_start < seq_len:
-        # 1. Search for the start primer (regex_start)
-        match_start = re.search(regex_start, sequence[current_search_start:])
+    for start_index_0_based, upstream_end in upstream_hits:
+        # Amplicons are non-overlapping: skip upstream motifs inside the previous amplicon
+        if start_index_0_based < current_search_start:
+            continue
+
+        # First downstream motif starting immediately after the current upstream match
+        # (and ending min_len bases after its start)
+        min_end = start_index_0_based + min_len if min_len else 0
+        while downstream_index < len(downstream_hits) and (downstream_hits[downstream_index][0] < upstream_end
+                                                            or downstream_hits[downstream_index][1] < min_end):
+            downstream_index += 1
+        if downstream_index == len(downstream_hits):
+            break  # No downstream motif after this upstream motif, nor after any later one
 
-        if not match_start:
-            break  # No more start motifs found
+        downstream_start, end_of_segment_0_based_exclusive = downstream_hits[downstream_index]
+        if max_len is not None and end_of_segment_0_based_exclusive - start_index_0_based > max_len:
+            continue  # The window of this upstream motif is exhausted
+        pairs.append((start_index_0_based, upstream_end, downstream_start, end_of_segment_0_based_exclusive))
 
-        # Adjust start match indices to be relative to the whole sequence
-        start_index_0_based = current_search_start + match_start.start()
-        search_for_end_from_index = current_search_start + match_start.end()
+        # The next amplicon starts at or after the end of the current full match
+        current_search_start = end_of_segment_0_based_exclusive
 
-        # 2. Search for the end primer (regex_end), starting immediately after the current start match
-        match_end_in_substring = re.search(regex_end, sequence[search_for_end_from_index:])
+    return pairs
 
-        if match_end_in_substring:
-            # Calculate indices in the whole sequence
-            end_match_start_0_based = search_for_end_from_index + match_end_in_substring.start()
-            end_of_segment_0_based_exclusive = search_for_end_from_index + match_end_in_substring.end()
 
-            # Extract the motif sequences from the main sequence
-            start_motif_seq = sequence[start_index_0_based: start_index_0_based + len(match_start.group(0))]
-            end_motif_seq = sequence[end_match_start_0_based: end_of_segment_0_based_exclusive]
+def find_all_matches_single_strand(sequence, regex_start, regex_end, min_len=None, max_len=None):
+    """
+    Finds ALL non-overlapping occurrences of the start motif followed by the
+    end motif on a single sequence string.
 
-            # Extract the full amplicon sequence
-            amplicon_sequence = sequence[start_index_0_based:end_of_segment_0_based_exclusive]
+    Every start and end motif hit is collected in one pass each, then hits are paired with a
+    two-pointer sweep (pair_motif_hits), optionally bounded to amplicons of min_len to max_len
+    bases. Scan time is linear in the sequence length plus the number of hits.
 
-            matches.append({
-                "amplicon_sequence": amplicon_sequence,
-                "start_motif_seq": start_motif_seq,
-                "end_motif_seq": end_motif_seq,
-                "start_0": start_index_0_based,
-                "end_0": end_of_segment_0_based_exclusive,
-            })
+    Returns a list of dictionaries containing match details.
+    """
+    start_hits = motif_hits(sequence, regex_start)
+    end_hits = motif_hits(sequence, regex_end) if start_hits else []
+
+    return [
+        {
+            "amplicon_sequence": sequence[start_0:end_0],
+            "start_motif_seq": sequence[start_0:start_motif_end],
+            "end_motif_seq": sequence[end_motif_start:end_0],
+            "start_0": start_0,
+            "end_0": end_0,
+        }
+        for start_0, start_motif_end, end_motif_start, end_0 in pair_motif_hits(start_hits, end_hits, min_len, max_len)
+    ]
+
+
+def iupac_bitmask(code):
+    """Returns the BASE_BITS mask of the bases an IUPAC code stands for."""
+    mask = 0
+    for base in degenerate_bases(code.upper()):
+        mask |= int(BASE_BITS[ord(base)])
+    return mask
 
-            # Start the next search immediately after the end of the current full match
-            # to ensure non-overlapping amplicons.
-            current_search_start = end_of_segment_0_based_exclusive
+
+def approximate_motif_hits(sequence, degenerate_seq, max_mismatches, protect_3prime=0, three_prime_first=False):
+    """
+    Returns the (start_0, end_0_exclusive) spans of the windows of the sequence matching a degenerate
+    motif with at most max_mismatches mismatching bases, sorted by start.
+    The protect_3prime bases at the primer's 3' end must match exactly: the last bases of the motif,
+    or its first bases with three_prime_first=True (motif scanned as a reverse complement).
+
+    A matching window is dropped only when it overlaps a window with strictly fewer mismatches, so
+    a shifted window of a repeat cannot replace the exact site, while exact hits (and adjacent or
+    overlapping sites) are all kept, as with motif_hits:
+
+    >>> approximate_motif_hits('ACAC' + 'ACACACACGT', 'ACACACACGT', 2)
+    [(4, 14)]
+    >>> approximate_motif_hits('TTTTGATTACAGGATTACAGCCCC', 'GATTACAG', 1)
+    [(4, 12), (12, 20)]
+
+    The sequence is encoded as BASE_BITS masks once, then each motif column adds its mismatches to
+    every window with one NumPy mask comparison, i.e. O(motif length x contig length) vectorized
+    work whatever max_mismatches is.
+    """
+    motif_length = len(degenerate_seq)
+    window_count = len(sequence) - motif_length + 1
+    if not motif_length or window_count <= 0:
+        return []
+
+    bits = BASE_BITS[np.frombuffer(sequence.encode('ascii', errors='replace'), dtype=np.uint8)]
+    protected = min(protect_3prime, motif_length)
+    protected_columns = range(protected) if three_prime_first else range(motif_length - protected, motif_length)
+
+    mismatches = np.zeros(window_count, dtype=np.uint16)
+    protected_mismatch = np.zeros(window_count, dtype=bool)
+    for column, code in enumerate(degenerate_seq):
+        column_mismatch = (bits[column:column + window_count] & iupac_bitmask(code)) == 0
+        if column in protected_columns:
+            protected_mismatch |= column_mismatch
         else:
-            # If the start motif was found, but no end motif followed it,
-            # we must advance the search past the current start motif's starting position
-            # to look for the next possible pair.
-            current_search_start = start_index_0_based + 1
+            mismatches += column_mismatch
+
+    starts = np.flatnonzero((mismatches <= max_mismatches) & ~protected_mismatch)
+    # Fewest mismatches among the overlapping matching windows (k positions apart, for k < motif_length)
+    start_mismatches = mismatches[starts]
+    best_overlapping = start_mismatches.copy()
+    for k in range(1, len(starts)):
+        overlapping = starts[k:] - starts[:-k] < motif_length
+        if not overlapping.any():
+            break
+        np.minimum(best_overlapping[k:], np.where(overlapping, start_mismatches[:-k], max_mismatches),
+                   out=best_overlapping[k:])
+        np.minimum(best_overlapping[:-k], np.where(overlapping, start_mismatches[k:], max_mismatches),
+                   out=best_overlapping[:-k])
+    starts = starts[start_mismatches <= best_overlapping]
+    return [(start_0, start_0 + motif_length) for start_0 in starts.tolist()]
+
+
+def count_mismatches(matched_seq, degenerate_seq):
+    """Number of bases of a matched sequence not covered by the aligned code of the degenerate primer."""
+    return sum(base not in degenerate_bases(code) for base, code in zip(matched_seq.upper(), degenerate_seq.upper()))
+
+
+def forward_strand_hits(sequence, degenerate_seq, max_mismatches=0, protect_3prime=0):
+    """
+    Returns the hits of a degenerate motif on the forward strand, as spans sorted by start:
+    exact (regex) matches, or matches within max_mismatches (approximate_motif_hits).
+    """
+    if max_mismatches > 0:
+        return approximate_motif_hits(sequence, degenerate_seq.upper(), max_mismatches, protect_3prime)
+    return motif_hits(sequence, iupac_to_regex(degenerate_seq))
 
-    return matches
 
+def reverse_strand_hits(sequence, degenerate_seq, max_mismatches=0, protect_3prime=0):
+    """
+    Returns the hits of a degenerate motif on the reverse strand, as spans in reverse-strand
+    coordinates sorted by start, without building the reverse-complemented sequence: the forward
+    sequence is scanned for the reverse-complemented motif and each forward span [s, e) is mapped
+    to [L - e, L - s).
+    """
+    L = len(sequence)
+    rc_motif = reverse_complement_degenerate(degenerate_seq)
+    if max_mismatches > 0:
+        forward_hits = approximate_motif_hits(sequence, rc_motif, max_mismatches, protect_3prime,
+                                              three_prime_first=True)
+    else:
+        forward_hits = motif_hits(sequence, iupac_to_regex(rc_motif))
+    return [(L - end_0, L - start_0) for start_0, end_0 in reversed(forward_hits)]
 
-def find_and_extract(header, sequence, regex_start, regex_end, primer_start, primer_end):
+
+def find_and_extract(header, sequence, regex_start, regex_end, primer_start, primer_end, max_mismatches=0,
+                     protect_3prime=0, min_len=None, max_len=None):
     """
     Finds all non-overlapping regions on both forward and reverse strands, checking both motif orders (P1..P2 and P2..P1).
     Reports coordinates relative to the original (forward) sequence.
+
+    Motif hits are collected once per motif and strand, and shared by both motif orders.
+    With max_mismatches > 0 motifs may mismatch on up to that many bases, except on the
+    protect_3prime bases of their 3' end (approximate_motif_hits).
+    With min_len/max_len only amplicons of that length are reported (pair_motif_hits).
+    Reverse-strand hits come from scanning the forward sequence with the reverse-complemented
+    primers (reverse_strand_hits); only the reported motif and amplicon sequences are
+    reverse-complemented.
+    """
+    if max_mismatches > 0:
+        forward_start_hits = forward_strand_hits(sequence, primer_start, max_mismatches, protect_3prime)
+        forward_end_hits = forward_strand_hits(sequence, primer_end, max_mismatches, protect_3prime)
+    else:
+        forward_start_hits = motif_hits(sequence, regex_start)
+        forward_end_hits = motif_hits(sequence, regex_end)
+
+    return pair_strand_hits(
+        header, sequence, primer_start, primer_end,
+        forward_start_hits, forward_end_hits,
+        reverse_strand_hits(sequence, primer_start, max_mismatches, protect_3prime),
+        reverse_strand_hits(sequence, primer_end, max_mismatches, protect_3prime),
+        min_len, max_len,
+    )
+
+
+def pair_strand_hits(header, sequence, primer_start, primer_end, forward_start_hits, forward_end_hits,
+                     reverse_start_hits, reverse_end_hits, min_len=None, max_len=None):
+    """
+    Pairs the hits of P1 (primer_start) and P2 (primer_end) on both strands, in both motif orders,
+    into the find_and_extract() result dictionaries. Forward hits are spans of the sequence,
+    reverse hits spans in reverse-strand coordinates (see reverse_strand_hits), all sorted by start.
+    Amplicons are bounded to min_len..max_len bases when given.
     """
     all_results = []
     L = len(sequence)
-    rev_comp = reverse_complement(sequence)
 
-    # Define the four search combinations: (Template, Upstream_Regex, Downstream_Regex, Strand, Upstream_Primer_Input, Downstream_Primer_Input)
+    # Define the four search combinations: (Upstream_Hits, Downstream_Hits, Strand, Upstream_Primer_Input)
     search_combinations = [
         # 1. Forward Template, Order P_start..P_end
-        (sequence, regex_start, regex_end, "FORWARD", primer_start, primer_end),
+        (forward_start_hits, forward_end_hits, "FORWARD", primer_start),
 
         # 2. Forward Template, Order P_end..P_start
-        (sequence, regex_end, regex_start, "FORWARD", primer_end, primer_start),
+        (forward_end_hits, forward_start_hits, "FORWARD", primer_end),
 
         # 3. Reverse Template, Order P_start..P_end (RC matches)
-        (rev_comp, regex_start, regex_end, "REVERSE", primer_start, primer_end),
+        (reverse_start_hits, reverse_end_hits, "REVERSE", primer_start),
 
         # 4. Reverse Template, Order P_end..P_start (RC matches)
-        (rev_comp, regex_end, regex_start, "REVERSE", primer_end, primer_start),
+        (reverse_end_hits, reverse_start_hits, "REVERSE", primer_end),
     ]
 
-    for template, up_regex, down_regex, strand, up_primer_input, down_primer_input in search_combinations:
+    for up_hits, down_hits, strand, up_primer_input in search_combinations:
 
-        current_matches = find_all_matches_single_strand(template, up_regex, down_regex)
+        for start_0, up_end_0, down_start_0, end_0 in pair_motif_hits(up_hits, down_hits, min_len, max_len):
 
-        for m in current_matches:
-
-            # --- Coordinate Calculation ---
+            # --- Coordinate Calculation and Sequence Extraction ---
             if strand == "FORWARD":
                 # Coordinates are 1-based inclusive/exclusive
-                start_pos = m['start_0'] + 1
-                end_pos = m['end_0']
+                start_pos = start_0 + 1
+                end_pos = end_0
+                up_motif_seq = sequence[start_0:up_end_0]
+                down_motif_seq = sequence[down_start_0:end_0]
+                amplicon_sequence = sequence[start_0:end_0]
             else:  # strand == "REVERSE"
                 # Calculate coordinates in the original (forward) sequence (1-based)
                 # Match (R_start to R_end) in RC corresponds to segment (L - R_end) to (L - R_start) in FWD sequence.
-                start_pos = L - m['end_0'] + 1
-                end_pos = L - m['start_0']
+                start_pos = L - end_0 + 1
+                end_pos = L - start_0
+                up_motif_seq = reverse_complement(sequence[L - up_end_0:L - start_0])
+                down_motif_seq = reverse_complement(sequence[L - end_0:L - down_start_0])
+                amplicon_sequence = reverse_complement(sequence[L - end_0:L - start_0])
 
             # --- Matched Sequence Mapping ---
             # Map the motif sequences back to the original input primers (primer_start / primer_end)
 
             # If P_start was the UPSTREAM motif in this match:
             if up_primer_input == primer_start:
-                fwd_match_seq = m['start_motif_seq']
-                rev_match_seq = m['end_motif_seq']
+                fwd_match_seq = up_motif_seq
+                rev_match_seq = down_motif_seq
 
             # If P_end was the UPSTREAM motif in this match:
             else:  # up_primer_input == primer_end
-                fwd_match_seq = m['end_motif_seq']
-                rev_match_seq = m['start_motif_seq']
+                fwd_match_seq = down_motif_seq
+                rev_match_seq = up_motif_seq
 
             all_results.append({
                 "header": header,
@@ -203,20 +422,178 @@ def find_and_extract(header, sequence, regex_start, regex_end, primer_start, pri
                 "end_pos": end_pos,
                 "fwd_match_seq": fwd_match_seq,  # Sequence that matched primer_start (P1)
                 "rev_match_seq": rev_match_seq,  # Sequence that matched primer_end (P2)
-                "amplicon_sequence": m['amplicon_sequence'],
+                "fwd_mismatches": count_mismatches(fwd_match_seq, primer_start),
+                "rev_mismatches": count_mismatches(rev_match_seq, primer_end),
+                "amplicon_sequence": amplicon_sequence,
             })
 
     return all_results
 
 
+def degenerate_bases(code):
+    """Returns the bases an IUPAC code stands for ('' for characters that can never match)."""
+    if code in 'ACGT':
+        return code
+    return IUPAC_MAPPING.get(code, '[]')[1:-1]
+
+
+def choose_seed(degenerate_seq):
+    """
+    Returns (offset, length) of the seed of a degenerate motif: the window of at most SEED_LENGTH
+    bases with the fewest expansions, shortened until it has at most MAX_SEED_EXPANSIONS.
+    """
+    degeneracy = [len(degenerate_bases(code)) for code in degenerate_seq]
+    seed_length = min(SEED_LENGTH, len(degenerate_seq))
+    while True:
+        best = None
+        for offset in range(len(degenerate_seq) - seed_length + 1):
+            expansions = 1
+            for count in degeneracy[offset:offset + seed_length]:
+                expansions *= count
+            if best is None or expansions < best[0]:
+                best = (expansions, offset)
+        if best[0] <= MAX_SEED_EXPANSIONS or seed_length == 1:
+            return best[1], seed_length
+        seed_length -= 1
+
+
+class PrimerPanel:
+    """
+    Panel of named degenerate primer pairs searched together.
+
+    Every distinct motif (each primer, and its reverse complement for the reverse strand) is indexed
+    by the exact expansions of its least degenerate seed (choose_seed) in a single Aho-Corasick
+    automaton. A contig is scanned once for the whole panel; each seed hit is verified against the
+    full motif regex at its candidate start, then the hits of every pair are paired as in
+    find_and_extract.
+
+    With max_mismatches > 0 seeds could miss mismatching hits: each motif is then scanned with
+    approximate_motif_hits instead of the automaton.
+    """
+
+    def __init__(self, pairs, max_mismatches=0, protect_3prime=0, min_len=None, max_len=None):
+        # pairs: [(name, primer_start, primer_end), ...]
+        self.pairs = pairs
+        self.min_len = min_len
+        self.max_len = max_len
+        self.max_mismatches = max_mismatches
+        self.protect_3prime = protect_3prime
+        self._motif_ids = {}
+        self._motif_patterns = []
+        # (motif, is_reverse_complement) of every motif id
+        self._motifs = []
+        automaton = AhoCorasick()
+
+        for _, primer_start, primer_end in pairs:
+            for primer in (primer_start, primer_end):
+                for motif, is_reverse in ((primer.upper(), False), (reverse_complement_degenerate(primer), True)):
+                    # Keyed by orientation too: the protected 3' end differs for palindromic primers
+                    if (motif, is_reverse) in self._motif_ids:
+                        continue
+                    motif_id = len(self._motif_patterns)
+                    self._motif_ids[(motif, is_reverse)] = motif_id
+                    self._motif_patterns.append(re.compile(iupac_to_regex(motif)))
+                    self._motifs.append((motif, is_reverse))
+
+                    offset, seed_length = choose_seed(motif)
+                    seed_bases = [degenerate_bases(code) for code in motif[offset:offset + seed_length]]
+                    # Motifs with characters that match no base never hit (and are not indexed)
+                    for seed in product(*seed_bases):
+                        automaton.add(''.join(seed), (motif_id, offset))
+
+        self.automaton = automaton.build()
+
+    def scan(self, sequence):
+        """Returns the verified (start_0, end_0_exclusive) hits of every motif, sorted by start."""
+        if self.max_mismatches > 0:
+            return [
+                approximate_motif_hits(sequence, motif, self.max_mismatches, self.protect_3prime,
+                                       three_prime_first=is_reverse)
+                for motif, is_reverse in self._motifs
+            ]
+
+        hits = [[] for _ in self._motif_patterns]
+        patterns = self._motif_patterns
+        for seed_start, (motif_id, offset) in self.automaton.iter(sequence):
+            start_0 = seed_start - offset
+            if start_0 < 0:
+                continue
+            match = patterns[motif_id].match(sequence, start_0)
+            if match:
+                hits[motif_id].append(match.span())
+        # Seeds of a motif have a fixed offset and length: hits come in start order
+        return hits
+
+    def find_and_extract(self, header, sequence):
+        """
+        Returns [(pair_name, results)] for every pair of the panel, in panel order, results being
+        the find_and_extract() result dictionaries of the pair.
+        """
+        hits = self.scan(sequence)
+        L = len(sequence)
+
+        def forward_hits(primer):
+            return hits[self._motif_ids[(primer.upper(), False)]]
+
+        def reverse_hits(primer):
+            spans = hits[self._motif_ids[(reverse_complement_degenerate(primer), True)]]
+            return [(L - end_0, L - start_0) for start_0, end_0 in reversed(spans)]
+
+        return [
+            (name, pair_strand_hits(header, sequence, primer_start, primer_end,
+                                    forward_hits(primer_start), forward_hits(primer_end),
+                                    reverse_hits(primer_start), reverse_hits(primer_end), self.min_len, self.max_len))
+            for name, primer_start, primer_end in self.pairs
+        ]
+
+
+def read_primer_panel(panel_file):
+    """
+    Reads a primer panel TSV with a header holding the 'name', 'primer_start' and 'primer_end'
+    columns (other columns are ignored). Returns [(name, primer_start, primer_end), ...].
+    """
+    pairs = []
+    try:
+        with open(panel_file, 'r', newline='') as f:
+            reader = csv.DictReader((line for line in f if line.strip() and not line.startswith('#')),
+                                    delimiter='\t')
+            missing = {'name', 'primer_start', 'primer_end'} - set(reader.fieldnames or [])
+            if missing:
+                print(f"Error: Panel file {panel_file} is missing the column(s): {', '.join(sorted(missing))}")
+                sys.exit(1)
+            for row in reader:
+                pairs.append((row['name'].strip(), row['primer_start'].strip(), row['primer_end'].strip()))
+    except FileNotFoundError:
+        print(f"Error: Panel file not found at {panel_file}")
+        sys.exit(1)
+    return pairs
+
+
 def calculate_tm(sequence):
     """Calculates the Melting Temperature (Tm) using the Nearest Neighbor method."""
-    try:
-        # **CORRECTION: Explicitly pass the DNA_NN4 table dictionary from mt.**
-        # This bypasses potential issues where the internal lookup fails.
-        # We also need to explicitly pass the default standard conditions (1 M salt, 0 M Mg2+).
+    return calculate_tms([sequence])[0]
 
-        # Use the standard set of parameters defined in Biopython
+
+def calculate_tms(sequences):
+    """
+    Calculates the Nearest Neighbor Tm (DNA_NN4 table, Biopython Tm_NN defaults) of many sequences
+    in one vectorized, cached batch. Sequences the batch engine cannot handle (non-ACGT bases)
+    fall back to Biopython, which also yields the error strings for failing sequences.
+    """
+    tms = []
+    for sequence, tm_value in zip(sequences, melting_temperatures(sequences)):
+        if tm_value != tm_value:  # NaN
+            tms.append(calculate_tm_biopython(sequence))
+        else:
+            # Return the value rounded to 2 decimal places
+            tms.append(round(tm_value, 2))
+    return tms
+
+
+def calculate_tm_biopython(sequence):
+    """Calculates the Tm of one sequence with Biopython's Tm_NN (DNA_NN4 table)."""
+    try:
+        # Explicitly pass the DNA_NN4 table dictionary from mt.
         tm_value = mt.Tm_NN(
             Seq(sequence),
             nn_table=mt.DNA_NN4,  # Use the explicit dictionary object
@@ -232,10 +609,184 @@ def calculate_tm(sequence):
 
     except Exception as e:
         # Catch the generic error and return the specific exception type and message.
-        # This will now tell you why the internal Tm_NN logic is failing.
         return f"Error: {type(e).__name__}: {e}"
 
 
+class AmpliconSearch:
+    """
+    Search settings of a run (one primer pair, or a panel of named pairs) and the output rows of a
+    record. It is built from plain arguments so that every pool worker can build its own copy
+    (panel automaton included).
+    """
+
+    def __init__(self, output_filename, primer_start=None, primer_end=None, pairs=None, max_mismatches=0,
+                 protect_3prime=0, min_len=None, max_len=None):
+        self.output_filename = output_filename
+        self.primer_start = primer_start
+        self.primer_end = primer_end
+        self.max_mismatches = max_mismatches
+        self.protect_3prime = protect_3prime
+        self.min_len = min_len
+        self.max_len = max_len
+        self.panel = PrimerPanel(pairs, max_mismatches, protect_3prime, min_len, max_len) if pairs else None
+        if self.panel is None:
+            # Convert the degenerate sequences to their regex patterns
+            self.regex_start = iupac_to_regex(primer_start)
+            self.regex_end = iupac_to_regex(primer_end)
+
+    def header_row(self):
+        """Returns the header row of the output TSV."""
+        if self.panel is None:
+            header_row = [
+                "output file",
+                "filename",
+                "contig accession",
+                "strand",
+                "amplicon start",
+                "amplicon end",
+                "amplicon length",
+                f"P1 ({self.primer_start}) matched sequence",
+                f"P2 ({self.primer_end}) matched sequence",
+                f"Tm P1 ({self.primer_start})",
+                f"Tm P2 ({self.primer_end})",
+                "amplicon sequence"
+            ]
+        else:
+            # Primers differ per pair: the panel name identifies them
+            header_row = [
+                "output file",
+                "panel name",
+                "filename",
+                "contig accession",
+                "strand",
+                "amplicon start",
+                "amplicon end",
+                "amplicon length",
+                "P1 matched sequence",
+                "P2 matched sequence",
+                "Tm P1",
+                "Tm P2",
+                "amplicon sequence"
+            ]
+        if self.max_mismatches > 0:
+            # Mismatch counts follow the matched sequences
+            mismatch_column = header_row.index("amplicon length") + 3
+            header_row[mismatch_column:mismatch_column] = ["P1 mismatches", "P2 mismatches"]
+        return header_row
+
+    def record_rows(self, filename, header, sequence):
+        """Returns the output rows of every amplicon found in one record."""
+        if self.panel is None:
+            pair_results = [(None, find_and_extract(header, sequence, self.regex_start, self.regex_end,
+                                                    self.primer_start, self.primer_end, self.max_mismatches,
+                                                    self.protect_3prime, self.min_len, self.max_len))]
+        else:
+            pair_results = self.panel.find_and_extract(header, sequence)
+        results = [(name, result) for name, name_results in pair_results for result in name_results]
+
+        # Tm of every matched primer sequence of the record in one batch
+        tms = calculate_tms(
+            [result['fwd_match_seq'] for _, result in results] + [result['rev_match_seq'] for _, result in results]
+        )
+
+        rows = []
+        for index, (name, result) in enumerate(results):
+            # --- TM and LENGTH CALCULATION ---
+            tm_p1 = tms[index]
+            tm_p2 = tms[len(results) + index]
+            amplicon_length = len(result['amplicon_sequence'])
+            # --------------------------------
+
+            data_row = [
+                self.output_filename,
+                filename,
+                result['header'],
+                result['strand'],
+                result['start_pos'],
+                result['end_pos'],
+                amplicon_length,
+                result['fwd_match_seq'],  # Matched P1
+                result['rev_match_seq'],  # Matched P2
+                tm_p1,
+                tm_p2,
+                result['amplicon_sequence']
+            ]
+            if self.max_mismatches > 0:
+                data_row[9:9] = [result['fwd_mismatches'], result['rev_mismatches']]
+            if self.panel is not None:
+                data_row.insert(1, name)
+            rows.append(data_row)
+        return rows
+
+
+# Per-process search, set by _init_search_worker (in the main process too when running serially)
+_WORKER_STATE = {}
+
+
+def _init_search_worker(search_arguments):
+    """Pool initializer: each worker builds its own AmpliconSearch from the run's arguments."""
+    _WORKER_STATE['search'] = AmpliconSearch(**search_arguments)
+
+
+def _search_task(task):
+    """
+    Pool task: output rows of a batch of records of one file.
+    Returns (filepath, rows, record_count, base_count, end_of_file).
+    """
+    filepath, records, end_of_file = task
+    search = _WORKER_STATE['search']
+    filename = os.path.basename(filepath)
+    rows = []
+    for header, sequence in records:
+        rows.extend(search.record_rows(filename, header, sequence))
+    return filepath, rows, len(records), sum(len(sequence) for _, sequence in records), end_of_file
+
+
+def iter_search_tasks(file_paths, task_bases=TASK_BASES):
+    """
+    Streams the records of every file as (filepath, records, end_of_file) tasks of about task_bases
+    bases; the last task of each file (possibly without records) has end_of_file set.
+    """
+    for filepath in file_paths:
+        records = []
+        bases = 0
+        try:
+            for header, sequence in iter_fasta_records(filepath):
+                records.append((header, sequence))
+                bases += len(sequence)
+                if bases >= task_bases:
+                    yield filepath, records, False
+                    records = []
+                    bases = 0
+        except FileNotFoundError:
+            print(f"Error: File not found at {filepath}")
+        except Exception as e:
+            print(f"Error reading file {filepath}: {e}")
+        yield filepath, records, True
+
+
+def run_search_tasks(tasks, search_arguments, threads=1):
+    """
+    Yields the _search_task() result of every task, in task order. With threads > 1 tasks are
+    spread over a process pool of that size, with at most TASKS_PER_WORKER tasks per worker in
+    flight so that files are read no faster than they are searched.
+    """
+    if threads <= 1:
+        _init_search_worker(search_arguments)
+        for task in tasks:
+            yield _search_task(task)
+        return
+
+    with multiprocessing.Pool(threads, initializer=_init_search_worker, initargs=(search_arguments,)) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_search_task, (task,)))
+            if len(pending) >= threads * TASKS_PER_WORKER:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Search for all non-overlapping regions defined by two degenerate DNA sequences in FASTA files. Performs a symmetrical search (P1..P2 and P2..P1) on both strands. Reports metadata (including matched sequences) in a TSV file."
@@ -254,27 +805,93 @@ def main():
     parser.add_argument(
         "primer_start",
         type=str,
-        help="The degenerate sequence for the START motif (P1)."
+        nargs='?',
+        help="The degenerate sequence for the START motif (P1). Not used with --panel."
     )
     parser.add_argument(
         "primer_end",
         type=str,
-        help="The degenerate sequence for the END motif (P2)."
+        nargs='?',
+        help="The degenerate sequence for the END motif (P2). Not used with --panel."
+    )
+    parser.add_argument(
+        "--panel",
+        type=str,
+        default=None,
+        help="TSV of named primer pairs (header with 'name', 'primer_start' and 'primer_end' columns) searched "
+             "together in one pass per contig. Adds a 'panel name' column to the output."
+    )
+    parser.add_argument(
+        "--max_mismatches",
+        type=int,
+        default=0,
+        help="Maximum number of mismatching bases allowed per primer hit (default: 0, exact matches). "
+             "A hit overlapping a hit of the same primer with fewer mismatches is dropped. "
+             "Adds the mismatch count of each primer to the output."
+    )
+    parser.add_argument(
+        "--protect_3prime",
+        type=int,
+        default=0,
+        help="Number of bases at the 3' end of each primer that must match exactly with --max_mismatches "
+             "(default: 0)."
     )
 
-    args = parser.parse_args()
-
-    # Get primers from arguments
-    primer_start = args.primer_start
-    primer_end = args.primer_end
-
-    output_filename = os.path.basename(args.output)
-
-    # Convert the degenerate sequences to their regex patterns
-    regex_start = iupac_to_regex(primer_start)
-    regex_end = iupac_to_regex(primer_end)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of worker processes searching the records (default: 1). Output order is unchanged."
+    )
+    parser.add_argument(
+        "--min_len",
+        type=int,
+        default=None,
+        help="Minimum amplicon length (primers included) reported (default: no minimum)."
+    )
+    parser.add_argument(
+        "--max_len",
+        type=int,
+        default=None,
+        help="Maximum amplicon length (primers included) reported; longer matches are not amplicons "
+             "(default: no maximum)."
+    )
 
-    print(f"Searching for regions defined by motifs P1: '{primer_start}' and P2: '{primer_end}'")
+    args = parser.parse_args()
+    max_mismatches = max(0, args.max_mismatches)
+    if args.min_len is not None and args.max_len is not None and args.min_len > args.max_len:
+        parser.error("--min_len cannot be greater than --max_len")
+
+    search_arguments = {
+        'output_filename': os.path.basename(args.output),
+        'max_mismatches': max_mismatches,
+        'protect_3prime': args.protect_3prime,
+        'min_len': args.min_len,
+        'max_len': args.max_len,
+    }
+
+    if args.panel:
+        if args.primer_start or args.primer_end:
+            parser.error("primer_start/primer_end cannot be combined with --panel")
+        pairs = read_primer_panel(args.panel)
+        if not pairs:
+            print(f"Warning: No primer pairs found in the panel file '{args.panel}'.")
+            return
+        search_arguments['pairs'] = pairs
+        print(f"Searching for regions defined by {len(pairs)} primer pairs of panel '{args.panel}'")
+    elif args.primer_start and args.primer_end:
+        # Get primers from arguments
+        search_arguments['primer_start'] = args.primer_start
+        search_arguments['primer_end'] = args.primer_end
+        print(f"Searching for regions defined by motifs P1: '{args.primer_start}' and P2: '{args.primer_end}'")
+    else:
+        parser.error("primer_start and primer_end are required (or use --panel)")
+
+    if max_mismatches > 0:
+        print(f"Allowing up to {max_mismatches} mismatches per primer"
+              + (f" outside the {args.protect_3prime} 3' end bases" if args.protect_3prime > 0 else ""))
+    if args.min_len is not None or args.max_len is not None:
+        print(f"Reporting amplicons of {args.min_len or 0} to {args.max_len if args.max_len is not None else 'any'} bp")
 
     # Find all matching files
     file_paths = glob(args.fasta_pattern)
@@ -285,6 +902,11 @@ def main():
 
     # Process all found files and write results
     total_found = 0
+    file_found = 0
+    files_done = 0
+    total_records = 0
+    total_bases = 0
+    start_time = time.time()
 
     # Open the output file for TSV writing
     file_exists = os.path.exists(args.output)
@@ -295,63 +917,30 @@ def main():
 
         # Write the header row ONLY if the file is new or empty
         if not file_exists or os.path.getsize(args.output) == 0:
-            header_row = [
-                "output file",
-                "filename",
-                "contig accession",
-                "strand",
-                "amplicon start",
-                "amplicon end",
-                "amplicon length", # <-- NEW HEADER
-                f"P1 ({primer_start}) matched sequence",
-                f"P2 ({primer_end}) matched sequence",
-                f"Tm P1 ({primer_start})",
-                f"Tm P2 ({primer_end})",
-                "amplicon sequence"
-            ]
-            tsv_writer.writerow(header_row)
-
-        for filepath in file_paths:
-            # Extract only the filename from the path
-            filename = os.path.basename(filepath)
-
-            sequences = read_fasta_sequences(filepath)
-
-            for header, sequence in sequences.items():
-                results = find_and_extract(header, sequence, regex_start, regex_end, primer_start, primer_end)
-
-                for result in results:
-                    total_found += 1
-
-                    # --- TM and LENGTH CALCULATION ---
-                    tm_p1 = calculate_tm(result['fwd_match_seq'])
-                    tm_p2 = calculate_tm(result['rev_match_seq'])
-                    amplicon_length = len(result['amplicon_sequence'])
-                    # --------------------------------
-
-                    # Write the data row to the TSV file
-                    data_row = [
-                        output_filename,
-                        filename,
-                        result['header'],
-                        result['strand'],
-                        result['start_pos'],
-                        result['end_pos'],
-                        amplicon_length, # <-- NEW VALUE
-                        result['fwd_match_seq'],  # Matched P1
-                        result['rev_match_seq'],  # Matched P2
-                        tm_p1,
-                        tm_p2,
-                        result['amplicon_sequence']
-                    ]
-                    tsv_writer.writerow(data_row)
-
-            print(f"Finished processing {filename}. Matches found in this file.")
+            tsv_writer.writerow(AmpliconSearch(**search_arguments).header_row())
+
+        # Records are searched (in parallel with --threads) and written back in file and record order
+        for filepath, rows, record_count, base_count, end_of_file in run_search_tasks(
+                iter_search_tasks(file_paths), search_arguments, args.threads):
+            tsv_writer.writerows(rows)
+            file_found += len(rows)
+            total_found += len(rows)
+            total_records += record_count
+            total_bases += base_count
+
+            if end_of_file:
+                files_done += 1
+                elapsed = max(time.time() - start_time, 1e-6)
+                print(f"Finished processing {os.path.basename(filepath)}. {file_found} matches found in this file. "
+                      f"[{files_done}/{len(file_paths)} files, {total_records} records, "
+                      f"{total_bases / 1e6:.1f} Mb, {total_bases / 1e6 / elapsed:.1f} Mb/s]")
+                file_found = 0
 
     print("-" * 50)
-    print(f"Done. Found {total_found} total extracted regions across {len(file_paths)} files.")
+    print(f"Done. Found {total_found} total extracted regions across {len(file_paths)} files "
+          f"({total_records} records, {total_bases / 1e6:.1f} Mb in {time.time() - start_time:.1f} s).")
     print(f"Results saved to TSV file: {args.output}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+from glob import glob
+
+import numpy as np
+
+from fasta_index import IndexedFasta
+from find_kmer_positions import read_kmer_entries
+from positions_io import DEFAULT_CHUNK_SIZE, POSITION_COLUMNS, open_positions_writer, positions_output_file
+
+INDEX_VERSION = 1
+DEFAULT_KMER_SIZE = 21
+# Largest k whose 2-bit code fits in an unsigned 64-bit integer
+MAX_KMER_SIZE = 31
+# Number of on-disk buckets (by leading bases of the canonical code) used to sort the index externally
+DEFAULT_BUCKET_BITS = 6
+
+# Orientation flags stored per occurrence
+ORIENT_FORWARD = 1  # the contig's forward k-mer is the canonical one
+ORIENT_REVERSE = 2  # the contig's reverse complement k-mer is the canonical one (both set for palindromes)
+
+# One occurrence as stored in the temporary bucket files
+OCCURRENCE_DTYPE = np.dtype([('code', '<u8'), ('contig', '<u4'), ('position', '<u4'), ('orient', 'u1')])
+
+# ASCII byte -> 2-bit base code, 4 for anything that is not A/C/G/T
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    _BASE_CODES[ord(_base)] = _code
+    _BASE_CODES[ord(_base.lower())] = _code
+
+
+def encode_kmer(kmer_seq):
+    """Returns the 2-bit code of an A/C/G/T k-mer, or None if it contains another character."""
+    code = 0
+    for base in kmer_seq:
+        base_code = 'ACGT'.find(base)
+        if base_code < 0:
+            return None
+        code = (code << 2) | base_code
+    return code
+
+
+def contig_kmer_codes(sequence, k):
+    """
+    Computes the canonical 2-bit code and orientation flags of every k-mer of a contig.
+    K-mers overlapping a non-ACGT character are skipped.
+    Returns (codes, positions, orient) arrays.
+    """
+    bases = _BASE_CODES[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+    kmer_count = len(bases) - k + 1
+    if kmer_count <= 0:
+        empty = np.empty(0, dtype=np.uint64)
+        return empty, empty.astype(np.uint32), empty.astype(np.uint8)
+
+    # A window is valid when it holds no non-ACGT base
+    invalid = np.concatenate([[0], np.cumsum(bases == 4)])
+    valid = (invalid[k:] - invalid[:kmer_count]) == 0
+
+    codes = bases.astype(np.uint64) & np.uint64(3)
+    forward = np.zeros(kmer_count, dtype=np.uint64)
+    reverse = np.zeros(kmer_count, dtype=np.uint64)
+    for offset in range(k):
+        window = codes[offset:offset + kmer_count]
+        forward = (forward << np.uint64(2)) | window
+        reverse |= (np.uint64(3) - window) << np.uint64(2 * offset)
+
+    canonical = np.minimum(forward, reverse)
+    orient = np.where(forward == canonical, ORIENT_FORWARD, 0) | np.where(reverse == canonical, ORIENT_REVERSE, 0)
+
+    positions = np.flatnonzero(valid).astype(np.uint32)
+    return canonical[valid], positions, orient[valid].astype(np.uint8)
+
+
+def list_assembly_fastas(fasta_dir, assembly_ext):
+    """Returns [(assembly_name, fasta_path)] for every <assembly><assembly_ext> file, sorted by name."""
+    fasta_paths = sorted(glob(os.path.join(fasta_dir, f"*{assembly_ext}")))
+    return [(os.path.basename(path)[:-len(assembly_ext)], path) for path in fasta_paths]
+
+
+def build_kmer_index(fasta_dir, assembly_ext, index_dir, k=DEFAULT_KMER_SIZE, bucket_bits=DEFAULT_BUCKET_BITS):
+    """
+    Builds a persistent k-mer position index over every whole-assembly FASTA of fasta_dir.
+
+    Each canonical k-mer occurrence is stored as (code, contig, position, orientation) in
+    columnar .npy files sorted by code, so any batch of k-mers is answered by binary search
+    without rescanning sequences. Sorting is done externally: occurrences are first spread over
+    2**bucket_bits bucket files by their leading bases, then each bucket is sorted in memory.
+    """
+    if not 1 <= k <= MAX_KMER_SIZE:
+        print(f"Error: k must be between 1 and {MAX_KMER_SIZE}.")
+        sys.exit(1)
+
+    assemblies = list_assembly_fastas(fasta_dir, assembly_ext)
+    if not assemblies:
+        print(f"Error: No files matching '*{assembly_ext}' found in {fasta_dir}.")
+        sys.exit(1)
+
+    os.makedirs(index_dir, exist_ok=True)
+    bucket_dir = os.path.join(index_dir, 'buckets.tmp')
+    os.makedirs(bucket_dir, exist_ok=True)
+
+    bucket_bits = min(bucket_bits, 2 * k)
+    bucket_shift = np.uint64(2 * k - bucket_bits)
+    bucket_count = 1 << bucket_bits
+    bucket_handles = [open(os.path.join(bucket_dir, f"{bucket}.bin"), 'wb') for bucket in range(bucket_count)]
+    bucket_sizes = np.zeros(bucket_count, dtype=np.int64)
+
+    # 1. Scan every contig once and spread its occurrences over the bucket files
+    contigs = []
+    try:
+        for assembly_name, fasta_path in assemblies:
+            print(f"Indexing k-mers of {assembly_name}...")
+            indexed_fasta = IndexedFasta(fasta_path)
+            for contig_name, entry in indexed_fasta.entries.items():
+                contig_id = len(contigs)
+                contigs.append((assembly_name, contig_name, entry.length))
+
+                codes, positions, orient = contig_kmer_codes(indexed_fasta.fetch(contig_name), k)
+                if not len(codes):
+                    continue
+
+                occurrences = np.empty(len(codes), dtype=OCCURRENCE_DTYPE)
+                occurrences['code'] = codes
+                occurrences['contig'] = contig_id
+                occurrences['position'] = positions
+                occurrences['orient'] = orient
+
+                buckets = (codes >> bucket_shift).astype(np.int64)
+                order = np.argsort(buckets, kind='stable')
+                bounds = np.searchsorted(buckets[order], np.arange(bucket_count + 1))
+                for bucket in np.flatnonzero(np.diff(bounds)):
+                    bucket_handles[bucket].write(occurrences[order[bounds[bucket]:bounds[bucket + 1]]].tobytes())
+                bucket_sizes += np.diff(bounds)
+            indexed_fasta.close()
+    finally:
+        for handle in bucket_handles:
+            handle.close()
+
+    # 2. Sort each bucket by (code, contig, position) and append it to the final columnar arrays
+    total = int(bucket_sizes.sum())
+    print(f"Sorting {total} k-mer occurrences from {len(contigs)} contigs...")
+    columns = {
+        'codes': np.lib.format.open_memmap(os.path.join(index_dir, 'codes.npy'), 'w+', np.uint64, (total,)),
+        'contigs': np.lib.format.open_memmap(os.path.join(index_dir, 'contig_ids.npy'), 'w+', np.uint32, (total,)),
+        'positions': np.lib.format.open_memmap(os.path.join(index_dir, 'positions.npy'), 'w+', np.uint32, (total,)),
+        'orient': np.lib.format.open_memmap(os.path.join(index_dir, 'orient.npy'), 'w+', np.uint8, (total,)),
+    }
+
+    offset = 0
+    for bucket in range(bucket_count):
+        occurrences = np.fromfile(os.path.join(bucket_dir, f"{bucket}.bin"), dtype=OCCURRENCE_DTYPE)
+        if not len(occurrences):
+            continue
+        occurrences = occurrences[np.lexsort((occurrences['position'], occurrences['contig'], occurrences['code']))]
+        end = offset + len(occurrences)
+        columns['codes'][offset:end] = occurrences['code']
+        columns['contigs'][offset:end] = occurrences['contig']
+        columns['positions'][offset:end] = occurrences['position']
+        columns['orient'][offset:end] = occurrences['orient']
+        offset = end
+
+    for column in columns.values():
+        column.flush()
+    shutil.rmtree(bucket_dir)
+
+    with open(os.path.join(index_dir, 'contigs.tsv'), 'w') as f:
+        f.write("contig_id\tassembly\tcontig\tlength\n")
+        for contig_id, (assembly_name, contig_name, length) in enumerate(contigs):
+            f.write(f"{contig_id}\t{assembly_name}\t{contig_name}\t{length}\n")
+
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': INDEX_VERSION,
+            'k': k,
+            'occurrences': total,
+            'contigs': len(contigs),
+            'assemblies': len(assemblies),
+            'assembly_ext': assembly_ext,
+        }, f, indent=2)
+
+    print(f"\nIndex complete: {total} occurrences of {k}-mers saved to {index_dir}")
+
+
+class KmerPositionIndex:
+    """Read-only, memory-mapped view of an index written by build_kmer_index()."""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {self.meta.get('version')} in {index_dir}.")
+
+        self.k = self.meta['k']
+        self.codes = np.load(os.path.join(index_dir, 'codes.npy'), mmap_mode='r')
+        self.contig_ids = np.load(os.path.join(index_dir, 'contig_ids.npy'), mmap_mode='r')
+        self.positions = np.load(os.path.join(index_dir, 'positions.npy'), mmap_mode='r')
+        self.orient = np.load(os.path.join(index_dir, 'orient.npy'), mmap_mode='r')
+
+        # 'assembly.contig' pair name -> contig id
+        self.pair_ids = {}
+        with open(os.path.join(index_dir, 'contigs.tsv')) as f:
+            next(f)
+            for line in f:
+                contig_id, assembly_name, contig_name, _ = line.rstrip('\n').split('\t')
+                self.pair_ids[f"{assembly_name}.{contig_name}"] = int(contig_id)
+
+    def lookup(self, canonical_codes):
+        """Returns the [start, end) row ranges of each canonical code, by binary search."""
+        canonical_codes = np.asarray(canonical_codes, dtype=np.uint64)
+        return (np.searchsorted(self.codes, canonical_codes, side='left'),
+                np.searchsorted(self.codes, canonical_codes, side='right'))
+
+
+def query_index(index_dir, tsv_file, output_file=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Answers a k-mer TSV (seq, contigs) from a prebuilt index and writes the same positions TSV
+    as find_kmer_positions.py (k-mer order, listed contigs only, '+' hits before '-' hits).
+    """
+    if output_file is None:
+        output_file = positions_output_file(tsv_file)
+
+    index = KmerPositionIndex(index_dir)
+    k = index.k
+    kmer_entries, _ = read_kmer_entries(tsv_file)
+
+    # 1. Encode every k-mer and look up all of them in one vectorized binary search
+    forward_codes = []
+    for kmer_seq, _, _ in kmer_entries:
+        code = encode_kmer(kmer_seq) if len(kmer_seq) == k else None
+        if code is None:
+            print(f"Warning: k-mer {kmer_seq} is not a {k}-mer over A/C/G/T. Skipping.")
+        forward_codes.append(code)
+
+    reverse_codes = [
+        encode_kmer(rev_comp_seq) if code is not None else None
+        for code, (_, rev_comp_seq, _) in zip(forward_codes, kmer_entries)
+    ]
+    canonical_codes = [min(f, r) if f is not None else 0 for f, r in zip(forward_codes, reverse_codes)]
+    starts, ends = index.lookup(canonical_codes)
+
+    # 2. Emit hits restricted to the contigs listed for each k-mer
+    print(f"Querying {len(kmer_entries)} k-mers against {index.meta['occurrences']} indexed occurrences...")
+    with open_positions_writer(output_file, POSITION_COLUMNS, chunk_size) as writer:
+        for kmer_index, (kmer_seq, _, contig_pairs) in enumerate(kmer_entries):
+            forward_code = forward_codes[kmer_index]
+            if forward_code is None or starts[kmer_index] == ends[kmer_index]:
+                continue
+
+            rows = slice(starts[kmer_index], ends[kmer_index])
+            hit_contigs = np.asarray(index.contig_ids[rows])
+            hit_positions = np.asarray(index.positions[rows])
+            hit_orient = np.asarray(index.orient[rows])
+
+            # The occurrence equals the k-mer itself ('+') when its orientation matches the k-mer's
+            # and to the reverse complement ('-') otherwise. Palindromic k-mers are reported on '-' only,
+            # like find_kmer_positions.py
+            if forward_code == reverse_codes[kmer_index]:
+                kmer_orient, rev_comp_orient = 0, ORIENT_FORWARD | ORIENT_REVERSE
+            elif forward_code == canonical_codes[kmer_index]:
+                kmer_orient, rev_comp_orient = ORIENT_FORWARD, ORIENT_REVERSE
+            else:
+                kmer_orient, rev_comp_orient = ORIENT_REVERSE, ORIENT_FORWARD
+
+            for pair_clean, assembly_name, contig_id in contig_pairs:
+                index_contig_id = index.pair_ids.get(pair_clean)
+                if index_contig_id is None:
+                    continue
+
+                on_contig = hit_contigs == index_contig_id
+                for strand, strand_orient in (('+', kmer_orient), ('-', rev_comp_orient)):
+                    for position in hit_positions[on_contig & ((hit_orient & strand_orient) != 0)]:
+                        writer.write((kmer_seq, assembly_name, contig_id, int(position), strand))
+
+    print(f"\nQuery complete. {writer.rows_written} hits saved to {output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds a persistent k-mer position index over a set of assembly FASTA files and answers "
+                    "k-mer position queries from it, producing the same TSV as find_kmer_positions.py."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Index every k-mer of the assemblies in a directory.")
+    build_parser.add_argument('fasta_dir', help="Directory containing one FASTA file per assembly.")
+    build_parser.add_argument('index_dir', help="Output directory of the index.")
+    build_parser.add_argument(
+        '--assembly_ext',
+        default='.fna',
+        help="Extension of the assembly FASTA files, plain or bgzip; the assembly name is the file name "
+             "without it (default: .fna)."
+    )
+    build_parser.add_argument(
+        '-k', '--kmer_size',
+        type=int,
+        default=DEFAULT_KMER_SIZE,
+        help=f"K-mer length, at most {MAX_KMER_SIZE} (default: {DEFAULT_KMER_SIZE})."
+    )
+    build_parser.add_argument(
+        '--bucket_bits',
+        type=int,
+        default=DEFAULT_BUCKET_BITS,
+        help=f"Log2 of the number of temporary buckets used to sort the index (default: {DEFAULT_BUCKET_BITS})."
+    )
+
+    query_parser = subparsers.add_parser('query', help="Emit the positions TSV of a k-mer list.")
+    query_parser.add_argument('index_dir', help="Directory of an index created with 'build'.")
+    query_parser.add_argument('tsv_file', help="TSV file containing k-mers ('seq' and 'contigs' columns).")
+    query_parser.add_argument(
+        '--output_file',
+        default=None,
+        help="Output positions file; a .npz or .parquet extension selects the columnar format "
+             "(default: <tsv_file>_positions.tsv, as find_kmer_positions.py)."
+    )
+    query_parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of hit rows buffered before each write (default: {DEFAULT_CHUNK_SIZE})."
+    )
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_kmer_index(args.fasta_dir, args.assembly_ext, args.index_dir, args.kmer_size, args.bucket_bits)
+    else:
+        query_index(args.index_dir, args.tsv_file, args.output_file, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
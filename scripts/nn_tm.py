@@ -0,0 +1,221 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+from Bio.SeqUtils import MeltingTemp as mt
+
+# Nearest-neighbor table (Allawi & SantaLucia 1997) and the Bio.SeqUtils.MeltingTemp.Tm_NN defaults:
+# 25 nM of each strand, 50 mM Na+, salt correction method 5, no self-complementarity
+NN_TABLE = mt.DNA_NN4
+DNA_CONC_1 = 25
+DNA_CONC_2 = 25
+NA_MM = 50
+GAS_CONSTANT = 1.987
+
+# NN table values have one decimal; enthalpy/entropy sums are computed exactly as integers in tenths
+NN_SCALE = 10
+
+BASES = 'ACGT'
+COMPLEMENT = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
+# Code of padding and of any non-ACGT character
+INVALID_CODE = 4
+
+# ASCII byte -> base code (A=0, C=1, G=2, T=3, case-insensitive), INVALID_CODE for every other byte
+ENCODE_TABLE = np.full(256, INVALID_CODE, dtype=np.int8)
+for _code, _base in enumerate(BASES):
+    ENCODE_TABLE[ord(_base)] = _code
+    ENCODE_TABLE[ord(_base.lower())] = _code
+
+# Oligos encoded per vectorized pass
+BATCH_SIZE = 65536
+
+# Entries of the default-conditions Tm cache (primers recur across contigs and files)
+DEFAULT_CACHE_SIZE = 100000
+
+
+def _scaled(value):
+    return round(value * NN_SCALE)
+
+
+class NNParameters:
+    """
+    Nearest-neighbor parameters of a Tm_NN table as integer arrays in tenths:
+    step_h/step_s[5 * base + next_base] (zero when either code is INVALID_CODE), the general
+    initiation, the terminal base pair term per base, the 5'T/3'A penalty and the allA/T and
+    oneG/C terms. Steps are looked up like Tm_NN does (key, then reversed key).
+    """
+
+    def __init__(self, nn_table):
+        self.step_h = np.zeros(25, dtype=np.int64)
+        self.step_s = np.zeros(25, dtype=np.int64)
+        self.steps = {}
+        for code, base in enumerate(BASES):
+            for next_code, next_base in enumerate(BASES):
+                key = f"{base}{next_base}/{COMPLEMENT[base]}{COMPLEMENT[next_base]}"
+                delta_h, delta_s = nn_table[key] if key in nn_table else nn_table[key[::-1]]
+                self.steps[(base, next_base)] = (_scaled(delta_h), _scaled(delta_s))
+                self.step_h[5 * code + next_code] = _scaled(delta_h)
+                self.step_s[5 * code + next_code] = _scaled(delta_s)
+
+        self.init = tuple(_scaled(value) for value in nn_table['init'])
+        self.terminal = {
+            base: tuple(_scaled(value) for value in nn_table['init_A/T' if base in 'AT' else 'init_G/C'])
+            for base in BASES
+        }
+        self.terminal_t = tuple(_scaled(value) for value in nn_table['init_5T/A'])
+        self.gc_content = {
+            True: tuple(_scaled(value) for value in nn_table['init_oneG/C']),
+            False: tuple(_scaled(value) for value in nn_table['init_allA/T']),
+        }
+
+        # Per base code arrays (INVALID_CODE rows are zero)
+        self.terminal_h = np.array([self.terminal[base][0] for base in BASES] + [0], dtype=np.int64)
+        self.terminal_s = np.array([self.terminal[base][1] for base in BASES] + [0], dtype=np.int64)
+
+
+_PARAMETERS = {}
+
+
+def nn_parameters(nn_table=NN_TABLE):
+    """Returns the (memoized) NNParameters of a nearest-neighbor table."""
+    parameters = _PARAMETERS.get(id(nn_table))
+    if parameters is None:
+        parameters = NNParameters(nn_table)
+        _PARAMETERS[id(nn_table)] = parameters
+    return parameters
+
+
+def salt_correction(lengths, Na=NA_MM, K=0, Tris=0, Mg=0, dNTPs=0):
+    """
+    Entropy salt correction of Tm_NN (method 5, Owczarzy 2004) for oligos of the given lengths,
+    with the monovalent ion equivalent of Bio.SeqUtils.MeltingTemp.salt_correction (mM inputs).
+    """
+    monovalent = Na + K + Tris / 2.0
+    if sum((K, Mg, Tris, dNTPs)) > 0 and dNTPs < Mg:
+        monovalent += 120 * math.sqrt(Mg - dNTPs)
+    return 0.368 * (np.asarray(lengths) - 1) * math.log(monovalent * 1e-3)
+
+
+def concentration_term(dnac1=DNA_CONC_1, dnac2=DNA_CONC_2):
+    """Entropy-side strand concentration term R ln(c) of the Tm_NN formula (non self-complementary)."""
+    return GAS_CONSTANT * math.log((dnac1 - dnac2 / 2.0) * 1e-9)
+
+
+def thermo_to_tm(delta_h, delta_s, salt_corr, dnac1=DNA_CONC_1, dnac2=DNA_CONC_2):
+    """
+    Melting temperature (degrees C) from total enthalpy and entropy in tenths (scalars or arrays),
+    with the entropy salt correction already computed, using the Tm_NN formula.
+    """
+    log_term = concentration_term(dnac1, dnac2)
+    total_h = np.asarray(delta_h) / NN_SCALE
+    total_s = np.asarray(delta_s) / NN_SCALE + salt_corr
+    return (1000 * total_h) / (total_s + log_term) - 273.15
+
+
+def encode_oligos(sequences):
+    """
+    Encodes oligos as an (n, max_length) int8 array of base codes padded with INVALID_CODE.
+    Returns (codes, lengths, valid), valid being False for empty oligos or non-ACGT characters.
+    """
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+    width = int(lengths.max()) if len(lengths) else 0
+    codes = np.full((len(sequences), max(width, 1)), INVALID_CODE, dtype=np.int8)
+    for row, sequence in enumerate(sequences):
+        if sequence:
+            codes[row, :len(sequence)] = ENCODE_TABLE[np.frombuffer(sequence.encode('ascii', errors='replace'),
+                                                                   dtype=np.uint8)]
+    invalid_bases = (codes == INVALID_CODE).sum(axis=1) - (codes.shape[1] - lengths)
+    return codes, lengths, (lengths > 0) & (invalid_bases == 0)
+
+
+def tm_nn_batch(sequences, nn_table=NN_TABLE, dnac1=DNA_CONC_1, dnac2=DNA_CONC_2, Na=NA_MM, K=0, Tris=0, Mg=0,
+                dNTPs=0):
+    """
+    Nearest-neighbor Tm of many oligos (equal or mixed lengths) in vectorized passes, matching
+    Bio.SeqUtils.MeltingTemp.Tm_NN(seq, nn_table=nn_table) with the same conditions (salt
+    correction method 5, perfect complement, not self-complementary).
+    Returns a float64 array; NaN for empty oligos or oligos with non-ACGT characters.
+    """
+    parameters = nn_parameters(nn_table)
+    sequences = list(sequences)
+    tms = np.full(len(sequences), np.nan)
+
+    for batch_start in range(0, len(sequences), BATCH_SIZE):
+        codes, lengths, valid = encode_oligos(sequences[batch_start:batch_start + BATCH_SIZE])
+        codes = codes.astype(np.int64)
+        rows = np.arange(len(lengths))
+
+        # Zipping: every adjacent pair inside the oligo (padding steps are zero)
+        step_index = 5 * codes[:, :-1] + codes[:, 1:]
+        delta_h = parameters.step_h[step_index].sum(axis=1)
+        delta_s = parameters.step_s[step_index].sum(axis=1)
+
+        # Initiation: general term, terminal base pairs, 5'T/3'A penalties, allA/T vs oneG/C
+        first = codes[:, 0]
+        last = codes[rows, np.maximum(lengths - 1, 0)]
+        has_gc = ((codes == 1) | (codes == 2)).any(axis=1)
+        delta_h = (delta_h + parameters.init[0] + parameters.terminal_h[first] + parameters.terminal_h[last]
+                   + parameters.terminal_t[0] * ((first == 3).astype(np.int64) + (last == 0))
+                   + np.where(has_gc, parameters.gc_content[True][0], parameters.gc_content[False][0]))
+        delta_s = (delta_s + parameters.init[1] + parameters.terminal_s[first] + parameters.terminal_s[last]
+                   + parameters.terminal_t[1] * ((first == 3).astype(np.int64) + (last == 0))
+                   + np.where(has_gc, parameters.gc_content[True][1], parameters.gc_content[False][1]))
+
+        salt_corr = salt_correction(lengths, Na, K, Tris, Mg, dNTPs)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            batch_tms = thermo_to_tm(delta_h, delta_s, salt_corr, dnac1, dnac2)
+        tms[batch_start:batch_start + len(lengths)] = np.where(valid, batch_tms, np.nan)
+
+    return tms
+
+
+class TmCache:
+    """
+    LRU cache in front of tm_nn_batch (default Tm_NN conditions and DNA_NN4 table):
+    uncached oligos of a request are computed together in one batch.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def melting_temperatures(self, sequences):
+        """Returns the Tm of every oligo as a list of floats (NaN for invalid oligos)."""
+        sequences = [sequence.upper() for sequence in sequences]
+        missing = list(dict.fromkeys(sequence for sequence in sequences if sequence not in self._entries))
+        self.misses += len(missing)
+        self.hits += len(sequences) - len(missing)
+
+        computed = dict(zip(missing, tm_nn_batch(missing).tolist())) if missing else {}
+        results = []
+        for sequence in sequences:
+            tm = computed.get(sequence)
+            if tm is None:
+                tm = self._entries[sequence]
+                self._entries.move_to_end(sequence)
+            results.append(tm)
+
+        for sequence, tm in computed.items():
+            self._entries[sequence] = tm
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return results
+
+    def melting_temperature(self, sequence):
+        return self.melting_temperatures([sequence])[0]
+
+
+# Shared default cache
+TM_CACHE = TmCache()
+
+
+def melting_temperatures(sequences):
+    """Cached nearest-neighbor Tm (DNA_NN4, Tm_NN defaults) of many oligos, as a list of floats."""
+    return TM_CACHE.melting_temperatures(sequences)
+
+
+def melting_temperature(sequence):
+    """Cached nearest-neighbor Tm (DNA_NN4, Tm_NN defaults) of one oligo."""
+    return TM_CACHE.melting_temperature(sequence)
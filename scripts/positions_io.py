@@ -0,0 +1,375 @@
+import csv
+import os
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Columns of the k-mer positions table, in order
+POSITION_COLUMNS = ['seq', 'assembly', 'contig', 'position', 'strand']
+# Columns stored dictionary-encoded (integer codes + sorted dictionary of values)
+CATEGORICAL_COLUMNS = ['seq', 'assembly', 'contig', 'strand']
+
+# Default number of rows buffered before each write
+DEFAULT_CHUNK_SIZE = 100000
+
+# Supported output formats, by file extension
+POSITION_FORMATS = {'tsv': '.tsv', 'npz': '.npz', 'parquet': '.parquet'}
+
+NPZ_FORMAT_VERSION = 1
+
+
+def positions_format(path):
+    """Returns the positions format ('tsv', 'npz' or 'parquet') implied by a file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for name, format_extension in POSITION_FORMATS.items():
+        if extension == format_extension:
+            return name
+    return 'tsv'
+
+
+class ChunkedTsvWriter:
+    """
+    Writes position rows to a TSV file, buffering at most chunk_size rows in memory
+    before appending them to disk.
+    """
+
+    def __init__(self, output_file, columns=POSITION_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.output_file = output_file
+        self.chunk_size = max(1, chunk_size)
+        self.rows_written = 0
+        self._buffer = []
+        self._handle = open(output_file, 'w', newline='')
+        self._writer = csv.writer(self._handle, delimiter='\t', lineterminator='\n')
+        self._writer.writerow(columns)
+
+    def write(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._writer.writerows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ColumnarPositionsWriter:
+    """
+    Writes position rows as dictionary-encoded integer columns, either as a compressed .npz
+    archive or as a Parquet file (categorical columns, requires pyarrow).
+
+    Rows are buffered chunk_size at a time, so memory stays bounded like the TSV writer:
+    - Parquet: every chunk is written as a row group with its own sorted dictionaries.
+    - npz: every chunk's integer codes are appended to one temporary file per column (next to the
+      output); on close the columns are streamed into the archive, codes remapped so they follow
+      the sorted value order.
+    Only the dictionaries (each distinct k-mer, assembly and contig string once) stay in memory.
+    """
+
+    def __init__(self, output_file, columns=POSITION_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE):
+        if list(columns) != POSITION_COLUMNS:
+            raise ValueError(f"Columnar output only supports the {POSITION_COLUMNS} columns.")
+        self.output_file = output_file
+        self.output_format = positions_format(output_file)
+        self.chunk_size = max(1, chunk_size)
+        self.rows_written = 0
+        self._dictionaries = {column: {} for column in CATEGORICAL_COLUMNS}
+        # Values of each dictionary by code (insertion order)
+        self._values = {column: [] for column in CATEGORICAL_COLUMNS}
+        self._buffer = {column: [] for column in POSITION_COLUMNS}
+
+        if self.output_format == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                print(f"Error: Parquet output requires pyarrow ({e}). Use the .npz format instead.")
+                sys.exit(1)
+            self._pa = pa
+            self._schema = pa.schema([
+                (column, pa.int64() if column == 'position' else pa.dictionary(pa.int32(), pa.string()))
+                for column in POSITION_COLUMNS
+            ])
+            self._parquet_writer = pq.ParquetWriter(output_file, self._schema)
+        else:
+            spill_dir = os.path.dirname(os.path.abspath(output_file))
+            self._spills = {column: tempfile.TemporaryFile(dir=spill_dir) for column in POSITION_COLUMNS}
+
+    def write(self, row):
+        for column, value in zip(POSITION_COLUMNS, row):
+            dictionary = self._dictionaries.get(column)
+            if dictionary is not None:
+                code = dictionary.get(value)
+                if code is None:
+                    code = dictionary[value] = len(dictionary)
+                    self._values[column].append(value)
+                value = code
+            self._buffer[column].append(value)
+        if len(self._buffer['position']) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer['position']:
+            return
+        self.rows_written += len(self._buffer['position'])
+        chunk = {
+            column: np.asarray(values, dtype=np.int64 if column == 'position' else np.int32)
+            for column, values in self._buffer.items()
+        }
+        self._buffer = {column: [] for column in POSITION_COLUMNS}
+
+        if self.output_format == 'parquet':
+            self._write_row_group(chunk)
+        else:
+            for column, data in chunk.items():
+                data.tofile(self._spills[column])
+
+    def _write_row_group(self, chunk):
+        """Writes one chunk as a Parquet row group, each column with the sorted dictionary of its values."""
+        pa = self._pa
+        arrays = []
+        for column in POSITION_COLUMNS:
+            data = chunk[column]
+            if column not in self._dictionaries:
+                arrays.append(pa.array(data, type=pa.int64()))
+                continue
+
+            used_codes, local_codes = np.unique(data, return_inverse=True)
+            values = np.array([self._values[column][code] for code in used_codes.tolist()], dtype=str)
+            order = np.argsort(values, kind='stable')
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(rank[local_codes.reshape(-1)], type=pa.int32()), pa.array(values[order], type=pa.string())
+            ))
+        self._parquet_writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def _write_npz(self):
+        """
+        Streams the spilled columns into the .npz archive (same layout as np.savez_compressed):
+        dictionary codes are remapped to the sorted value order and downcast chunk by chunk.
+        """
+        with zipfile.ZipFile(self.output_file, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            with archive.open('format_version.npy', 'w') as entry:
+                np.lib.format.write_array(entry, np.array(NPZ_FORMAT_VERSION))
+
+            for column in POSITION_COLUMNS:
+                spill = self._spills[column]
+                spill.seek(0)
+                if column in self._dictionaries:
+                    values = np.array(self._values[column], dtype=str)
+                    order = np.argsort(values, kind='stable')
+                    remap = np.empty(len(order), dtype=np.int64)
+                    remap[order] = np.arange(len(order), dtype=np.int64)
+                    source_dtype = np.dtype(np.int32)
+                    target_dtype = smallest_code_dtype(np.empty(0, dtype=np.int64), len(values)).dtype
+                    name = f"{column}_codes"
+                else:
+                    remap = None
+                    source_dtype = target_dtype = np.dtype(np.int64)
+                    name = column
+
+                with archive.open(f"{name}.npy", 'w', force_zip64=True) as entry:
+                    np.lib.format.write_array_header_1_0(entry, {
+                        'descr': np.lib.format.dtype_to_descr(target_dtype),
+                        'fortran_order': False,
+                        'shape': (self.rows_written,),
+                    })
+                    while True:
+                        data = np.frombuffer(spill.read(self.chunk_size * source_dtype.itemsize), dtype=source_dtype)
+                        if not len(data):
+                            break
+                        if remap is not None:
+                            data = remap[data]
+                        entry.write(data.astype(target_dtype).tobytes())
+
+                if remap is not None:
+                    with archive.open(f"{column}_values.npy", 'w', force_zip64=True) as entry:
+                        np.lib.format.write_array(entry, values[order])
+
+    def close(self):
+        try:
+            self.flush()
+            if self.output_format == 'npz':
+                self._write_npz()
+        finally:
+            self._release()
+
+    def _release(self):
+        """Closes the Parquet writer or the npz spill files (safe to call more than once)."""
+        if self.output_format == 'parquet':
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+                self._parquet_writer = None
+            return
+        for spill in self._spills.values():
+            spill.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # On error the rows are not written out, but the spill files and Parquet writer are still released
+        try:
+            if exc_type is None:
+                self.close()
+        finally:
+            self._release()
+
+
+def smallest_code_dtype(codes, value_count):
+    """Downcasts dictionary codes to the smallest unsigned integer type able to hold value_count."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if value_count <= np.iinfo(dtype).max:
+            return codes.astype(dtype)
+    return codes.astype(np.int64)
+
+
+def open_positions_writer(output_file, columns=POSITION_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Returns a TSV or columnar (.npz/.parquet) writer depending on the output file extension."""
+    if positions_format(output_file) == 'tsv':
+        return ChunkedTsvWriter(output_file, columns, chunk_size)
+    return ColumnarPositionsWriter(output_file, columns, chunk_size)
+
+
+def positions_output_file(tsv_file, output_format='tsv'):
+    """Derives the positions output name from the k-mer TSV name (<name>_positions.<ext>)."""
+    extension = POSITION_FORMATS[output_format]
+    output_file = tsv_file.replace('.tsv', f'_positions{extension}')
+    if tsv_file == output_file:
+        output_file = f"kmer_positions_results{extension}"
+    return output_file
+
+
+def read_positions(input_file, columns=None):
+    """
+    Loads a positions table (TSV, .npz or .parquet) as a DataFrame with categorical
+    seq/assembly/contig/strand columns (sorted categories) and integer positions. Only the
+    requested columns are decoded; Parquet files are memory-mapped. .npz archives are
+    compressed, so the requested columns are always loaded whole into memory.
+    """
+    columns = list(columns) if columns is not None else POSITION_COLUMNS
+    input_format = positions_format(input_file)
+
+    if input_format == 'npz':
+        data = {}
+        with np.load(input_file, allow_pickle=False) as archive:
+            for column in columns:
+                if column in CATEGORICAL_COLUMNS:
+                    data[column] = pd.Categorical.from_codes(
+                        archive[f"{column}_codes"].astype(np.int64), categories=archive[f"{column}_values"]
+                    )
+                else:
+                    data[column] = archive[column]
+        return pd.DataFrame(data, columns=columns)
+
+    if input_format == 'parquet':
+        try:
+            # Engine used by pd.read_parquet
+            import pyarrow
+        except ImportError as e:
+            print(f"Error: Parquet input requires pyarrow ({e}). Use the .npz format instead.")
+            sys.exit(1)
+        df = pd.read_parquet(input_file, columns=columns, memory_map=True)
+        # Row groups carry their own dictionaries: restore one sorted set of categories per column
+        for column in CATEGORICAL_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+                df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+        return df
+
+    dtypes = {column: 'category' for column in CATEGORICAL_COLUMNS if column in columns}
+    if 'position' in columns:
+        dtypes['position'] = 'int64'
+    return pd.read_csv(input_file, sep='\t', usecols=columns, dtype=dtypes)[columns]
+
+
+def iter_positions(input_file, chunk_rows=DEFAULT_CHUNK_SIZE, columns=None):
+    """
+    Streams a positions table (TSV, .npz or .parquet) as DataFrames of at most chunk_rows rows.
+    Each chunk is indexed by the global row number of its rows in the table. Only one chunk is
+    decoded at a time. Parquet row groups are read one batch at a time; .npz archives are
+    compressed and cannot be memory-mapped, so their integer code columns are loaded whole
+    (the strings are still only decoded chunk by chunk). Use .parquet when that does not fit.
+    """
+    columns = list(columns) if columns is not None else POSITION_COLUMNS
+    chunk_rows = max(1, int(chunk_rows))
+    input_format = positions_format(input_file)
+
+    if input_format == 'npz':
+        with np.load(input_file, allow_pickle=False) as archive:
+            data = {}
+            for column in columns:
+                if column in CATEGORICAL_COLUMNS:
+                    data[column] = (archive[f"{column}_codes"], archive[f"{column}_values"])
+                else:
+                    data[column] = (archive[column], None)
+        row_count = len(data[columns[0]][0]) if columns else 0
+        for start in range(0, row_count, chunk_rows):
+            stop = min(start + chunk_rows, row_count)
+            yield pd.DataFrame({
+                column: values[start:stop] if categories is None
+                else pd.Categorical.from_codes(values[start:stop].astype(np.int64), categories=categories)
+                for column, (values, categories) in data.items()
+            }, columns=columns, index=pd.RangeIndex(start, stop))
+        return
+
+    if input_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            print(f"Error: Parquet input requires pyarrow ({e}). Use the .npz format instead.")
+            sys.exit(1)
+        start = 0
+        for batch in pq.ParquetFile(input_file).iter_batches(batch_size=chunk_rows, columns=columns):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+        return
+
+    dtypes = {column: str for column in CATEGORICAL_COLUMNS if column in columns}
+    if 'position' in columns:
+        dtypes['position'] = 'int64'
+    with pd.read_csv(input_file, sep='\t', usecols=columns, dtype=dtypes, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk[columns]
+
+
+def count_positions(input_file):
+    """
+    Returns the number of rows of a positions table. Columnar files store it; TSV rows are
+    estimated from the file size and the mean length of the first lines.
+    """
+    input_format = positions_format(input_file)
+    if input_format == 'npz':
+        with np.load(input_file, allow_pickle=False) as archive:
+            return len(archive['position'])
+    if input_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            print(f"Error: Parquet input requires pyarrow ({e}). Use the .npz format instead.")
+            sys.exit(1)
+        return pq.ParquetFile(input_file).metadata.num_rows
+
+    with open(input_file, 'rb') as f:
+        f.readline()
+        sample = [len(line) for _, line in zip(range(1000), f)]
+    if not sample:
+        return 0
+    return int(os.path.getsize(input_file) / (sum(sample) / len(sample)))